@@ -3,6 +3,8 @@
 # cat h.json | jq '.Records[] | select((.resources == null) or (any(.resources[].ARN; contains ("arn:aws:s3:::for509trails")) | not))' | jq -n '.Records |= [inputs]'
 
 # This script will read a file or directory tree of JSON Cloudtrail logs and create a parallel structure after filtering out specified records.
+# Note: aws-cloudtrail2sof-elk.py can apply the same kind of filter while converting, without a separate pass, e.g.:
+#   aws-cloudtrail2sof-elk.py -r /path/to/cloudtrail_logs/ --exclude-bucket for509trails --exclude-arn arn:aws:s3:::for509trails
 
 # bash functionality to get command-line parameters
 # source: http://stackoverflow.com/questions/192249/how-do-i-parse-command-line-arguments-in-bash
@@ -0,0 +1,885 @@
+#!/usr/bin/env python3
+# SOF-ELK® Supporting script
+# (C)2026 Lewes Technology Consulting, LLC
+#
+# This script measures the throughput of the SOF-ELK® converter scripts so
+# performance changes can be compared between revisions.  Deterministic
+# synthetic input is generated for each converter at one or more scales, each
+# converter is run against it, and the records/sec, MB/sec, and peak RSS of
+# each run are reported and saved as JSON.
+#
+# The same seed always produces the same input, so results from different
+# revisions (or machines) can be compared with "--compare".  Generated data can
+# be kept between runs with "--data-dir", which avoids generating it again.
+#
+# Usage:
+#   converter-benchmark.py
+#   converter-benchmark.py -s small -s large -b csv2json -w after.json --compare before.json
+#   converter-benchmark.py -s 250000 -j 4 --data-dir /var/tmp/sof-elk-benchmark
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# the converters live in the directory above this one
+script_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+default_seed = 509
+default_scales = ["small", "medium"]
+# the number of records generated for each benchmark at each named scale
+scales = {
+    "small": 10000,
+    "medium": 100000,
+    "large": 1000000,
+}
+base_time = datetime(2025, 1, 10, 8, 0, 0, tzinfo=timezone.utc)
+
+cloudtrail_records_per_file = 500
+cloudtrail_account_id = "123456789012"
+cloudtrail_regions = ["us-east-1", "us-west-2", "eu-west-1"]
+cloudtrail_events = [
+    ("s3.amazonaws.com", "GetObject", True),
+    ("s3.amazonaws.com", "PutObject", False),
+    ("s3.amazonaws.com", "ListBuckets", True),
+    ("ec2.amazonaws.com", "DescribeInstances", True),
+    ("ec2.amazonaws.com", "RunInstances", False),
+    ("iam.amazonaws.com", "CreateAccessKey", False),
+    ("sts.amazonaws.com", "AssumeRole", False),
+    ("signin.amazonaws.com", "ConsoleLogin", False),
+]
+cloudtrail_user_agents = [
+    "aws-cli/2.15.0 Python/3.11.6 Linux/6.5.0 exe/x86_64.ubuntu.22",
+    "Boto3/1.34.0 md/Botocore#1.34.0 ua/2.0 os/linux#6.5.0 md/arch#x86_64 lang/python#3.11.6",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+]
+
+vpcflow_records_per_file = 10000
+vpcflow_interfaces = 8
+vpcflow_header = "version account-id interface-id srcaddr dstaddr srcport dstport protocol packets bytes start end action log-status"
+
+azure_tuples_per_record = 2000
+azure_mac_addresses = ["00224871C205", "00224871C206", "000D3AF87856"]
+azure_ports = [22, 53, 80, 123, 443, 445, 1433, 3389, 8080]
+
+csv_column_count = 40
+volatility_processes = [
+    "System",
+    "smss.exe",
+    "csrss.exe",
+    "wininit.exe",
+    "services.exe",
+    "lsass.exe",
+    "svchost.exe",
+    "explorer.exe",
+    "powershell.exe",
+    "notepad.exe",
+]
+
+
+def random_id(rng, length, alphabet="ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"):
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def random_uuid(rng):
+    return "%08x-%04x-%04x-%04x-%012x" % (
+        rng.getrandbits(32),
+        rng.getrandbits(16),
+        rng.getrandbits(16),
+        rng.getrandbits(16),
+        rng.getrandbits(48),
+    )
+
+
+def random_ip(rng, prefix="10.0"):
+    return f"{prefix}.{rng.randint(0, 15)}.{rng.randint(1, 254)}"
+
+
+def cloudtrail_record(rng, event_time, region):
+    event_source, event_name, read_only = rng.choice(cloudtrail_events)
+    user_name = f"user{rng.randint(1, 40)}"
+    record = {
+        "eventVersion": "1.09",
+        "userIdentity": {
+            "type": "IAMUser",
+            "principalId": "AIDA" + random_id(rng, 17),
+            "arn": f"arn:aws:iam::{cloudtrail_account_id}:user/{user_name}",
+            "accountId": cloudtrail_account_id,
+            "accessKeyId": "AKIA" + random_id(rng, 16),
+            "userName": user_name,
+        },
+        "eventTime": event_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "eventSource": event_source,
+        "eventName": event_name,
+        "awsRegion": region,
+        "sourceIPAddress": random_ip(rng, "198.51"),
+        "userAgent": rng.choice(cloudtrail_user_agents),
+        "requestParameters": None,
+        "responseElements": None,
+        "requestID": random_id(rng, 16),
+        "eventID": random_uuid(rng),
+        "readOnly": read_only,
+        "eventType": "AwsApiCall",
+        "managementEvent": event_source != "s3.amazonaws.com",
+        "recipientAccountId": cloudtrail_account_id,
+        "eventCategory": "Management",
+        "tlsDetails": {
+            "tlsVersion": "TLSv1.3",
+            "cipherSuite": "TLS_AES_128_GCM_SHA256",
+            "clientProvidedHostHeader": f"{event_source.split('.')[0]}.{region}.amazonaws.com",
+        },
+    }
+    if event_source == "s3.amazonaws.com":
+        bucket_name = f"evidence-bucket-{rng.randint(1, 5)}"
+        object_key = f"data/{random_id(rng, 8).lower()}/{rng.randint(1, 99999)}.bin"
+        record["requestParameters"] = {
+            "bucketName": bucket_name,
+            "Host": f"{bucket_name}.s3.{region}.amazonaws.com",
+            "key": object_key,
+        }
+        record["resources"] = [
+            {
+                "type": "AWS::S3::Object",
+                "ARN": f"arn:aws:s3:::{bucket_name}/{object_key}",
+            },
+            {
+                "accountId": cloudtrail_account_id,
+                "type": "AWS::S3::Bucket",
+                "ARN": f"arn:aws:s3:::{bucket_name}",
+            },
+        ]
+        record["eventCategory"] = "Data"
+        record["additionalEventData"] = {
+            "bytesTransferredIn": 0,
+            "bytesTransferredOut": rng.randint(0, 10485760),
+            "x-amz-id-2": random_id(rng, 60),
+        }
+    elif event_name == "RunInstances":
+        record["requestParameters"] = {
+            "instancesSet": {
+                "items": [{"imageId": "ami-" + random_id(rng, 17).lower()}]
+            },
+            "instanceType": rng.choice(["t3.micro", "m5.large", "c6i.xlarge"]),
+        }
+        record["responseElements"] = {
+            "reservationId": "r-" + random_id(rng, 17).lower(),
+            "ownerId": cloudtrail_account_id,
+        }
+    return record
+
+
+def generate_cloudtrail(data_dir, record_count, seed):
+    """
+    Write gzip-compressed CloudTrail files of cloudtrail_records_per_file
+    records each, in the AWSLogs/<account>/CloudTrail/<region>/YYYY/MM/DD/
+    layout used by S3, with the records spread over three days.
+    """
+    rng = random.Random(seed)
+    file_count = -(-record_count // cloudtrail_records_per_file)
+    seconds_per_record = 3 * 86400 / max(record_count, 1)
+
+    for file_number in range(file_count):
+        region = cloudtrail_regions[file_number % len(cloudtrail_regions)]
+        first_record = file_number * cloudtrail_records_per_file
+        last_record = min(first_record + cloudtrail_records_per_file, record_count)
+        file_time = base_time + timedelta(seconds=first_record * seconds_per_record)
+
+        records = [
+            cloudtrail_record(
+                rng,
+                base_time + timedelta(seconds=record_number * seconds_per_record),
+                region,
+            )
+            for record_number in range(first_record, last_record)
+        ]
+
+        file_dir = os.path.join(
+            data_dir,
+            "AWSLogs",
+            cloudtrail_account_id,
+            "CloudTrail",
+            region,
+            file_time.strftime("%Y/%m/%d"),
+        )
+        os.makedirs(file_dir, exist_ok=True)
+        file_name = f"{cloudtrail_account_id}_CloudTrail_{region}_{file_time.strftime('%Y%m%dT%H%MZ')}_{random_id(rng, 16)}.json.gz"
+        with gzip.open(os.path.join(file_dir, file_name), "wt", compresslevel=6) as f:
+            f.write(json.dumps({"Records": records}))
+
+    return data_dir
+
+
+def generate_vpcflow(data_dir, record_count, seed):
+    """
+    Write gzip-compressed plain text VPC Flow log files of
+    vpcflow_records_per_file records each, in the
+    AWSLogs/<account>/vpcflowlogs/<region>/YYYY/MM/DD/ layout used by S3, with
+    the records spread over three days.
+    """
+    rng = random.Random(seed)
+    interface_ids = [
+        f"eni-{rng.getrandbits(68):017x}" for _ in range(vpcflow_interfaces)
+    ]
+    file_count = -(-record_count // vpcflow_records_per_file)
+    seconds_per_record = 3 * 86400 / max(record_count, 1)
+    start_epoch = int(base_time.timestamp())
+
+    for file_number in range(file_count):
+        region = cloudtrail_regions[file_number % len(cloudtrail_regions)]
+        first_record = file_number * vpcflow_records_per_file
+        last_record = min(first_record + vpcflow_records_per_file, record_count)
+        file_time = base_time + timedelta(seconds=first_record * seconds_per_record)
+
+        lines = [vpcflow_header]
+        for record_number in range(first_record, last_record):
+            start = start_epoch + int(record_number * seconds_per_record)
+            packets = rng.randint(1, 500)
+            lines.append(
+                f"2 {cloudtrail_account_id} {rng.choice(interface_ids)}"
+                f" {random_ip(rng)} {random_ip(rng, '172.16')}"
+                f" {rng.randint(1024, 65535)} {rng.choice(azure_ports)} 6"
+                f" {packets} {packets * rng.randint(40, 1500)} {start} {start + 60}"
+                f" {'REJECT' if rng.random() < 0.1 else 'ACCEPT'} OK"
+            )
+
+        file_dir = os.path.join(
+            data_dir,
+            "AWSLogs",
+            cloudtrail_account_id,
+            "vpcflowlogs",
+            region,
+            file_time.strftime("%Y/%m/%d"),
+        )
+        os.makedirs(file_dir, exist_ok=True)
+        file_name = f"{cloudtrail_account_id}_vpcflowlogs_{region}_fl-{rng.getrandbits(68):017x}_{file_time.strftime('%Y%m%dT%H%MZ')}_{rng.getrandbits(32):08x}.log.gz"
+        with gzip.open(os.path.join(file_dir, file_name), "wt", compresslevel=6) as f:
+            f.write("\n".join(lines))
+            f.write("\n")
+
+    return data_dir
+
+
+def azure_flow_path(data_dir, hour, mac_address):
+    flow_time = base_time + timedelta(hours=hour)
+    return os.path.join(
+        data_dir,
+        flow_time.strftime("y=%Y/m=%m/d=%d/h=%H/m=00"),
+        f"macAddress={mac_address}",
+        "PT1H.json",
+    )
+
+
+def write_azure_flow_logs(data_dir, record_count, seed, make_tuple, make_record):
+    """
+    Write three hours of Azure flow logs, one PT1H.json per hour and MAC
+    address, in the blob layout Azure uses.  Each flow is seen once per hour:
+    it begins in the first hour, continues in the second, and ends in the
+    third.  make_tuple(rng, flow, hour) builds one flowtuple string and
+    make_record(mac_address, flowtuples) one record.
+    """
+    flow_count = max(1, record_count // 3)
+    for hour in range(3):
+        # the flows are drawn from the same sequence in every hour, while the
+        # counters for each hour come from a sequence of their own
+        flow_rng = random.Random(seed)
+        tuple_rng = random.Random(seed * 10 + hour)
+
+        output_files = {}
+        pending_tuples = {}
+        try:
+            for mac_address in azure_mac_addresses:
+                flow_path = azure_flow_path(data_dir, hour, mac_address)
+                os.makedirs(os.path.dirname(flow_path), exist_ok=True)
+                output_files[mac_address] = open(flow_path, "w")
+                output_files[mac_address].write('{"records":[')
+                pending_tuples[mac_address] = []
+
+            records_written = dict.fromkeys(azure_mac_addresses, 0)
+
+            def write_record(mac_address):
+                if records_written[mac_address]:
+                    output_files[mac_address].write(",")
+                output_files[mac_address].write(
+                    json.dumps(make_record(mac_address, pending_tuples[mac_address]))
+                )
+                records_written[mac_address] += 1
+                pending_tuples[mac_address] = []
+
+            for flow_number in range(flow_count):
+                flow = {
+                    "time": int(base_time.timestamp())
+                    + flow_number * 3600 // flow_count,
+                    "source_ip": random_ip(flow_rng),
+                    "destination_ip": random_ip(flow_rng),
+                    "source_port": flow_rng.randint(1024, 65535),
+                    "destination_port": flow_rng.choice(azure_ports),
+                    "protocol": flow_rng.choice("66666U"),
+                    "direction": flow_rng.choice("IO"),
+                }
+                mac_address = azure_mac_addresses[
+                    flow_number % len(azure_mac_addresses)
+                ]
+                pending_tuples[mac_address].append(make_tuple(tuple_rng, flow, hour))
+                if len(pending_tuples[mac_address]) >= azure_tuples_per_record:
+                    write_record(mac_address)
+
+            for mac_address in azure_mac_addresses:
+                if pending_tuples[mac_address] or not records_written[mac_address]:
+                    write_record(mac_address)
+                output_files[mac_address].write("]}\n")
+
+        finally:
+            for output_file in output_files.values():
+                output_file.close()
+
+    return data_dir
+
+
+def generate_azure_vnet(data_dir, record_count, seed):
+    """Write Virtual Network flow logs (flowLogVersion 4, millisecond timestamps)."""
+
+    def make_tuple(rng, flow, hour):
+        flow_state = "BCE"[hour]
+        if hour == 2 and rng.random() < 0.1:
+            flow_state = "D"
+        if flow_state == "B":
+            counters = "0,0,0,0"
+        else:
+            counters = f"{rng.randint(1, 500)},{rng.randint(60, 500000)},{rng.randint(1, 500)},{rng.randint(60, 500000)}"
+        protocol = "17" if flow["protocol"] == "U" else "6"
+        return (
+            f"{(flow['time'] + hour * 3600) * 1000},{flow['source_ip']},{flow['destination_ip']},"
+            f"{flow['source_port']},{flow['destination_port']},{protocol},{flow['direction']},"
+            f"{flow_state},{rng.choice(['X', 'NX', 'NX_HW_NOT_SUPPORTED'])},{counters}"
+        )
+
+    def make_record(mac_address, flowtuples):
+        return {
+            "time": base_time.strftime("%Y-%m-%dT%H:%M:%S.0000000Z"),
+            "flowLogVersion": 4,
+            "flowLogGUID": "66aa66aa-bb77-cc88-dd99-00ee00ee00ee",
+            "macAddress": mac_address,
+            "category": "FlowLogFlowEvent",
+            "flowLogResourceID": "/SUBSCRIPTIONS/00000000-0000-0000-0000-000000000000/RESOURCEGROUPS/NETWORKWATCHERRG/PROVIDERS/MICROSOFT.NETWORK/NETWORKWATCHERS/NETWORKWATCHER_EASTUS/FLOWLOGS/VNETFLOWLOG",
+            "targetResourceID": "/subscriptions/00000000-0000-0000-0000-000000000000/resourceGroups/evidence/providers/Microsoft.Network/virtualNetworks/evidence-vnet",
+            "operationName": "FlowLogFlowEvent",
+            "flowRecords": {
+                "flows": [
+                    {
+                        "aclID": "00000000-1111-2222-3333-444444444444",
+                        "flowGroups": [
+                            {
+                                "rule": "DefaultRule_AllowInternetOutBound",
+                                "flowTuples": flowtuples,
+                            }
+                        ],
+                    }
+                ]
+            },
+        }
+
+    return write_azure_flow_logs(data_dir, record_count, seed, make_tuple, make_record)
+
+
+def generate_azure_nsg(data_dir, record_count, seed):
+    """Write legacy Network Security Group flow logs (Version 2, second timestamps)."""
+
+    def make_tuple(rng, flow, hour):
+        flow_state = "BCE"[hour]
+        if flow_state == "B":
+            counters = ",,,"
+        else:
+            counters = f"{rng.randint(1, 500)},{rng.randint(60, 500000)},{rng.randint(1, 500)},{rng.randint(60, 500000)}"
+        protocol = "U" if flow["protocol"] == "U" else "T"
+        return (
+            f"{flow['time'] + hour * 3600},{flow['source_ip']},{flow['destination_ip']},"
+            f"{flow['source_port']},{flow['destination_port']},{protocol},{flow['direction']},"
+            f"A,{flow_state},{counters}"
+        )
+
+    def make_record(mac_address, flowtuples):
+        return {
+            "time": base_time.strftime("%Y-%m-%dT%H:%M:%S.0000000Z"),
+            "systemId": "11bb11bb-cc22-dd33-ee44-55ff55ff55ff",
+            "macAddress": mac_address,
+            "category": "NetworkSecurityGroupFlowEvent",
+            "resourceId": "/SUBSCRIPTIONS/00000000-0000-0000-0000-000000000000/RESOURCEGROUPS/EVIDENCE/PROVIDERS/MICROSOFT.NETWORK/NETWORKSECURITYGROUPS/EVIDENCE-NSG",
+            "operationName": "NetworkSecurityGroupFlowEvents",
+            "properties": {
+                "Version": 2,
+                "flows": [
+                    {
+                        "rule": "DefaultRule_AllowInternetOutBound",
+                        "flows": [{"mac": mac_address, "flowTuples": flowtuples}],
+                    }
+                ],
+            },
+        }
+
+    return write_azure_flow_logs(data_dir, record_count, seed, make_tuple, make_record)
+
+
+def csv_cell(rng, column, row_number):
+    """Return one cell of the wide CSV file, whose type depends on its column."""
+    column_type = column % 8
+    if column_type == 0:
+        return str(rng.randint(0, 100000))
+    elif column_type == 1:
+        return repr(rng.random() * 1000)
+    elif column_type == 2:
+        return rng.choice(["True", "False"])
+    elif column_type == 3:
+        return (base_time + timedelta(seconds=row_number)).strftime(
+            "%Y-%m-%d %H:%M:%S.%f"
+        )
+    elif column_type == 4:
+        # mostly empty, as many tool exports are
+        return "" if rng.random() < 0.8 else random_id(rng, 12)
+    elif column_type == 5:
+        return f"C:\\Users\\user{rng.randint(1, 20)}\\AppData\\Local\\Temp\\{random_id(rng, 8)}.tmp"
+    elif column_type == 6:
+        # needs quoting
+        return f'{random_id(rng, 6)}, "{random_id(rng, 4)}"'
+    return f"0x{rng.getrandbits(32):08X}"
+
+
+def generate_wide_csv(data_dir, record_count, seed):
+    """Write a CSV file with csv_column_count columns of mixed types, as from a tool export."""
+    rng = random.Random(seed)
+    csv_filename = os.path.join(data_dir, "wide.csv")
+    with open(csv_filename, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(
+            [f"Column {column} Value" for column in range(csv_column_count)]
+        )
+        for row_number in range(record_count):
+            writer.writerow(
+                [
+                    csv_cell(rng, column, row_number)
+                    for column in range(csv_column_count)
+                ]
+            )
+    return csv_filename
+
+
+def generate_volatility(data_dir, record_count, seed):
+    """
+    Write Volatility 3 windows.pslist JSONL output as PowerShell redirection
+    creates it: UTF-16 LE with a BOM and CRLF line endings.
+    """
+    rng = random.Random(seed)
+    volatility_filename = os.path.join(data_dir, "windows.pslist.json")
+    with open(
+        volatility_filename, "w", encoding="utf-16", newline="\r\n"
+    ) as volatility_file:
+        for record_number in range(record_count):
+            create_time = base_time + timedelta(seconds=record_number)
+            record = {
+                "PID": record_number * 4,
+                "PPID": rng.randint(0, record_number) * 4,
+                "ImageFileName": rng.choice(volatility_processes),
+                "Offset(V)": 0xFFFF800000000000 + rng.getrandbits(40),
+                "Threads": rng.randint(1, 200),
+                "Handles": rng.randint(0, 5000),
+                "SessionId": rng.choice([None, 0, 1, 2]),
+                "Wow64": rng.random() < 0.1,
+                "CreateTime": create_time.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+                "ExitTime": None,
+                "File output": "Disabled",
+                "__children": [],
+            }
+            volatility_file.write(json.dumps(record))
+            volatility_file.write("\n")
+    return volatility_filename
+
+
+def converter_command(script_name, *arguments):
+    return [sys.executable, os.path.join(script_dir, script_name), *arguments]
+
+
+def cloudtrail_command(input_path, output_dir, jobs):
+    return converter_command(
+        "aws-cloudtrail2sof-elk.py",
+        "-r",
+        input_path,
+        "-o",
+        os.path.join(output_dir, "aws"),
+        "-f",
+        "-j",
+        str(jobs),
+    )
+
+
+def vpcflow_command(input_path, output_dir, jobs):
+    return converter_command(
+        "aws-vpcflow2sof-elk.py",
+        "-r",
+        input_path,
+        "-w",
+        os.path.join(output_dir, "vpcflow.txt"),
+        "-f",
+        "-j",
+        str(jobs),
+    )
+
+
+def azure_command(input_path, output_dir, jobs):
+    return converter_command(
+        "azure-flow2sof-elk.py",
+        "-r",
+        input_path,
+        "-w",
+        os.path.join(output_dir, "azure.csv"),
+        "-f",
+        "-j",
+        str(jobs),
+    )
+
+
+def csv2json_command(input_path, output_dir, jobs):
+    return converter_command(
+        "csv2json.py",
+        "-r",
+        input_path,
+        "-w",
+        os.path.join(output_dir, "wide.json"),
+        "-j",
+        str(jobs),
+    )
+
+
+def volatility_command(input_path, output_dir, jobs):
+    # a single file is always converted by one process
+    return converter_command(
+        "volatility2sof-elk.py",
+        "-r",
+        input_path,
+        "-w",
+        os.path.join(output_dir, "windows.pslist.json"),
+    )
+
+
+# benchmark name: (input generator, converter command)
+benchmarks = {
+    "cloudtrail": (generate_cloudtrail, cloudtrail_command),
+    "vpcflow": (generate_vpcflow, vpcflow_command),
+    "azure-vnet": (generate_azure_vnet, azure_command),
+    "azure-nsg": (generate_azure_nsg, azure_command),
+    "csv2json": (generate_wide_csv, csv2json_command),
+    "volatility": (generate_volatility, volatility_command),
+}
+
+
+def path_size(path):
+    """Return the total size of a file, or of every file in a directory tree."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total_size += os.path.getsize(os.path.join(root, name))
+    return total_size
+
+
+def scale_record_count(scale):
+    if scale in scales:
+        return scales[scale]
+    return int(scale)
+
+
+def prepare_input(benchmark, scale, seed, data_dir):
+    """
+    Generate the input for one benchmark at one scale, or reuse it if it was
+    already generated in data_dir.  Returns the path to pass to the converter.
+    """
+    generate, _ = benchmarks[benchmark]
+    input_dir = os.path.join(
+        data_dir, f"{benchmark}-{scale_record_count(scale)}-{seed}"
+    )
+    # the marker sits beside the input, where the converters will not read it
+    marker_filename = input_dir + ".input-path"
+
+    if os.path.exists(marker_filename):
+        with open(marker_filename) as marker_file:
+            return os.path.join(input_dir, marker_file.read().strip())
+
+    if os.path.exists(input_dir):
+        shutil.rmtree(input_dir)
+    os.makedirs(input_dir)
+    input_path = generate(input_dir, scale_record_count(scale), seed)
+
+    # the marker is written last, so a partly generated input is never reused
+    with open(marker_filename, "w") as marker_file:
+        marker_file.write(os.path.relpath(input_path, input_dir))
+    return input_path
+
+
+def run_converter(command, log_filename):
+    """
+    Run one converter to completion.  Returns a tuple of (exit status, elapsed
+    seconds, peak RSS in KB).  The peak RSS is that of the converter or of the
+    largest worker process it started, whichever is larger.
+    """
+    with open(log_filename, "w") as log_file:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(
+            command, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL
+        )
+        # wait4() reports the resource use of this one child (and the workers
+        # it waited for), unlike getrusage(RUSAGE_CHILDREN)
+        _, wait_status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    return process.returncode, elapsed, usage.ru_maxrss
+
+
+def run_benchmark(benchmark, scale, seed, jobs, repeat, data_dir, work_dir):
+    """Run one benchmark at one scale repeat times and return its result, using the fastest run."""
+    _, make_command = benchmarks[benchmark]
+    record_count = scale_record_count(scale)
+
+    generate_start = time.perf_counter()
+    input_path = prepare_input(benchmark, scale, seed, data_dir)
+    generate_time = time.perf_counter() - generate_start
+    input_bytes = path_size(input_path)
+
+    runs = []
+    for run_number in range(repeat):
+        output_dir = os.path.join(work_dir, f"{benchmark}-{record_count}-{run_number}")
+        os.makedirs(output_dir)
+        log_filename = os.path.join(
+            work_dir, f"{benchmark}-{record_count}-{run_number}.log"
+        )
+
+        exit_status, elapsed, peak_rss_kb = run_converter(
+            make_command(input_path, output_dir, jobs), log_filename
+        )
+        runs.append(
+            {
+                "exit_status": exit_status,
+                "elapsed": round(elapsed, 4),
+                "peak_rss_kb": peak_rss_kb,
+                "output_bytes": path_size(output_dir),
+            }
+        )
+        shutil.rmtree(output_dir)
+
+        if exit_status != 0:
+            with open(log_filename, errors="replace") as log_file:
+                log_tail = log_file.read()[-2000:]
+            sys.stderr.write(
+                f"ERROR: {benchmark} at scale {scale} exited with status {exit_status}:\n{log_tail}\n"
+            )
+            break
+
+    best_run = min(runs, key=lambda run: (run["exit_status"] != 0, run["elapsed"]))
+    elapsed = max(best_run["elapsed"], 0.000001)
+    return {
+        "benchmark": benchmark,
+        "scale": scale,
+        "records": record_count,
+        "input_bytes": input_bytes,
+        "output_bytes": best_run["output_bytes"],
+        "elapsed": best_run["elapsed"],
+        "records_per_sec": round(record_count / elapsed, 1),
+        "mb_per_sec": round(input_bytes / 1048576 / elapsed, 3),
+        "peak_rss_kb": best_run["peak_rss_kb"],
+        "exit_status": best_run["exit_status"],
+        "generate_time": round(generate_time, 3),
+        "runs": runs,
+    }
+
+
+def git_revision():
+    """Return the git commit the converters were run from, or None."""
+    try:
+        result = subprocess.run(
+            ["git", "-C", script_dir, "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def format_result(result):
+    return (
+        f"{result['benchmark']:<12} {result['records']:>9} records {result['input_bytes'] / 1048576:>9.1f} MB"
+        f" {result['elapsed']:>9.2f}s {result['records_per_sec']:>11.0f} records/s"
+        f" {result['mb_per_sec']:>8.2f} MB/s {result['peak_rss_kb'] / 1024:>8.1f} MB peak RSS"
+    )
+
+
+def compare_results(results, previous):
+    """Print the change in throughput and peak RSS from a previous results file."""
+    previous_results = {
+        (result["benchmark"], result["records"]): result
+        for result in previous["results"]
+    }
+    print()
+    print(f"Compared with {previous.get('revision') or 'previous results'}:")
+    for result in results:
+        previous_result = previous_results.get((result["benchmark"], result["records"]))
+        if previous_result is None or previous_result["records_per_sec"] <= 0:
+            continue
+        speed_change = (
+            result["records_per_sec"] / previous_result["records_per_sec"] - 1
+        ) * 100
+        rss_change = (
+            result["peak_rss_kb"] / max(previous_result["peak_rss_kb"], 1) - 1
+        ) * 100
+        print(
+            f"{result['benchmark']:<12} {result['records']:>9} records"
+            f" {speed_change:>+8.1f}% records/s {rss_change:>+8.1f}% peak RSS"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the SOF-ELK(R) converter scripts against deterministic synthetic input."
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        dest="benchmarks",
+        help=f"Benchmark to run.  Can be used multiple times. (Default: all of {', '.join(benchmarks)})",
+        choices=list(benchmarks),
+        action="append",
+    )
+    parser.add_argument(
+        "-s",
+        "--scale",
+        dest="scales",
+        help=f"Input scale: {', '.join(f'{name} ({count} records)' for name, count in scales.items())}, or a number of records.  Can be used multiple times. (Default: {', '.join(default_scales)})",
+        action="append",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="Number of worker processes for the converters that support them.  Use 0 for one per CPU. (Default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-n",
+        "--repeat",
+        dest="repeat",
+        help="Number of times to run each benchmark.  The fastest run is reported. (Default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        help=f"Seed for the synthetic input.  Only results from the same seed are comparable. (Default: {default_seed})",
+        type=int,
+        default=default_seed,
+    )
+    parser.add_argument(
+        "--data-dir",
+        dest="data_dir",
+        help="Directory to keep generated input in, so later runs can reuse it. (Default: a temporary directory)",
+    )
+    parser.add_argument(
+        "-w",
+        "--write",
+        dest="outfile",
+        help="JSON file to save the results to. (Default: converter-benchmark-<revision>.json)",
+    )
+    parser.add_argument(
+        "--compare",
+        dest="compare",
+        help="Results file from an earlier run to compare these results with.",
+    )
+    args = parser.parse_args()
+
+    selected_benchmarks = args.benchmarks or list(benchmarks)
+    selected_scales = args.scales or default_scales
+    for scale in selected_scales:
+        try:
+            if scale_record_count(scale) < 1:
+                raise ValueError
+        except ValueError:
+            sys.stderr.write(
+                f"ERROR: Scale {scale} is not one of {', '.join(scales)} or a positive number of records.\n"
+            )
+            sys.exit(2)
+
+    if args.jobs < 0:
+        sys.stderr.write("ERROR: The number of jobs cannot be negative.\n")
+        sys.exit(2)
+    if args.repeat < 1:
+        sys.stderr.write("ERROR: Each benchmark must be run at least once.\n")
+        sys.exit(2)
+
+    previous = None
+    if args.compare:
+        try:
+            with open(args.compare) as compare_file:
+                previous = json.load(compare_file)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(
+                f"ERROR: Could not read results from {args.compare} ({e}).\n"
+            )
+            sys.exit(2)
+
+    revision = git_revision()
+    outfile = args.outfile or f"converter-benchmark-{revision or 'unknown'}.json"
+
+    report = {
+        "created": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "jobs": args.jobs,
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="sof-elk-benchmark-") as work_dir:
+        data_dir = args.data_dir or os.path.join(work_dir, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        run_dir = os.path.join(work_dir, "runs")
+        os.makedirs(run_dir)
+
+        for scale in selected_scales:
+            for benchmark in selected_benchmarks:
+                result = run_benchmark(
+                    benchmark,
+                    scale,
+                    args.seed,
+                    args.jobs,
+                    args.repeat,
+                    data_dir,
+                    run_dir,
+                )
+                report["results"].append(result)
+                print(format_result(result), flush=True)
+
+    with open(outfile, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+        results_file.write("\n")
+    print(f"Results saved to {outfile}")
+
+    if previous is not None:
+        compare_results(report["results"], previous)
+
+    if any(result["exit_status"] != 0 for result in report["results"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
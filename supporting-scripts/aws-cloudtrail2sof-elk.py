@@ -4,22 +4,35 @@
 # Updated Jan 2025 by GH user @za to refactor into a date-hashed directory tree
 #
 # This script will recursively read a file or directory tree of JSON AWS
-# Cloudtrail logs and output in a format that SOF-ELK® can read.  Both gzipped
-# and native JSON is supported.
+# Cloudtrail logs and output in a format that SOF-ELK® can read.  Both native
+# JSON and JSON compressed with gzip, bzip2, xz, or zstd is supported.
 # Assumes the filename contains a date in the format YYYYMMDD, such as:
 #  123456789012_CloudTrail_us-east-1_20250110T0805Z_Ba3uiALBNRSB1c4v.json.gz
+# Use "--stats" to report throughput and the time spent in each phase of the
+# conversion, or "--profile" to profile it.
 
 import argparse
-import gzip
-import json
+import hashlib
+import math
+import multiprocessing
 import os
+import pickle
 import re
+import signal
+import sqlite3
+import struct
 import sys
+import tempfile
 
 
-from datetime import datetime
-from collections import defaultdict
+from datetime import datetime, timezone
+from collections import defaultdict, OrderedDict
 
+import sof_elk_io
+import sof_elk_json
+import sof_elk_stats
+from sof_elk_json import JSONStream
+from sof_elk_stats import stats
 
 default_destdir = os.path.join(os.sep, "logstash", "aws")
 
@@ -27,32 +40,163 @@ filename_regex_string = "(?P<account_id>\\d{12})_CloudTrail_(?P<region_name>[A-Z
 filename_regex = re.compile(filename_regex_string)
 
 
-def process_cloudtrail_file(infile):
+read_chunk_size = 1024 * 1024
+default_max_open_files = 64
+output_buffer_size = 1024 * 1024
+output_compresslevel = 6
+# a worker returns the records of an input file to the writer in chunks of
+# about this many characters, and spools them to a temporary file rather than
+# holding more than max_result_chunks chunks in memory
+result_chunk_size = 1024 * 1024
+max_result_chunks = 8
+manifest_commit_interval = 256
+default_dedup_capacity = 10000000
+dedup_false_positive_rate = 0.01
+dedup_batch_size = 10000
+
+# record fields that can be used to include or exclude records, by option name
+filter_fields = {
+    "source": "eventSource",
+    "event": "eventName",
+    "bucket": "requestParameters.bucketName",
+    "arn": "resources[].ARN",
+}
+
+
+def iter_records_array(stream):
     """
-    Process a single CloudTrail log file and return its records.
+    Walk a top-level JSON object and yield each element of its "Records" array.
+    All other top-level values are decoded and discarded.  Returns True if a
+    "Records" array was found.
     """
-    records = []
+    found_records = False
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return found_records
+
+    while True:
+        key = stream.decode()
+        stream.expect(":")
+
+        if key == "Records" and stream.peek() == "[":
+            found_records = True
+            stream.expect("[")
 
-    # Determine if this is a gzip file
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.decode()
+                    if stream.peek() == ",":
+                        stream.pos += 1
+                        continue
+                    stream.expect("]")
+                    break
+
+        else:
+            stream.decode()
+
+        if stream.peek() == ",":
+            stream.pos += 1
+            continue
+        stream.expect("}")
+        break
+
+    return found_records
+
+
+def process_cloudtrail_file(infile):
+    """
+    Process a single CloudTrail log file and yield its records one at a time.
+    Files of moderate size are decoded in one pass, while the "Records" array
+    of larger ones is decoded incrementally, so memory use stays flat
+    regardless of the size of the input file.  Returns True if the whole file
+    was converted, or False if it could not be read or did not hold CloudTrail
+    records (any records ahead of an error are still yielded).
+    """
     try:
-        with gzip.open(infile, "rt") as input_file:
-            rawjson = json.load(input_file)
-    except OSError:
-        with open(infile, "r") as input_file:
-            rawjson = json.load(input_file)
-    except json.decoder.JSONDecodeError:
-        sys.stderr.write(
-            f"- ERROR: Could not process JSON from {infile}. Skipping file.\n"
-        )
-        return records
+        input_file = sof_elk_io.open_input(infile)
+    except OSError as e:
+        sys.stderr.write(f"- ERROR: Could not open {infile} ({e}). Skipping file.\n")
+        return False
+
+    with input_file:
+        try:
+            stream = JSONStream(input_file)
+
+            if stream.peek() != "{":
+                found_records = False
+            else:
+                try:
+                    with stats.phase("decode"):
+                        document = stream.read_document()
+                except sof_elk_json.JSONDecodeError:
+                    # walk the file to recover the records ahead of the error
+                    document = None
+
+                if document is None:
+                    found_records = yield from stats.timed(
+                        iter_records_array(stream), "decode"
+                    )
+                else:
+                    records = document.get("Records")
+                    found_records = isinstance(records, list)
+                    if found_records:
+                        yield from records
 
-    if "Records" not in rawjson:
+        except (sof_elk_json.JSONDecodeError, UnicodeDecodeError, EOFError, OSError):
+            sys.stderr.write(
+                f"- ERROR: Could not process JSON from {infile}. Skipping file.\n"
+            )
+            return False
+
+    if not found_records:
         sys.stderr.write(
             f"- ERROR: Input file {infile} does not appear to contain AWS CloudTrail records. Skipping file.\n"
         )
-        return records
+    return found_records
+
+
+class GeneratorResult:
+    """
+    Iterate over a generator, keeping the value it returns in .value and the
+    number of items it yielded in .count.
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.value = None
+        self.count = 0
 
-    return rawjson["Records"]
+    def __iter__(self):
+        generator = self.generator
+        while True:
+            try:
+                item = next(generator)
+            except StopIteration as e:
+                self.value = e.value
+                return
+            self.count += 1
+            yield item
+
+
+def file_converted(infile, records):
+    """
+    Return True if the records from process_cloudtrail_file(), wrapped in a
+    GeneratorResult, count as a converted file.  A file with an error counts
+    if records were read ahead of the error, because those were written, and
+    reading the file again would write them a second time.
+    """
+    if records.value:
+        return True
+    if records.count:
+        sys.stderr.write(
+            f"- WARNING: Kept the {records.count} records read from {infile} before the error. The file is treated as converted.\n"
+        )
+        return True
+    return False
 
 
 def derive_output_file(infile):
@@ -84,106 +228,953 @@ def derive_output_file(infile):
     return output_file
 
 
-parser = argparse.ArgumentParser(
-    description="Process AWS CloudTrail logs into daily-based output files."
-)
-parser.add_argument(
-    "-r",
-    "--read",
-    dest="input",
-    required=True,
-    help="AWS CloudTrail log file or directory to read.",
-)
-parser.add_argument(
-    "-o",
-    "--output",
-    dest="outdir",
-    help='Base directory to store processed daily output files (default: "processed-logs-json").',
-)
-parser.add_argument(
-    "-f",
-    "--force",
-    dest="force_outfile",
-    help=f"Force creating an output file in a location other than the default SOF-ELK ingest location, {default_destdir}",
-    default=False,
-    action="store_true",
-)
-parser.add_argument(
-    "-a",
-    "--append",
-    dest="append",
-    help="Append to the output file if it exists.",
-    default=False,
-    action="store_true",
-)
-parser.add_argument(
-    "-v",
-    "--verbose",
-    dest="verbose",
-    action="store_true",
-    help="Display progress and status information.",
-)
-args = parser.parse_args()
-args.input = os.path.expanduser(args.input)
-args.outdir = os.path.expanduser(args.outdir)
-
-if not args.outdir.startswith(default_destdir) and not args.force_outfile:
-    sys.stderr.write(
-        f'ERROR: Output location is not in {default_destdir}, which is the SOF-ELK ingest location. Use "-f" to force creating a file in this location.\n'
-    )
-    sys.exit(2)
-
-if (
-    os.path.exists(args.outdir)
-    and not (args.outdir == default_destdir)
-    and not args.append
+def utc_timestamp(value):
+    """
+    Parse an ISO 8601 date or date/time into the format CloudTrail uses for
+    eventTime, so the two can be compared as strings.  Times without a zone
+    are assumed to be UTC.
+    """
+    timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class RecordFilter:
+    """
+    Include/exclude predicates applied to each CloudTrail record as it is
+    decoded, so unwanted records are never written.  include and exclude map a
+    field name from filter_fields to a list of values.  A record is kept only if
+    it matches at least one value for every include field, matches no exclude
+    field, and has an eventTime within [start_time, end_time).  ARNs match by
+    prefix so a bucket ARN also matches the objects within it.
+    """
+
+    def __init__(self, include=None, exclude=None, start_time=None, end_time=None):
+        self.include = {
+            field: set(values) for field, values in (include or {}).items() if values
+        }
+        self.exclude = {
+            field: set(values) for field, values in (exclude or {}).items() if values
+        }
+        self.start_time = start_time
+        self.end_time = end_time
+        self.active = bool(self.include or self.exclude or start_time or end_time)
+
+    @staticmethod
+    def field_values(record, field):
+        if field == "resources[].ARN":
+            resources = record.get("resources")
+            if not isinstance(resources, list):
+                return ()
+            return tuple(
+                resource.get("ARN")
+                for resource in resources
+                if isinstance(resource, dict)
+            )
+
+        elif field == "requestParameters.bucketName":
+            request_parameters = record.get("requestParameters")
+            if not isinstance(request_parameters, dict):
+                return ()
+            return (request_parameters.get("bucketName"),)
+
+        return (record.get(field),)
+
+    def field_matches(self, record, field, values):
+        for value in self.field_values(record, field):
+            if not isinstance(value, str):
+                continue
+            if field == "resources[].ARN":
+                if any(value.startswith(arn) for arn in values):
+                    return True
+            elif value in values:
+                return True
+        return False
+
+    def matches(self, record):
+        if not isinstance(record, dict):
+            return False
+
+        if self.start_time or self.end_time:
+            event_time = record.get("eventTime")
+            if not isinstance(event_time, str):
+                return False
+            if self.start_time and event_time < self.start_time:
+                return False
+            if self.end_time and event_time >= self.end_time:
+                return False
+
+        for field, values in self.include.items():
+            if not self.field_matches(record, field, values):
+                return False
+
+        for field, values in self.exclude.items():
+            if self.field_matches(record, field, values):
+                return False
+
+        return True
+
+
+# the filter in effect for this process, whether to return each record's
+# eventID for de-duplication, and where workers spool large results - set in
+# main() and in each worker
+record_filter = RecordFilter()
+collect_event_ids = False
+spool_dir = None
+
+
+def set_conversion_options(
+    new_record_filter, new_collect_event_ids, new_spool_dir=None
 ):
-    sys.stderr.write(
-        f'ERROR: Output directory {args.outdir} already exists.  Use "-a" to append to any existing output in this location.\n'
-    )
-    sys.exit(3)
-
-input_files = []
-if os.path.isfile(args.input):
-    input_files.append(args.input)
-elif os.path.isdir(args.input):
-    for root, _, files in os.walk(args.input):
-        for name in files:
-            input_files.append(os.path.join(root, name))
-else:
-    sys.stderr.write("No input files could be processed. Exiting.\n")
-    sys.exit(4)
-
-if args.verbose:
-    print(f"Found {len(input_files)} files to parse.")
-
-for idx, infile in enumerate(input_files, 1):
-    if args.verbose:
-        print(f"- Parsing file: {infile} ({idx} of {len(input_files)})")
+    global record_filter, collect_event_ids, spool_dir
+    record_filter = new_record_filter
+    collect_event_ids = new_collect_event_ids
+    spool_dir = new_spool_dir
+
+
+def init_worker(*conversion_options):
+    # ctrl-c is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_conversion_options(*conversion_options)
+
+
+def record_event_id(record):
+    """Return the eventID of a record, or None if it does not have one."""
+    if isinstance(record, dict):
+        event_id = record.get("eventID")
+        if isinstance(event_id, str):
+            return event_id
+    return None
+
+
+def convert_cloudtrail_file(infile):
+    """
+    Read a single CloudTrail log file and serialize its records for output.
+    Returns a tuple of ((output_file, chunks, spool_file, filtered_count,
+    converted), worker_stats).  The records are split into chunks, each a
+    tuple of (serialized_records, event_ids), where serialized_records is a
+    list of newline-terminated JSON lines and event_ids is the matching list of
+    eventIDs if collect_event_ids is set, or None.  Once a file produces more
+    than max_result_chunks chunks, all of them are written to spool_file
+    instead and chunks is empty, so no worker holds more than that much of a
+    file in memory.  converted is the result of file_converted(), and
+    worker_stats holds this process's
+    statistics for the file.  This is the unit of work handed to each worker
+    process when running with multiple jobs, so only complete lines are ever
+    returned to the writer.
+    """
+    output_file = derive_output_file(infile)
+
+    chunks = []
+    spool_file = None
+    spool_fh = None
+    serialized_records = []
+    event_ids = [] if collect_event_ids else None
+    chunk_size = 0
+    filtered_count = 0
+
+    def end_chunk():
+        nonlocal spool_fh, spool_file, serialized_records, event_ids, chunk_size
+        chunks.append((serialized_records, event_ids))
+        serialized_records = []
+        event_ids = [] if collect_event_ids else None
+        chunk_size = 0
+
+        if spool_fh is None and len(chunks) > max_result_chunks:
+            spool_fd, spool_file = tempfile.mkstemp(suffix=".spool", dir=spool_dir)
+            spool_fh = open(spool_fd, "wb")
+        if spool_fh is not None:
+            with stats.phase("write"):
+                for chunk in chunks:
+                    pickle.dump(chunk, spool_fh, pickle.HIGHEST_PROTOCOL)
+            chunks.clear()
+
+    records = GeneratorResult(process_cloudtrail_file(infile))
+    try:
+        with stats.phase("transform"):
+            for record in records:
+                if record_filter.active and not record_filter.matches(record):
+                    filtered_count += 1
+                    continue
+                serialized_record = f"{sof_elk_json.dumps(record)}\n"
+                serialized_records.append(serialized_record)
+                if collect_event_ids:
+                    event_ids.append(record_event_id(record))
+
+                chunk_size += len(serialized_record)
+                if chunk_size >= result_chunk_size:
+                    end_chunk()
+
+            if serialized_records:
+                end_chunk()
+    finally:
+        if spool_fh is not None:
+            spool_fh.close()
+
+    converted = file_converted(infile, records)
+    return (output_file, chunks, spool_file, filtered_count, converted), stats.take()
+
+
+def iter_result_chunks(chunks, spool_file):
+    """
+    Yield the chunks returned by convert_cloudtrail_file(), reading them back
+    from its spool file if there is one, and remove the spool file.
+    """
+    yield from chunks
+    if spool_file is None:
+        return
+
+    try:
+        with open(spool_file, "rb") as spool_fh:
+            while True:
+                try:
+                    chunk = pickle.load(spool_fh)
+                except EOFError:
+                    break
+                yield chunk
+    finally:
+        os.remove(spool_file)
+
+
+class DailyOutputWriters:
+    """
+    Bounded LRU pool of open daily output files.  Each file is opened once with
+    a large write buffer and kept open while records for that day keep arriving,
+    instead of being reopened for every input file.  When the pool is full, the
+    least recently used file is closed.  If compress is set, files are written
+    as gzip (".json.gz"), which the SOF-ELK filebeat input reads natively.
+    A new file is written under a temporary name and only renamed into place
+    when it is closed, so close() must be called before the records written to
+    it can be considered complete.
+
+    checkpoint() closes every file and marks the point that rollback() returns
+    to: rollback() truncates each file written since then back to the size it
+    had at the checkpoint, and removes the files created since then, so an
+    interrupted or failed run leaves no records from input files that are not
+    yet in the manifest.  Leaving a "with" block with an exception rolls back.
+    """
+
+    def __init__(self, outdir, max_open=default_max_open_files, compress=False):
+        self.outdir = outdir
+        self.max_open = max(1, max_open)
+        self.compress = compress
+        self.writers = OrderedDict()
+        self.known_dirs = set()
+        # the size of each file written since the last checkpoint, as it was
+        # at the checkpoint, or None if it did not exist yet
+        self.checkpoint_sizes = {}
+
+    def output_path(self, output_file):
+        output_path = os.path.join(self.outdir, output_file)
+        if self.compress:
+            output_path += ".gz"
+        return output_path
+
+    def get(self, output_file):
+        """Return an open writer for the specified daily output file."""
+        writer = self.writers.get(output_file)
+        if writer is not None:
+            self.writers.move_to_end(output_file)
+            return writer
+
+        if len(self.writers) >= self.max_open:
+            _, oldest_writer = self.writers.popitem(last=False)
+            oldest_writer.close()
+
+        output_path = self.output_path(output_file)
+        if output_file not in self.checkpoint_sizes:
+            try:
+                self.checkpoint_sizes[output_file] = os.path.getsize(output_path)
+            except FileNotFoundError:
+                self.checkpoint_sizes[output_file] = None
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir not in self.known_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            self.known_dirs.add(output_dir)
+
+        # appending to an existing gzip file adds a new gzip member, which is
+        # still a valid gzip stream
+        writer = sof_elk_io.open_output(
+            output_path,
+            compression="gzip" if self.compress else None,
+            compresslevel=output_compresslevel,
+            append=True,
+            buffer_size=output_buffer_size,
+        )
+
+        self.writers[output_file] = writer
+        return writer
+
+    def write(self, output_file, serialized_records):
+        """Append a block of serialized records to the specified daily output file."""
+        self.get(output_file).write(serialized_records)
+
+    def close(self):
+        while self.writers:
+            _, writer = self.writers.popitem(last=False)
+            writer.close()
+
+    def checkpoint(self):
+        """Close every file, keeping everything written to them so far."""
+        self.close()
+        self.checkpoint_sizes = {}
+
+    def rollback(self):
+        """Undo everything written since the last checkpoint()."""
+        while self.writers:
+            _, writer = self.writers.popitem(last=False)
+            writer.discard()
+
+        for output_file, size in self.checkpoint_sizes.items():
+            output_path = self.output_path(output_file)
+            try:
+                if size is None:
+                    os.remove(output_path)
+                else:
+                    os.truncate(output_path, size)
+            except FileNotFoundError:
+                pass
+        self.checkpoint_sizes = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.rollback()
+
+
+class ConversionManifest:
+    """
+    Persistent record of the input files that have already been converted,
+    keyed on absolute path, size, and modification time, plus a SHA-256 of the
+    file content if use_hash is set.  Entries are appended to the manifest as
+    JSON lines, so the entries committed by an interrupted run are kept and the
+    next run picks up with the files that were not yet committed.
+    """
 
-    records = process_cloudtrail_file(infile)
+    def __init__(self, filename, use_hash=False):
+        self.filename = filename
+        self.use_hash = use_hash
+        self.entries = {}
+        self.pending = []
 
+        if os.path.isfile(self.filename):
+            with open(self.filename, "r") as manifest_file:
+                for manifest_line in manifest_file:
+                    try:
+                        entry = sof_elk_json.loads(manifest_line)
+                        self.entries[entry["path"]] = entry
+                    except (sof_elk_json.JSONDecodeError, KeyError, TypeError):
+                        # most likely a partial line from an interrupted run
+                        continue
+
+    def file_state(self, infile):
+        """Return the manifest entry describing the current state of infile."""
+        file_stat = os.stat(infile)
+        return {
+            "path": os.path.abspath(infile),
+            "size": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns,
+        }
+
+    def file_hash(self, infile):
+        sha256 = hashlib.sha256()
+        with open(infile, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(read_chunk_size), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def is_processed(self, state):
+        """
+        Determine if the file described by state was already converted.  When
+        hashing is enabled, a file whose size or modification time changed but
+        whose content did not is still considered processed.
+        """
+        entry = self.entries.get(state["path"])
+        if entry is None:
+            return False
+
+        if entry["size"] == state["size"] and entry["mtime_ns"] == state["mtime_ns"]:
+            return True
+
+        if self.use_hash and "sha256" in entry and entry["size"] == state["size"]:
+            state["sha256"] = self.file_hash(state["path"])
+            if state["sha256"] == entry["sha256"]:
+                # record the new timestamp so the file is not hashed again
+                self.add(state)
+                return True
+
+        return False
+
+    def add(self, state):
+        """Queue an entry for a file whose output has been fully written."""
+        if self.use_hash and "sha256" not in state:
+            state["sha256"] = self.file_hash(state["path"])
+        self.pending.append(state)
+
+    def commit(self):
+        """
+        Durably append all queued entries to the manifest.  The caller must
+        flush the corresponding output first.
+        """
+        if not self.pending:
+            return
+
+        manifest_dir = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(manifest_dir, exist_ok=True)
+
+        with open(self.filename, "a") as manifest_file:
+            for entry in self.pending:
+                manifest_file.write(f"{sof_elk_json.dumps(entry)}\n")
+                self.entries[entry["path"]] = entry
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+
+        self.pending = []
+
+
+class EventDeduplicator:
+    """
+    Persistent, memory-bounded set of the CloudTrail eventIDs already written.
+    The exact set lives in an on-disk SQLite database, fronted by an in-memory
+    Bloom filter sized for capacity IDs.  Most new IDs are identified by the
+    Bloom filter alone, and only possible duplicates are confirmed against the
+    database.  New IDs are inserted in batches and become durable in commit().
+    Exceeding the capacity only raises the number of database lookups.
+    """
+
+    def __init__(self, filename, capacity=default_dedup_capacity):
+        self.filename = filename
+        self.duplicates = 0
+        self.pending = set()
+
+        # each hash is a 32-bit value, which bounds the size of the filter
+        self.bloom_bits = min(
+            2**32,
+            max(
+                8,
+                int(
+                    -capacity * math.log(dedup_false_positive_rate) / (math.log(2) ** 2)
+                ),
+            ),
+        )
+        self.bloom_hashes = max(1, round(self.bloom_bits / capacity * math.log(2)))
+        self.bloom_unpacker = struct.Struct(f"<{self.bloom_hashes}I")
+
+        dedup_dir = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(dedup_dir, exist_ok=True)
+
+        self.db = sqlite3.connect(self.filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS event_ids (event_id TEXT PRIMARY KEY) WITHOUT ROWID"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS bloom (bits INTEGER, hashes INTEGER, filter BLOB)"
+        )
+        self.db.commit()
+
+        # reuse the saved Bloom filter if it was built with the same geometry,
+        # otherwise rebuild it from the stored eventIDs
+        saved_bloom = self.db.execute(
+            "SELECT filter FROM bloom WHERE bits = ? AND hashes = ?",
+            (self.bloom_bits, self.bloom_hashes),
+        ).fetchone()
+        if saved_bloom is not None:
+            self.bloom = bytearray(saved_bloom[0])
+        else:
+            self.bloom = bytearray((self.bloom_bits + 7) // 8)
+            for (event_id,) in self.db.execute("SELECT event_id FROM event_ids"):
+                self.bloom_check_and_add(event_id)
+
+    def bloom_check_and_add(self, event_id):
+        """
+        Set the Bloom filter bits for event_id.  Returns True if they were all
+        already set, meaning the eventID may have been seen before.
+        """
+        # one digest provides an independent 32-bit value for each hash
+        positions = self.bloom_unpacker.unpack(
+            hashlib.blake2b(
+                event_id.encode("utf-8"), digest_size=self.bloom_unpacker.size
+            ).digest()
+        )
+
+        bloom = self.bloom
+        bloom_bits = self.bloom_bits
+        maybe_present = True
+        for position in positions:
+            position %= bloom_bits
+            bit = 1 << (position & 7)
+            if not bloom[position >> 3] & bit:
+                bloom[position >> 3] |= bit
+                maybe_present = False
+        return maybe_present
+
+    def is_duplicate(self, event_id):
+        """
+        Determine if a record with this eventID was already written, and
+        remember the eventID if not.  Records without an eventID are never
+        considered duplicates.
+        """
+        if event_id is None:
+            return False
+
+        if self.bloom_check_and_add(event_id):
+            if (
+                event_id in self.pending
+                or self.db.execute(
+                    "SELECT 1 FROM event_ids WHERE event_id = ?", (event_id,)
+                ).fetchone()
+            ):
+                self.duplicates += 1
+                return True
+
+        self.pending.add(event_id)
+        if len(self.pending) >= dedup_batch_size:
+            self.flush()
+        return False
+
+    def flush(self):
+        """Insert pending eventIDs into the database without committing."""
+        if self.pending:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO event_ids (event_id) VALUES (?)",
+                ((event_id,) for event_id in self.pending),
+            )
+            self.pending = set()
+
+    def commit(self):
+        """
+        Durably store all eventIDs seen so far.  The caller must flush the
+        corresponding output first.
+        """
+        self.flush()
+        self.db.commit()
+
+    def rollback(self):
+        """
+        Forget the eventIDs seen since the last commit(), whose records were
+        rolled back.  They stay set in the Bloom filter, which only costs a
+        database lookup if they are seen again.
+        """
+        self.pending = set()
+        self.db.rollback()
+
+    def close(self):
+        self.commit()
+        self.db.execute("DELETE FROM bloom")
+        self.db.execute(
+            "INSERT INTO bloom (bits, hashes, filter) VALUES (?, ?, ?)",
+            (self.bloom_bits, self.bloom_hashes, bytes(self.bloom)),
+        )
+        self.db.commit()
+        self.db.close()
+
+
+def stream_cloudtrail_file(infile, writers, deduplicator=None):
+    """
+    Convert a single CloudTrail log file, writing each record to its daily
+    output file as soon as it is decoded.  Returns a tuple of (record_count,
+    filtered_count, converted), where converted is the result of
+    file_converted().  Records suppressed as duplicates are counted by the
+    deduplicator.
+    """
     output_file = derive_output_file(infile)
 
-    if args.outdir == None:
-        output_path = os.path.join(default_destdir, output_file)
+    # the output file is only opened once there is a record to write
+    record_count = 0
+    filtered_count = 0
+    outfh = None
+    records = GeneratorResult(process_cloudtrail_file(infile))
+    for record in records:
+        if record_filter.active and not record_filter.matches(record):
+            filtered_count += 1
+            continue
+        if deduplicator is not None and deduplicator.is_duplicate(
+            record_event_id(record)
+        ):
+            continue
+        if outfh is None:
+            outfh = writers.get(output_file)
+        outfh.write(f"{sof_elk_json.dumps(record)}\n")
+        record_count += 1
+
+    return record_count, filtered_count, file_converted(infile, records)
+
+
+def write_converted_file(result, writers, deduplicator=None):
+    """
+    Write the serialized records returned by convert_cloudtrail_file() for a
+    single input file.  Returns a tuple of (record_count, filtered_count,
+    converted).
+    """
+    output_file, chunks, spool_file, filtered_count, converted = result
+
+    record_count = 0
+    for serialized_records, event_ids in iter_result_chunks(chunks, spool_file):
+        if deduplicator is None:
+            writers.write(output_file, "".join(serialized_records))
+            record_count += len(serialized_records)
+            continue
+
+        # each eventID is only remembered right before its record is written
+        outfh = None
+        for serialized_record, event_id in zip(serialized_records, event_ids):
+            if deduplicator.is_duplicate(event_id):
+                continue
+            if outfh is None:
+                outfh = writers.get(output_file)
+            outfh.write(serialized_record)
+            record_count += 1
+
+    return record_count, filtered_count, converted
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process AWS CloudTrail logs into daily-based output files."
+    )
+    parser.add_argument(
+        "-r",
+        "--read",
+        dest="input",
+        required=True,
+        help="AWS CloudTrail log file or directory to read.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="outdir",
+        default=default_destdir,
+        help=f"Base directory to store processed daily output files (default: {default_destdir}).",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        dest="force_outfile",
+        help=f"Force creating an output file in a location other than the default SOF-ELK ingest location, {default_destdir}",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-a",
+        "--append",
+        dest="append",
+        help="Append to the output file if it exists.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to convert input files in parallel.  Use 0 to run one worker per CPU core. (default: 1)",
+    )
+    parser.add_argument(
+        "-z",
+        "--gzip",
+        dest="compress",
+        action="store_true",
+        default=False,
+        help="Write gzip-compressed daily output files (.json.gz).",
+    )
+    parser.add_argument(
+        "--max-open-files",
+        dest="max_open_files",
+        type=int,
+        default=default_max_open_files,
+        help=f"Maximum number of daily output files to hold open at once. (default: {default_max_open_files})",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        dest="manifest",
+        default=None,
+        help="Manifest file used to track converted input files.  Files already listed with the same size and modification time are skipped, so repeated or interrupted runs only convert new or changed files.  Implies -a.",
+    )
+    parser.add_argument(
+        "--manifest-hash",
+        dest="manifest_hash",
+        action="store_true",
+        default=False,
+        help="Also record a SHA-256 hash of each input file in the manifest, and skip files whose timestamp changed but whose content did not.",
+    )
+    for option_name, field in filter_fields.items():
+        parser.add_argument(
+            f"--include-{option_name}",
+            dest=f"include_{option_name}",
+            action="append",
+            help=f"Only output records with this {field} value.  Can be used multiple times.",
+        )
+        parser.add_argument(
+            f"--exclude-{option_name}",
+            dest=f"exclude_{option_name}",
+            action="append",
+            help=f"Do not output records with this {field} value.  Can be used multiple times.",
+        )
+    parser.add_argument(
+        "--start-time",
+        dest="start_time",
+        type=utc_timestamp,
+        help="Only output records with an eventTime at or after this ISO 8601 date or date/time (UTC unless specified).",
+    )
+    parser.add_argument(
+        "--end-time",
+        dest="end_time",
+        type=utc_timestamp,
+        help="Only output records with an eventTime before this ISO 8601 date or date/time (UTC unless specified).",
+    )
+    parser.add_argument(
+        "-d",
+        "--dedup",
+        dest="dedup",
+        default=None,
+        help="Database file used to track the eventID of every record written.  Records whose eventID is already in the database are suppressed, including across separate runs.",
+    )
+    parser.add_argument(
+        "--dedup-capacity",
+        dest="dedup_capacity",
+        type=int,
+        default=default_dedup_capacity,
+        help=f"Expected number of unique eventIDs, used to size the in-memory filter in front of the de-duplication database. (default: {default_dedup_capacity})",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        action="store_true",
+        help="Display progress and status information.",
+    )
+    sof_elk_stats.add_arguments(parser)
+    args = parser.parse_args()
+    args.input = os.path.expanduser(args.input)
+    args.outdir = os.path.expanduser(args.outdir)
+    if args.manifest:
+        args.manifest = os.path.expanduser(args.manifest)
+        args.append = True
+    elif args.manifest_hash:
+        sys.stderr.write('ERROR: "--manifest-hash" requires "-m".\n')
+        sys.exit(2)
+    if args.dedup:
+        args.dedup = os.path.expanduser(args.dedup)
+        if args.dedup_capacity < 1:
+            sys.stderr.write("ERROR: The de-duplication capacity must be positive.\n")
+            sys.exit(2)
+
+    if not args.outdir.startswith(default_destdir) and not args.force_outfile:
+        sys.stderr.write(
+            f'ERROR: Output location is not in {default_destdir}, which is the SOF-ELK ingest location. Use "-f" to force creating a file in this location.\n'
+        )
+        sys.exit(2)
+
+    if (
+        os.path.exists(args.outdir)
+        and not (args.outdir == default_destdir)
+        and not args.append
+    ):
+        sys.stderr.write(
+            f'ERROR: Output directory {args.outdir} already exists.  Use "-a" to append to any existing output in this location.\n'
+        )
+        sys.exit(3)
+
+    if args.jobs < 0:
+        sys.stderr.write("ERROR: The number of jobs cannot be negative.\n")
+        sys.exit(2)
+    elif args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+
+    input_files = []
+    if os.path.isfile(args.input):
+        input_files.append(args.input)
+    elif os.path.isdir(args.input):
+        for root, _, files in os.walk(args.input):
+            for name in files:
+                input_files.append(os.path.join(root, name))
     else:
-        output_path = os.path.join(args.outdir, output_file)
+        sys.stderr.write("No input files could be processed. Exiting.\n")
+        sys.exit(4)
+
+    if args.verbose:
+        print(f"Found {len(input_files)} files to parse.")
+
+    sof_elk_stats.start(args, "aws-cloudtrail2sof-elk.py")
 
-    output_dir = os.path.dirname(output_path)
+    manifest = None
+    file_states = {}
+    if args.manifest:
+        manifest = ConversionManifest(args.manifest, use_hash=args.manifest_hash)
 
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        new_input_files = []
+        for infile in input_files:
+            file_states[infile] = manifest.file_state(infile)
+            if not manifest.is_processed(file_states[infile]):
+                new_input_files.append(infile)
+        manifest.commit()
 
-    with open(output_path, "a") as outfh:
-        for record in records:
-            outfh.write(f"{json.dumps(record)}\n")
+        if args.verbose:
+            print(
+                f"Skipping {len(input_files) - len(new_input_files)} files already listed in the manifest."
+            )
+        input_files = new_input_files
 
-if not args.outdir.startswith(default_destdir):
-    print(
-        f"Output complete.  You must move/copy the generated file to the {default_destdir} directory before SOF-ELK can process it."
+    deduplicator = None
+    if args.dedup:
+        deduplicator = EventDeduplicator(args.dedup, capacity=args.dedup_capacity)
+
+    set_conversion_options(
+        RecordFilter(
+            include={
+                field: getattr(args, f"include_{option_name}")
+                for option_name, field in filter_fields.items()
+            },
+            exclude={
+                field: getattr(args, f"exclude_{option_name}")
+                for option_name, field in filter_fields.items()
+            },
+            start_time=args.start_time,
+            end_time=args.end_time,
+        ),
+        deduplicator is not None,
     )
-else:
-    print(
-        "SOF-ELK should now be processing the generated file - check system load and the Kibana interface to confirm."
+    total_records = 0
+    total_filtered = 0
+
+    writers = DailyOutputWriters(
+        args.outdir, max_open=args.max_open_files, compress=args.compress
     )
+
+    completed_files = 0
+    failed_files = 0
+
+    def commit_progress():
+        # output must reach the disk, under its final name, before the
+        # manifest or the eventID database say it did
+        writers.checkpoint()
+        if deduplicator is not None:
+            deduplicator.commit()
+        if manifest is not None:
+            manifest.commit()
+
+    def file_complete(infile, record_count, converted):
+        nonlocal completed_files, failed_files
+        completed_files += 1
+        stats.add_files()
+        stats.add_records(record_count)
+        if not converted:
+            # left out of the manifest so the next run tries the file again
+            failed_files += 1
+        elif manifest is not None:
+            manifest.add(file_states[infile])
+        if completed_files % manifest_commit_interval == 0:
+            commit_progress()
+
+    try:
+        if args.jobs > 1 and len(input_files) > 1:
+            # each worker reads, parses, and serializes whole input files, while
+            # this process remains the only writer so daily output files are
+            # never interleaved.  imap() preserves input order so the output is
+            # identical to a single-process run.  The records of large files
+            # are spooled to a temporary directory rather than held in memory.
+            worker_spool_dir = tempfile.TemporaryDirectory(
+                prefix="aws-cloudtrail2sof-elk-"
+            )
+            pool = multiprocessing.Pool(
+                processes=min(args.jobs, len(input_files)),
+                initializer=init_worker,
+                initargs=(record_filter, collect_event_ids, worker_spool_dir.name),
+            )
+            chunksize = max(1, min(64, len(input_files) // (args.jobs * 4)))
+            results = pool.imap(convert_cloudtrail_file, input_files, chunksize)
+
+            try:
+                with writers:
+                    for idx, (infile, (result, worker_stats)) in enumerate(
+                        zip(input_files, stats.timed(results, "wait")), 1
+                    ):
+                        if args.verbose:
+                            print(
+                                f"- Parsing file: {infile} ({idx} of {len(input_files)})"
+                            )
+
+                        with stats.phase("write"):
+                            record_count, filtered_count, converted = (
+                                write_converted_file(result, writers, deduplicator)
+                            )
+                        total_records += record_count
+                        total_filtered += filtered_count
+
+                        stats.merge(worker_stats)
+                        file_complete(infile, record_count, converted)
+
+            finally:
+                pool.terminate()
+                pool.join()
+                worker_spool_dir.cleanup()
+
+        else:
+            # a single process streams records straight to the output file, which
+            # keeps memory use flat even for very large input files
+            with writers:
+                for idx, infile in enumerate(input_files, 1):
+                    if args.verbose:
+                        print(f"- Parsing file: {infile} ({idx} of {len(input_files)})")
+
+                    with stats.phase("transform"):
+                        record_count, filtered_count, converted = (
+                            stream_cloudtrail_file(infile, writers, deduplicator)
+                        )
+                    total_records += record_count
+                    total_filtered += filtered_count
+
+                    file_complete(infile, record_count, converted)
+
+    except KeyboardInterrupt:
+        # the output written since the last commit was rolled back when the
+        # writers were left, so the eventIDs and manifest entries for it are
+        # dropped too
+        sys.stderr.write("\nInterrupted.\n")
+        if deduplicator is not None:
+            deduplicator.rollback()
+            deduplicator.close()
+        if manifest is not None:
+            sys.stderr.write(
+                "Files converted before the last checkpoint were saved to the manifest, and the output of the files after them was removed. Re-run with the same options to resume.\n"
+            )
+        sys.exit(1)
+
+    if deduplicator is not None:
+        deduplicator.close()
+        print(f"Suppressed {deduplicator.duplicates} duplicate records.")
+
+    if manifest is not None:
+        manifest.commit()
+        if failed_files:
+            print(
+                f"{failed_files} files could not be read and were not added to the manifest, so they will be tried again on the next run."
+            )
+
+    if args.verbose:
+        print(f"Wrote {total_records} records.")
+        if record_filter.active:
+            print(f"Filtered out {total_filtered} records.")
+
+    if not args.outdir.startswith(default_destdir):
+        print(
+            f"Output complete.  You must move/copy the generated file to the {default_destdir} directory before SOF-ELK can process it."
+        )
+    else:
+        print(
+            "SOF-ELK should now be processing the generated file - check system load and the Kibana interface to confirm."
+        )
+
+
+if __name__ == "__main__":
+    main()
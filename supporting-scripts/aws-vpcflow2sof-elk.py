@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+# SOF-ELK® Supporting script
+# (C)2026 Lewes Technology Consulting, LLC
+#
+# This script will read a file or directory tree of AWS VPC Flow logs and
+# output in a format that SOF-ELK® can read with its NetFlow ingest feature.
+# The following forms of VPC Flow logs are supported, each of which may be
+# compressed with gzip, bzip2, xz, or zstd:
+#  - Plain text log files as delivered to S3, such as:
+#    123456789012_vpcflowlogs_us-east-1_fl-0123456789abcdef0_20250110T0805Z_0a1b2c3d.log.gz
+#  - JSON exports from CloudWatch Logs, with the flow records in an "events"
+#    array (e.g. the output of "aws logs filter-log-events")
+#  - CloudWatch Logs subscription data, with the flow records in a "logEvents"
+#    array, including files of several such objects as delivered by Firehose
+# Use "--stats" to report throughput and the time spent in each phase of the
+# conversion, or "--profile" to profile it.
+#
+# This script replaces the jq pipeline in aws-vpcflow2sof-elk.sh, which is now
+# a wrapper around it.  Like the other Python converters, "-f" forces creating
+# the output file outside /logstash/nfarch/ and "-a" appends to an existing
+# file, where the shell script used "-f" to append.
+
+import argparse
+import io
+import itertools
+import multiprocessing
+import os
+import pickle
+import signal
+import sys
+import tempfile
+
+import sof_elk_io
+import sof_elk_json
+import sof_elk_stats
+from sof_elk_json import JSONStream
+from sof_elk_stats import stats
+
+default_destdir = "/logstash/nfarch/"
+line_batch_size = 10000
+read_chunk_size = 1024 * 1024
+# a worker returns the records of an input file to the writer in chunks of
+# about this many characters, and spools them to a temporary file rather than
+# holding more than max_result_chunks chunks in memory
+result_chunk_size = 1024 * 1024
+max_result_chunks = 8
+
+# JSON arrays that hold the flow log events, each with the flow record as text
+# in its "message" field
+events_keys = ("events", "logEvents")
+json_start_bytes = (b"{", b"[")
+# leading bytes skipped when deciding whether a file holds JSON or plain text
+leading_whitespace = b" \t\r\n\xef\xbb\xbf"
+
+
+def iter_events_array(stream):
+    """Walk a JSON array of log events and yield each one."""
+    stream.expect("[")
+    if stream.peek() == "]":
+        stream.pos += 1
+        return
+
+    while True:
+        yield stream.decode()
+        if stream.peek() == ",":
+            stream.pos += 1
+            continue
+        stream.expect("]")
+        break
+
+
+def iter_events_object(stream):
+    """
+    Walk a top-level JSON object and yield each element of its "events" or
+    "logEvents" array.  All other top-level values are decoded and discarded.
+    Returns True if an events array was found.  The events of CloudWatch Logs
+    control messages are not flow records, so they are skipped.
+    """
+    found_events = False
+    control_message = False
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return found_events
+
+    while True:
+        key = stream.decode()
+        stream.expect(":")
+
+        if key in events_keys and stream.peek() == "[":
+            found_events = True
+            if control_message:
+                stream.decode()
+            else:
+                yield from iter_events_array(stream)
+
+        else:
+            value = stream.decode()
+            if key == "messageType" and value == "CONTROL_MESSAGE":
+                control_message = True
+
+        if stream.peek() == ",":
+            stream.pos += 1
+            continue
+        stream.expect("}")
+        break
+
+    return found_events
+
+
+def document_events(document):
+    """Return the list of log events in a decoded JSON document, or None."""
+    if isinstance(document, list):
+        return document
+    if not isinstance(document, dict):
+        return None
+
+    for key in events_keys:
+        events = document.get(key)
+        if isinstance(events, list):
+            if document.get("messageType") == "CONTROL_MESSAGE":
+                return []
+            return events
+    return None
+
+
+def read_json_events(infile, text_file):
+    """
+    Yield the log events from a file of JSON, which may hold several JSON
+    objects (e.g. as delivered by Firehose).  Files of moderate size are
+    decoded in one pass, while larger ones are decoded incrementally, so
+    memory use stays flat regardless of the size of the input file.
+    """
+    stream = JSONStream(text_file)
+
+    try:
+        with stats.phase("decode"):
+            document = stream.read_document()
+    except sof_elk_json.JSONDecodeError:
+        # more than one object, or an error: walk the file value by value
+        document = None
+
+    if document is not None:
+        events = document_events(document)
+        if events is None:
+            sys.stderr.write(
+                f"- ERROR: Input file {infile} does not appear to contain AWS VPC Flow log events. Skipping file.\n"
+            )
+            return
+        yield from events
+        return
+
+    object_num = 0
+    while stream.peek():
+        object_num += 1
+
+        if stream.peek() == "[":
+            yield from stats.timed(iter_events_array(stream), "decode")
+            continue
+
+        if stream.peek() != "{":
+            sys.stderr.write(
+                f"- ERROR: Did not detect JSON content in {infile}, object {object_num}. Skipping rest of file.\n"
+            )
+            return
+
+        found_events = yield from stats.timed(iter_events_object(stream), "decode")
+        if not found_events:
+            sys.stderr.write(
+                f"- ERROR: JSON did not contain an 'events' or 'logEvents' field in {infile}, object {object_num}. Skipping rest of file.\n"
+            )
+            return
+
+
+def read_json_lines(infile, text_file):
+    """Yield the "message" of each log event in a JSON file as a line of output."""
+    skipped_events = 0
+    for event in read_json_events(infile, text_file):
+        try:
+            message = event["message"]
+        except (KeyError, TypeError):
+            skipped_events += 1
+            continue
+        if not isinstance(message, str):
+            skipped_events += 1
+            continue
+
+        if message.endswith("\n"):
+            yield message
+        else:
+            yield message + "\n"
+
+    if skipped_events:
+        sys.stderr.write(
+            f"- WARNING: Skipped {skipped_events} events without a 'message' field in {infile}.\n"
+        )
+
+
+def read_text_lines(text_file):
+    """Yield each non-blank line of a plain text VPC Flow log file."""
+    # the header line is passed through too, and dropped by the ingest pipeline
+    while True:
+        with stats.phase("decode"):
+            lines = text_file.readlines(read_chunk_size)
+        if not lines:
+            return
+        for line in lines:
+            if line.isspace():
+                continue
+            if line.endswith("\n"):
+                yield line
+            else:
+                yield line + "\n"
+
+
+def read_flow_lines(infile):
+    """
+    Yield the VPC Flow records in a single input file as lines of output.
+    Whether the file holds JSON or plain text is detected from its content
+    rather than its name.
+    """
+    try:
+        input_file = sof_elk_io.open_input(infile, mode="rb")
+    except OSError as e:
+        sys.stderr.write(f"- ERROR: Could not open {infile} ({e}). Skipping file.\n")
+        return
+
+    with input_file:
+        try:
+            first_byte = input_file.peek(read_chunk_size).lstrip(leading_whitespace)[:1]
+            text_file = io.TextIOWrapper(input_file, encoding="utf-8-sig")
+
+            if first_byte in json_start_bytes:
+                yield from read_json_lines(infile, text_file)
+            else:
+                yield from read_text_lines(text_file)
+
+        except (sof_elk_json.JSONDecodeError, UnicodeDecodeError, EOFError, OSError):
+            sys.stderr.write(
+                f"- ERROR: Could not process content from {infile}. Skipping rest of file.\n"
+            )
+
+
+def stream_vpcflow_file(infile, outfh):
+    """
+    Convert a single VPC Flow log file, writing its records to outfh
+    line_batch_size at a time.  Returns the number of records written.
+    """
+    record_count = 0
+    lines = read_flow_lines(infile)
+    while True:
+        batch = list(itertools.islice(lines, line_batch_size))
+        if not batch:
+            return record_count
+        outfh.writelines(batch)
+        record_count += len(batch)
+        stats.add_records(len(batch))
+
+
+# where workers spool large results - set in each worker
+spool_dir = None
+
+
+def init_worker(new_spool_dir=None):
+    global spool_dir
+    # ctrl-c is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    spool_dir = new_spool_dir
+
+
+def convert_vpcflow_file(infile):
+    """
+    Convert a single VPC Flow log file in a worker process.  Returns a tuple
+    of ((chunks, spool_file, record_count), worker_stats).  The converted text
+    is split into chunks of about result_chunk_size characters.  Once a file
+    produces more than max_result_chunks chunks, all of them are written to
+    spool_file instead and chunks is empty, so no worker holds more than that
+    much of a file in memory.
+    """
+    chunks = []
+    spool_file = None
+    spool_fh = None
+    lines = []
+    chunk_size = 0
+    record_count = 0
+
+    def end_chunk():
+        nonlocal spool_fh, spool_file, lines, chunk_size
+        chunks.append("".join(lines))
+        lines = []
+        chunk_size = 0
+
+        if spool_fh is None and len(chunks) > max_result_chunks:
+            spool_fd, spool_file = tempfile.mkstemp(suffix=".spool", dir=spool_dir)
+            spool_fh = open(spool_fd, "wb")
+        if spool_fh is not None:
+            with stats.phase("write"):
+                for chunk in chunks:
+                    pickle.dump(chunk, spool_fh, pickle.HIGHEST_PROTOCOL)
+            chunks.clear()
+
+    try:
+        with stats.phase("transform"):
+            for line in read_flow_lines(infile):
+                lines.append(line)
+                record_count += 1
+
+                chunk_size += len(line)
+                if chunk_size >= result_chunk_size:
+                    end_chunk()
+
+            if lines:
+                end_chunk()
+    finally:
+        if spool_fh is not None:
+            spool_fh.close()
+
+    return (chunks, spool_file, record_count), stats.take()
+
+
+def iter_result_chunks(chunks, spool_file):
+    """
+    Yield the chunks returned by convert_vpcflow_file(), reading them back
+    from its spool file if there is one, and remove the spool file.
+    """
+    yield from chunks
+    if spool_file is None:
+        return
+
+    try:
+        with open(spool_file, "rb") as spool_fh:
+            while True:
+                try:
+                    chunk = pickle.load(spool_fh)
+                except EOFError:
+                    break
+                yield chunk
+    finally:
+        os.remove(spool_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process AWS VPC Flow logs into a format that is consistent with other SOF-ELK(R) NetFlow entries and place them into an output file.  Plain text logs and JSON exports from CloudWatch Logs are supported."
+    )
+    parser.add_argument(
+        "-r",
+        "--read",
+        dest="infile",
+        help="AWS VPC Flow log file to read or a directory containing AWS VPC Flow log files, which may be compressed with gzip, bzip2, xz, or zstd.",
+    )
+    parser.add_argument(
+        "-w",
+        "--write",
+        dest="outfile",
+        help="File to create containing processed VPC Flow data.  Names ending in .gz are written gzip-compressed.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        dest="force_outfile",
+        help=f"Force creating an output file in a location other than the default SOF-ELK ingest location, {default_destdir}",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-a",
+        "--append",
+        dest="append",
+        help="Append to the output file if it exists.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="Number of worker processes used to convert input files in parallel.  Use 0 to run one worker per CPU core. (Default: 1)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        help="Display progress and related status information while parsing input files.",
+        default=False,
+        action="store_true",
+    )
+    sof_elk_stats.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.infile is None:
+        sys.stderr.write("ERROR: No input file or root directory specified.\n")
+        sys.exit(2)
+
+    if args.outfile is None:
+        sys.stderr.write("ERROR: No output file specified.\n")
+        sys.exit(2)
+    elif not args.outfile.startswith(default_destdir) and not args.force_outfile:
+        sys.stderr.write(
+            f'ERROR: Output file is not in {default_destdir}, which is the SOF-ELK ingest location. Use "-f" to force creating a file in this location.\n'
+        )
+        sys.exit(2)
+
+    if args.jobs < 0:
+        sys.stderr.write("ERROR: The number of jobs cannot be negative.\n")
+        sys.exit(2)
+    elif args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+
+    input_files = []
+    if os.path.isfile(args.infile):
+        input_files.append(args.infile)
+    elif os.path.isdir(args.infile):
+        for root, _, files in os.walk(args.infile):
+            for name in files:
+                input_files.append(os.path.join(root, name))
+    else:
+        sys.stderr.write("No input files could be processed.  Exiting.\n")
+        sys.exit(4)
+    # S3 object names start with the account and region and end with the
+    # delivery time, so this keeps each log's records in order
+    input_files.sort()
+
+    if args.verbose:
+        print(f"Found {len(input_files)} files to parse.")
+
+    sof_elk_stats.start(args, "aws-vpcflow2sof-elk.py")
+
+    if os.path.isfile(args.outfile) and args.append:
+        outfh = sof_elk_io.open_output(args.outfile, append=True)
+    elif os.path.isfile(args.outfile):
+        sys.stderr.write(
+            f'ERROR: Output file {args.outfile} already exists. Use "-a" to append to the file at this location or specify a different filename.\n'
+        )
+        sys.exit(3)
+    else:
+        # the output file only appears under its own name once it is complete
+        outfh = sof_elk_io.open_output(args.outfile)
+
+    total_records = 0
+    with outfh:
+        if args.jobs > 1 and len(input_files) > 1:
+            # each worker reads and converts whole input files, while this
+            # process remains the only writer.  imap() preserves input order
+            # so the output is identical to a single-process run.  The records
+            # of large files are spooled to a temporary directory rather than
+            # held in memory.
+            worker_spool_dir = tempfile.TemporaryDirectory(
+                prefix="aws-vpcflow2sof-elk-"
+            )
+            pool = multiprocessing.Pool(
+                processes=min(args.jobs, len(input_files)),
+                initializer=init_worker,
+                initargs=(worker_spool_dir.name,),
+            )
+            chunksize = max(1, min(64, len(input_files) // (args.jobs * 4)))
+            results = pool.imap(convert_vpcflow_file, input_files, chunksize)
+
+            try:
+                for idx, (
+                    infile,
+                    ((chunks, spool_file, record_count), worker_stats),
+                ) in enumerate(zip(input_files, stats.timed(results, "wait")), 1):
+                    if args.verbose:
+                        print(f"- Parsing file: {infile} ({idx} of {len(input_files)})")
+
+                    with stats.phase("write"):
+                        for chunk in iter_result_chunks(chunks, spool_file):
+                            outfh.write(chunk)
+                    # free this file's output before the next one arrives
+                    del chunks
+                    total_records += record_count
+
+                    stats.merge(worker_stats)
+                    stats.add_files()
+                    stats.add_records(record_count)
+
+            finally:
+                pool.terminate()
+                pool.join()
+                worker_spool_dir.cleanup()
+
+        else:
+            # a single process streams records straight to the output file, which
+            # keeps memory use flat even for very large input files
+            for idx, infile in enumerate(input_files, 1):
+                if args.verbose:
+                    print(f"- Parsing file: {infile} ({idx} of {len(input_files)})")
+
+                with stats.phase("transform"):
+                    total_records += stream_vpcflow_file(infile, outfh)
+                stats.add_files()
+
+    if args.verbose:
+        print(f"Wrote {total_records} records.")
+
+    if total_records == 0:
+        sys.stderr.write(
+            "No records were converted.  Please validate the input data to ensure it contains AWS VPC Flow logs.\n"
+        )
+
+    print("Output complete.")
+    if not args.outfile.startswith(default_destdir):
+        print(
+            f"You must move/copy the generated file to the {default_destdir} directory before SOF-ELK can process it."
+        )
+    else:
+        print(
+            "SOF-ELK should now be processing the generated file - check system load and the Kibana interface to confirm."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@
 #
 # This script will read a file or directory tree of JSON VPC Flow logs and
 # output in a format that SOF-ELK® can read with its NetFlow ingest feature
+#
+# The conversion is done by aws-vpcflow2sof-elk.py.  This wrapper keeps the
+# original command line, where "-f" forces appending to an existing output
+# file.  Use the Python script directly for its other options.
 
 # include common functions
 functions_include="/usr/local/sof-elk/supporting-scripts/functions.sh"
@@ -14,6 +18,8 @@ else
     exit 1
 fi
 
+converter="$( dirname "$( realpath "${0}" )" )/aws-vpcflow2sof-elk.py"
+
 # parse options
 FORCE_APPEND=0
 while getopts ":r:w:fh" opt; do
@@ -32,17 +38,6 @@ while getopts ":r:w:fh" opt; do
     esac
 done
 
-# make sure jq is available
-if ! which jq > /dev/null; then
-    echoerr "jq not found - exiting."
-    exit 3
-fi
-# make sure realpath is available
-if ! which realpath > /dev/null; then
-    echoerr "realpath not found - exiting."
-    exit 4
-fi
-
 if [[ -z "${SOURCE_LOCATION}" ]]; then
     echoerr "Please supply a source filename or parent directory containing VPC Flow"
     echoerr "  data to be parsed for SOF-ELK."
@@ -76,59 +71,18 @@ if [ -f "${DESTINATION_FILE}" ] && [ "${FORCE_APPEND}" -ne 1 ]; then
     echoerr "ERROR: Output file already exists and -f was not specified to force append.  Exiting."
     exit 9
 fi
+
+CONVERTER_ARGS=( -r "${SOURCE_LOCATION}" -w "${DESTINATION_FILE}" )
+if [ "${FORCE_APPEND}" -eq 1 ]; then
+    CONVERTER_ARGS+=( -a )
+fi
 if [[ ! "${DESTINATION_FILE}" =~ ^/logstash/nfarch/ ]]; then
     echoerr "WARNING: Output file location is not in /logstash/nfarch/. Resulting file will"
     echoerr "         not be automatically ingested unless moved/copied to the correct"
     echoerr "         filesystem location."
     echoerr "         Press Ctrl-C to try again or <Enter> to continue."
     read -r
-    NONSTANDARD_OUTPUT=1
-else
-    NONSTANDARD_OUTPUT=0
+    CONVERTER_ARGS+=( -f )
 fi
 
-# prepare list of input file(s) to read
-# this is to handle spaces in filenames
-IFS="
-"
-READFILES=$( find "${SOURCE_LOCATION}" -type f -print )
-
-CONVERT_SUCCESS=0
-for READFILE in ${READFILES}; do
-    # validate source data location
-    jq -crM '.events[1].message' < "${READFILE}" 2> /dev/null
-
-    TEST_RUN=$?
-    if [ "${TEST_RUN}" -ne 0 ]; then
-        echoerr ""
-        echoerr "Error with source file ${READFILE} - skipping."
-        continue
-    fi
-
-    # finally run jq command
-    jq -crM '.events[].message' < "${READFILE}" >> "${DESTINATION_FILE}"
-
-    REAL_RUN=$?
-    if [ "${REAL_RUN}" -ne 0 ]; then
-        echoerr ""
-        echoerr "An error occurred with source file ${READFILE}."
-        echoerr "Data may not have loaded correctly."
-        continue
-    else
-        CONVERT_SUCCESS=1
-    fi
-done
-
-if [ "${CONVERT_SUCCESS}" -eq 1 ]; then
-    echoerr "Output complete."
-    if [ "${NONSTANDARD_OUTPUT}" -eq 1 ]; then
-        echoerr "You must move/copy the generated file to the /logstash/nfarch/ directory before"
-        echoerr "  SOF-ELK can process it."
-    else
-        echoerr "SOF-ELK should now be processing the generated file - check system load and the"
-        echoerr "  Kibana interface to confirm."
-    fi
-else
-    echoerr "No files were successfully converted."
-    echoerr "Please validate the input data to ensure it contains proper JSON data."
-fi
+exec python3 "${converter}" "${CONVERTER_ARGS[@]}"
@@ -10,14 +10,47 @@
 #   for details on the newer Virtual Network Flow format
 # See https://docs.microsoft.com/en-us/azure/network-watcher/network-watcher-nsg-flow-logging-overview
 #   for details on the legacy VPC Flow format
+# Use "--stats" to report throughput and the time spent in each phase of the
+#   conversion, or "--profile" to profile it.
 
 import argparse
+import array
+import collections
+import heapq
+import io
+import multiprocessing
+import pickle
+import re
+import signal
 import sys
 import os
-import json
 import csv
+import threading
+import traceback
+import zlib
+from datetime import datetime, timezone
+
+import sof_elk_io
+import sof_elk_json
+import sof_elk_stats
+from sof_elk_json import JSONStream
+from sof_elk_stats import stats
 
 default_destdir = "/logstash/nfarch/"
+default_idle_timeout = 7200
+default_max_flows = 2000000
+capacity_eviction_fraction = 10
+# the string and profile tables are rebuilt from the flows in flight once they
+# hold twice as many entries as after the last rebuild, and at least this many
+min_compaction_size = 1 << 18
+# when converting in parallel, each shard sends its output to be written in
+# blocks of about this many characters, at most shard_queue_size input files'
+# flowtuples wait for each shard, and at most parse_window input files per
+# worker are parsed ahead of the shards
+output_block_size = 1024 * 1024
+shard_queue_size = 4
+parse_window = 2
+blob_path_regex = re.compile(r"y=(\d{4})/m=(\d{2})/d=(\d{2})/h=(\d{2})/m=(\d{2})/")
 vnet_flow_fields = [
     "timestamp",
     "source_ip",
@@ -48,6 +81,12 @@ vpc_flow_fields = [
     "in_packets",
     "in_bytes",
 ]
+# flowtuple fields shared by both formats are at the same positions
+timestamp_field = 0
+vnet_flow_state_field = vnet_flow_fields.index("flow_state")
+vnet_encryption_state_field = vnet_flow_fields.index("encryption_state")
+vpc_traffic_decision_field = vpc_flow_fields.index("traffic_decision")
+vpc_flow_state_field = vpc_flow_fields.index("flow_state")
 output_csv_columns = [
     "exporter_guid",
     "exporter_mac",
@@ -73,383 +112,1199 @@ output_csv_columns = [
 ]
 
 
-def create_inflight_index(flowtuple):
-    index_string = "-".join(
-        (
-            flowtuple["source_ip"],
-            flowtuple["destination_ip"],
-            flowtuple["source_port"],
-            flowtuple["destination_port"],
-            flowtuple["protocol"],
+flow_states = ("initial", "partial", "complete", "denied")
+flow_state_codes = {state: code for code, state in enumerate(flow_states)}
+
+
+def epoch_seconds(timestamp):
+    # VNet flow logs carry millisecond timestamps, NSG flow logs use seconds
+    if timestamp > 99999999999:
+        return timestamp // 1000
+    return timestamp
+
+
+class FlowTable:
+    """
+    Compact, array-backed table of in-flight flows.
+
+    Each flow's 5-tuple is packed into a single integer key built from the ids
+    of interned strings, and the flow's numeric state lives in typed arrays
+    indexed by a slot number.  Everything that describes where a flow came from
+    (exporter, rule, source file) plus its protocol, direction, and decision is
+    an interned "profile" tuple shared by every flow with the same values.
+    Slots of removed flows are reused.
+
+    The table is shared by all input files so flows that span files are
+    stitched together.  Each flow is written exactly once: when it ends or is
+    denied, when it has been idle for longer than idle_timeout seconds of log
+    time, when it is among the oldest flows and the table has reached
+    max_flows, or when the table is flushed at the end of the run.
+
+    Strings and profiles are not released when a flow is removed.  Instead
+    both tables are rebuilt from the flows still in flight once they have
+    doubled in size, so their memory use follows the flows in flight rather
+    than everything seen during the run.
+    """
+
+    def __init__(
+        self, writer, idle_timeout=default_idle_timeout, max_flows=default_max_flows
+    ):
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.clock = 0
+        self.last_expiry = 0
+        self.flows_written = 0
+        self.idle_evictions = 0
+        self.capacity_evictions = 0
+
+        self.slots = {}
+        self.profiles = []
+        self.states = bytearray()
+        self.first_seen = array.array("q")
+        self.last_seen = array.array("q")
+        self.out_bytes = array.array("q")
+        self.out_packets = array.array("q")
+        self.in_bytes = array.array("q")
+        self.in_packets = array.array("q")
+        self.free_slots = []
+
+        self.string_ids = {}
+        self.strings = []
+        self.interned_profiles = {}
+        self.profile_cache = {}
+        self.profile_cache_infile = None
+        self.compaction_size = min_compaction_size
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def string_id(self, value):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.string_ids[value] = string_id
+            self.strings.append(value)
+        return string_id
+
+    def intern_profile(self, profile):
+        return self.interned_profiles.setdefault(profile, profile)
+
+    def flow_key(self, flowtuple):
+        """Pack the 5-tuple of a decoded flowtuple into a single integer key."""
+        string_ids = self.string_ids
+        source_ip, destination_ip, source_port, destination_port, protocol = flowtuple[
+            1:6
+        ]
+
+        source_ip_id = string_ids.get(source_ip)
+        if source_ip_id is None:
+            source_ip_id = self.string_id(source_ip)
+        destination_ip_id = string_ids.get(destination_ip)
+        if destination_ip_id is None:
+            destination_ip_id = self.string_id(destination_ip)
+        source_port_id = string_ids.get(source_port)
+        if source_port_id is None:
+            source_port_id = self.string_id(source_port)
+        destination_port_id = string_ids.get(destination_port)
+        if destination_port_id is None:
+            destination_port_id = self.string_id(destination_port)
+        protocol_id = string_ids.get(protocol)
+        if protocol_id is None:
+            protocol_id = self.string_id(protocol)
+
+        return (
+            source_ip_id << 128
+            | destination_ip_id << 96
+            | source_port_id << 64
+            | destination_port_id << 32
+            | protocol_id
         )
-    )
-    return index_string
-
 
-def create_inflight_entry(flowtuple, record_meta):
-    inflight_record = {}
-    inflight_record["exporter_guid"] = record_meta["exporter_guid"]
-    exporter_mac = record_meta["exporter_mac"]
-    inflight_record["exporter_mac"] = ":".join(
-        exporter_mac[i : i + 2] for i in range(0, len(exporter_mac), 2)
-    )
-    inflight_record["version"] = record_meta["flow_version"]
-    inflight_record["flow_rule"] = record_meta["flow_rule"]
-    inflight_record["source"] = record_meta["infile"]
-    inflight_record["state"] = record_meta["state"]
-
-    inflight_record["first_seen"] = int(flowtuple["timestamp"])
-    inflight_record["last_seen"] = int(flowtuple["timestamp"])
-    inflight_record["source_ip"] = flowtuple["source_ip"]
-    inflight_record["source_port"] = int(flowtuple["source_port"])
-    inflight_record["destination_ip"] = flowtuple["destination_ip"]
-    inflight_record["destination_port"] = int(flowtuple["destination_port"])
-
-    if record_meta["flow_type"] == "vnet":
-        inflight_record["protocol"] = flowtuple["protocol"]
-        inflight_record["traffic_decision"] = "allowed"
-
-        if flowtuple["encryption_state"] == "X":
-            inflight_record["encrypted"] = 1
+    def flow_profile(self, flowtuple, record_meta):
+        """
+        Return the shared profile tuple for a new flow.  Profiles are cached on
+        the raw values they are derived from, so each is only built once per
+        input file.
+        """
+        if record_meta["infile"] != self.profile_cache_infile:
+            self.profile_cache.clear()
+            self.profile_cache_infile = record_meta["infile"]
+
+        flow_type = record_meta["flow_type"]
+        protocol_value = flowtuple[5]
+        traffic_flow = flowtuple[6]
+        if flow_type == "vnet":
+            flow_detail = flowtuple[vnet_encryption_state_field]
         else:
-            inflight_record["encrypted"] = 0
-            if flowtuple["encryption_state"] != "NX":
-                inflight_record["non_encrypted_reason"] = flowtuple["encryption_state"]
-
-    elif record_meta["flow_type"] == "vpc":
-        if flowtuple["protocol"] == "T":
-            inflight_record["protocol"] = 6
-        elif flowtuple["protocol"] == "U":
-            inflight_record["protocol"] = 17
+            flow_detail = flowtuple[vpc_traffic_decision_field]
+
+        cache_key = (
+            flow_type,
+            record_meta["exporter_guid"],
+            record_meta["exporter_mac"],
+            record_meta["flow_version"],
+            record_meta["flow_rule"],
+            protocol_value,
+            traffic_flow,
+            flow_detail,
+        )
+        profile = self.profile_cache.get(cache_key)
+        if profile is not None:
+            return profile
 
-        if flowtuple["traffic_decision"] == "A":
-            inflight_record["traffic_decision"] = "allowed"
-        elif flowtuple["traffic_decision"] == "D":
-            inflight_record["traffic_decision"] = "denied"
+        exporter_mac = record_meta["exporter_mac"]
+        exporter_mac = ":".join(
+            exporter_mac[i : i + 2] for i in range(0, len(exporter_mac), 2)
+        )
 
-    if flowtuple["traffic_flow"] == "I":
-        inflight_record["direction"] = "inbound"
-    elif flowtuple["traffic_flow"] == "O":
-        inflight_record["direction"] = "outbound"
+        protocol = ""
+        traffic_decision = ""
+        encrypted = ""
+        non_encrypted_reason = ""
+        direction = ""
 
-    inflight_record["out_packets"] = 0
-    inflight_record["out_bytes"] = 0
-    inflight_record["in_packets"] = 0
-    inflight_record["in_bytes"] = 0
+        if flow_type == "vnet":
+            protocol = protocol_value
+            traffic_decision = "allowed"
 
-    return inflight_record
+            if flow_detail == "X":
+                encrypted = 1
+            else:
+                encrypted = 0
+                if flow_detail != "NX":
+                    non_encrypted_reason = flow_detail
+
+        elif flow_type == "vpc":
+            if protocol_value == "T":
+                protocol = 6
+            elif protocol_value == "U":
+                protocol = 17
+
+            if flow_detail == "A":
+                traffic_decision = "allowed"
+            elif flow_detail == "D":
+                traffic_decision = "denied"
+
+        if traffic_flow == "I":
+            direction = "inbound"
+        elif traffic_flow == "O":
+            direction = "outbound"
+
+        profile = self.intern_profile(
+            (
+                record_meta["exporter_guid"],
+                exporter_mac,
+                record_meta["flow_version"],
+                record_meta["flow_rule"],
+                record_meta["infile"],
+                protocol,
+                direction,
+                traffic_decision,
+                encrypted,
+                non_encrypted_reason,
+            )
+        )
+        self.profile_cache[cache_key] = profile
+        return profile
+
+    def create(self, key, flowtuple, record_meta):
+        """
+        Add a new flow from its first flowtuple and return its slot.  A flow
+        still in flight for the same 5-tuple (e.g. one whose end record was
+        lost) is written out first, so it is not silently replaced.
+        """
+        if key in self.slots:
+            self.evict(key)
+
+        profile = self.flow_profile(flowtuple, record_meta)
+        state = flow_state_codes[record_meta["state"]]
+        timestamp = flowtuple[timestamp_field]
+        seen = epoch_seconds(timestamp)
+        if seen > self.clock:
+            self.clock = seen
+
+        if self.max_flows and len(self.slots) >= self.max_flows:
+            self.evict_oldest(max(1, self.max_flows // capacity_eviction_fraction))
+
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.profiles[slot] = profile
+            self.states[slot] = state
+            self.first_seen[slot] = timestamp
+            self.last_seen[slot] = timestamp
+            self.out_bytes[slot] = 0
+            self.out_packets[slot] = 0
+            self.in_bytes[slot] = 0
+            self.in_packets[slot] = 0
+        else:
+            slot = len(self.profiles)
+            self.profiles.append(profile)
+            self.states.append(state)
+            self.first_seen.append(timestamp)
+            self.last_seen.append(timestamp)
+            self.out_bytes.append(0)
+            self.out_packets.append(0)
+            self.in_bytes.append(0)
+            self.in_packets.append(0)
+
+        self.slots[key] = slot
+        return slot
+
+    def get_or_create(self, key, flowtuple, record_meta):
+        """
+        Return the slot of an existing flow, or create one if this is the first
+        flowtuple seen for it (e.g. a continuation without a begin).
+        """
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.create(key, flowtuple, record_meta)
+        return slot
+
+    def update(self, slot, flowtuple, state):
+        self.states[slot] = flow_state_codes[state]
+
+        timestamp = flowtuple[timestamp_field]
+        seen = epoch_seconds(timestamp)
+        if seen > self.clock:
+            self.clock = seen
+        self.last_seen[slot] = timestamp
+
+        out_packets, out_bytes, in_packets, in_bytes = flowtuple[9:13]
+        self.out_bytes[slot] += out_bytes
+        self.out_packets[slot] += out_packets
+        self.in_bytes[slot] += in_bytes
+        self.in_packets[slot] += in_packets
+
+    def set_traffic_decision(self, slot, traffic_decision):
+        profile = self.profiles[slot]
+        self.profiles[slot] = self.intern_profile(
+            profile[:7] + (traffic_decision,) + profile[8:]
+        )
 
+    def has_statistics(self, slot):
+        # omit flows without statistics (e.g. started but not continued/ended)
+        return (
+            self.out_bytes[slot]
+            + self.out_packets[slot]
+            + self.in_bytes[slot]
+            + self.in_packets[slot]
+            != 0
+        )
 
-def update_inflight_record(inflight_record, flowtuple, state):
-    inflight_record["state"] = state
+    def csv_row(self, key, slot):
+        """Return a flow as a list of values in output_csv_columns order."""
+        strings = self.strings
+        (
+            exporter_guid,
+            exporter_mac,
+            version,
+            flow_rule,
+            source,
+            protocol,
+            direction,
+            traffic_decision,
+            encrypted,
+            non_encrypted_reason,
+        ) = self.profiles[slot]
+
+        return [
+            exporter_guid,
+            exporter_mac,
+            version,
+            flow_rule,
+            source,
+            flow_states[self.states[slot]],
+            self.first_seen[slot],
+            self.last_seen[slot],
+            strings[key >> 128],
+            int(strings[(key >> 64) & 0xFFFFFFFF]),
+            strings[(key >> 96) & 0xFFFFFFFF],
+            int(strings[(key >> 32) & 0xFFFFFFFF]),
+            protocol,
+            self.out_bytes[slot],
+            self.out_packets[slot],
+            self.in_bytes[slot],
+            self.in_packets[slot],
+            direction,
+            traffic_decision,
+            encrypted,
+            non_encrypted_reason,
+        ]
+
+    def release(self, key):
+        """Remove a flow from the table without writing it out."""
+        slot = self.slots.pop(key)
+        self.profiles[slot] = None
+        self.free_slots.append(slot)
+
+    def remove(self, key):
+        """Remove a flow from the table and return its output row."""
+        row = self.csv_row(key, self.slots[key])
+        self.release(key)
+        return row
+
+    def complete(self, key):
+        """Write out a flow that has ended or been denied and remove it."""
+        self.writer.writerow(self.remove(key))
+        self.flows_written += 1
+
+    def evict(self, key):
+        """
+        Remove a flow that is still in flight, writing it out only if it has
+        statistics (e.g. omit flows that were started but not continued/ended)
+        """
+        if self.has_statistics(self.slots[key]):
+            self.complete(key)
+        else:
+            self.release(key)
+
+    def evict_idle(self):
+        """Evict all flows that have not been seen within idle_timeout seconds."""
+        cutoff = self.clock - self.idle_timeout
+        last_seen = self.last_seen
+        idle_flows = [
+            key
+            for key, slot in self.slots.items()
+            if epoch_seconds(last_seen[slot]) < cutoff
+        ]
+        for key in idle_flows:
+            self.evict(key)
+        self.idle_evictions += len(idle_flows)
+
+    def evict_oldest(self, count):
+        """Evict the count flows that were seen least recently."""
+        last_seen = self.last_seen
+        oldest_flows = heapq.nsmallest(
+            count,
+            self.slots.items(),
+            key=lambda item: epoch_seconds(last_seen[item[1]]),
+        )
+        for key, slot in oldest_flows:
+            self.evict(key)
+        self.capacity_evictions += len(oldest_flows)
+
+    def expire(self):
+        """
+        Evict idle flows, and compact the string and profile tables once they
+        have grown enough.  The table is only scanned for idle flows once the
+        log clock has advanced by a quarter of the idle timeout since the last
+        scan.
+        """
+        if self.idle_timeout and self.clock - self.last_expiry >= max(
+            1, self.idle_timeout // 4
+        ):
+            self.last_expiry = self.clock
+            self.evict_idle()
+
+        if (
+            len(self.strings) > self.compaction_size
+            or len(self.interned_profiles) > self.compaction_size
+        ):
+            self.compact()
+
+    def compact(self):
+        """
+        Rebuild the string and profile tables from the flows in flight, which
+        releases the values that were only used by flows already removed.
+        Flow keys are built from string ids, so every key is renumbered.
+        """
+        strings = self.strings
+        self.string_ids = {}
+        self.strings = []
+        self.slots = {
+            self.flow_key(
+                (
+                    None,
+                    strings[key >> 128],
+                    strings[(key >> 96) & 0xFFFFFFFF],
+                    strings[(key >> 64) & 0xFFFFFFFF],
+                    strings[(key >> 32) & 0xFFFFFFFF],
+                    strings[key & 0xFFFFFFFF],
+                )
+            ): slot
+            for key, slot in self.slots.items()
+        }
+
+        self.interned_profiles = {}
+        for profile in self.profiles:
+            if profile is not None:
+                self.intern_profile(profile)
+        self.profile_cache.clear()
+
+        self.compaction_size = max(
+            min_compaction_size,
+            2 * len(self.strings),
+            2 * len(self.interned_profiles),
+        )
 
-    inflight_record["last_seen"] = int(flowtuple["timestamp"])
-    inflight_record["out_bytes"] += int(flowtuple["out_bytes"])
-    inflight_record["out_packets"] += int(flowtuple["out_packets"])
-    inflight_record["in_bytes"] += int(flowtuple["in_bytes"])
-    inflight_record["in_packets"] += int(flowtuple["in_packets"])
+    def flush(self):
+        """Evict every remaining flow at the end of the run."""
+        for key in list(self.slots):
+            self.evict(key)
+
+
+# when converting in parallel, each input file is parsed once and its
+# flowtuples are split between shards by the hash of their 5-tuple, and each
+# shard is converted by its own long-lived process with its own flow table
+shard_count = 1
+
+
+def init_worker(new_shard_count):
+    global shard_count
+    # ctrl-c is handled by the main process, which terminates the pool and the
+    # shard processes
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shard_count = new_shard_count
+
+
+def flowtuple_shard(flowtuple):
+    """
+    Return the shard that owns the flow a raw flowtuple string belongs to.  A
+    stable hash is used so the result does not depend on the worker process.
+    """
+    flow_id = ",".join(flowtuple.split(",", 6)[1:6])
+    return zlib.crc32(flow_id.encode()) % shard_count
+
+
+def flow_log_sort_key(infile):
+    """
+    Order input files by the hour they cover.  Azure stores flow logs in blobs
+    named .../y=YYYY/m=MM/d=DD/h=HH/m=00/..., and files that do not follow
+    this layout are ordered by their modification time.
+    """
+    path_match = blob_path_regex.search(infile.replace(os.sep, "/"))
+    if path_match:
+        file_time = datetime(
+            *[int(value) for value in path_match.groups()], tzinfo=timezone.utc
+        ).timestamp()
+    else:
+        file_time = os.path.getmtime(infile)
+    return (file_time, infile)
+
+
+def decode_flowtuple(raw_flowtuple):
+    """
+    Split one raw flowtuple string into a list of fields, converting the
+    timestamp and the four packet and byte counters to integers.  Counters
+    that are empty or absent (e.g. on "B" records or version 1 NSG flow logs)
+    become 0, and missing text fields become "".
+    """
+    flowtuple = raw_flowtuple.split(",")
+    flowtuple[0] = int(flowtuple[0])
+    if len(flowtuple) < 9:
+        flowtuple.extend([""] * (9 - len(flowtuple)))
+    counters = [int(value) if value else 0 for value in flowtuple[9:13]]
+    flowtuple[9:] = counters + [0] * (4 - len(counters))
+    return flowtuple
+
+
+def decode_flowtuples(raw_flowtuples):
+    """
+    Decode a list of raw flowtuple strings.  The common case of complete
+    13-field tuples is handled in a single pass, and any list that does not
+    fit it is decoded one tuple at a time with decode_flowtuple().
+    """
+    try:
+        return [
+            [
+                int(timestamp),
+                source_ip,
+                destination_ip,
+                source_port,
+                destination_port,
+                protocol,
+                traffic_flow,
+                field_7,
+                field_8,
+                int(out_packets),
+                int(out_bytes),
+                int(in_packets),
+                int(in_bytes),
+            ]
+            for (
+                timestamp,
+                source_ip,
+                destination_ip,
+                source_port,
+                destination_port,
+                protocol,
+                traffic_flow,
+                field_7,
+                field_8,
+                out_packets,
+                out_bytes,
+                in_packets,
+                in_bytes,
+            ) in (raw_flowtuple.split(",") for raw_flowtuple in raw_flowtuples)
+        ]
+    except ValueError:
+        return [decode_flowtuple(raw_flowtuple) for raw_flowtuple in raw_flowtuples]
+
+
+def iter_records_array(stream):
+    """
+    Walk a top-level JSON object and yield each element of its "records" array.
+    All other top-level values are decoded and discarded.  Returns True if a
+    "records" array was found.
+    """
+    found_records = False
+
+    stream.expect("{")
+    if stream.peek() == "}":
+        stream.pos += 1
+        return found_records
+
+    while True:
+        key = stream.decode()
+        stream.expect(":")
+
+        if key == "records" and stream.peek() == "[":
+            found_records = True
+            stream.expect("[")
+
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.decode()
+                    if stream.peek() == ",":
+                        stream.pos += 1
+                        continue
+                    stream.expect("]")
+                    break
 
-    return inflight_record
+        else:
+            stream.decode()
+
+        if stream.peek() == ",":
+            stream.pos += 1
+            continue
+        stream.expect("}")
+        break
+
+    return found_records
+
+
+def read_flow_records(infile):
+    """
+    Yield the flow log records from a file, which may be compressed and may
+    hold several JSON objects (e.g. one per line).  Each object's "records"
+    array is decoded incrementally, so even multi-megabyte single-line blobs
+    are never held in memory as a whole.
+    """
+    try:
+        input_file = sof_elk_io.open_input(infile)
+    except OSError as e:
+        sys.stderr.write(
+            "- ERROR: Could not open %s (%s). Skipping file.\n" % (infile, e)
+        )
+        return
 
+    with input_file:
+        stream = JSONStream(input_file)
+        object_num = 0
 
-def process_azure_flow(infile, outfh):
-    input_file = open(infile, "r")
+        try:
+            while stream.peek():
+                object_num += 1
 
-    inflight_flows = {}
-    writer = csv.DictWriter(outfh, fieldnames=output_csv_columns)
+                if stream.peek() != "{":
+                    sys.stderr.write(
+                        "- ERROR: Did not detect JSON content in %s, object %d. Skipping rest of file.\n"
+                        % (infile, object_num)
+                    )
+                    return
 
-    input_linenum = 0
-    for line in input_file:
-        input_linenum += 1
+                found_records = yield from stats.timed(
+                    iter_records_array(stream), "decode"
+                )
+                if not found_records:
+                    sys.stderr.write(
+                        "- ERROR: JSON did not contain a 'records' field in %s, object %d. Skipping rest of file.\n"
+                        % (infile, object_num)
+                    )
+                    return
 
-        try:
-            rawjson = json.loads(line)
-        except json.decoder.JSONDecodeError:
+        except (sof_elk_json.JSONDecodeError, UnicodeDecodeError, EOFError, OSError):
             sys.stderr.write(
-                "- ERROR: Did not detect JSON content in %s, line %d. Skipping line.\n"
-                % (infile, input_linenum)
+                "- ERROR: Could not process JSON content in %s, object %d. Skipping rest of file.\n"
+                % (infile, object_num)
             )
-            return
 
-        if not "records" in rawjson:
+
+def vnet_flow_groups(record, infile):
+    """
+    Yield a (record_meta, raw_flowtuples) pair for each flow group in a
+    Virtual Network Flow log record.
+    """
+    exporter_guid = record["flowLogGUID"]
+    exporter_mac = record["macAddress"].lower()
+    flow_version = int(record["flowLogVersion"])
+
+    for flowset in record["flowRecords"]["flows"]:
+        for flowgroup in flowset["flowGroups"]:
+            record_meta = {
+                "flow_type": "vnet",
+                "exporter_guid": exporter_guid,
+                "exporter_mac": exporter_mac,
+                "flow_version": flow_version,
+                "flow_rule": flowgroup["rule"],
+                "infile": infile,
+            }
+            yield record_meta, flowgroup["flowTuples"]
+
+
+def vpc_flow_groups(record, infile):
+    """
+    Yield a (record_meta, raw_flowtuples) pair for each flowset in a legacy
+    VPC Flow log record.
+    """
+    exporter_guid = record["systemId"]
+    flow_version = int(record["properties"]["Version"])
+
+    for ruleset in record["properties"]["flows"]:
+        for flowset in ruleset["flows"]:
+            record_meta = {
+                "flow_type": "vpc",
+                "exporter_guid": exporter_guid,
+                "exporter_mac": flowset["mac"].lower(),
+                "flow_version": flow_version,
+                "flow_rule": ruleset["rule"],
+                "infile": infile,
+            }
+            yield record_meta, flowset["flowTuples"]
+
+
+def read_flow_groups(infile):
+    """
+    Yield the flowtuples of each flow log record in a file as a list of
+    (record_meta, raw_flowtuples) pairs.
+    """
+    for record in read_flow_records(infile):
+        # this is a new vnet flow format
+        if record["category"] == "FlowLogFlowEvent":
+            yield list(vnet_flow_groups(record, infile))
+
+        # this is a legacy VPC flow format
+        elif record["category"] == "NetworkSecurityGroupFlowEvent":
+            yield list(vpc_flow_groups(record, infile))
+
+        else:
             sys.stderr.write(
-                "- ERROR: JSON did not contain a 'records' field in %s, line %d. Skipping line.\n"
-                % (infile, input_linenum)
+                "- ERROR: Could not determine flow log type from a record in %s - skipping.\n"
+                % (infile)
             )
-            return
 
-        for record in rawjson["records"]:
-            # this is a new vnet flow format
-            if record["category"] == "FlowLogFlowEvent":
-                process_azure_vnet_flow(record, writer, inflight_flows, infile)
 
-            # this is a legacy VPC flow format
-            elif record["category"] == "NetworkSecurityGroupFlowEvent":
-                process_azure_vpc_flow(record, writer, inflight_flows, infile)
+def process_flow_groups(flow_groups, inflight_flows):
+    """Add the flowtuples from one flow log record to the flow table."""
+    for record_meta, raw_flowtuples in flow_groups:
+        with stats.phase("decode"):
+            flowtuples = decode_flowtuples(raw_flowtuples)
 
-            else:
-                sys.stderr.write(
-                    "- ERROR: Could not determine flow log type from a record in %s - skipping.\n"
-                    % (infile)
-                )
+        if record_meta["flow_type"] == "vnet":
+            process_vnet_flowtuples(flowtuples, record_meta, inflight_flows)
+        else:
+            process_vpc_flowtuples(flowtuples, record_meta, inflight_flows)
 
-        # finish out any still in flight, but omit any without statistics (e.g. started but not continued/ended)
-        for flow in inflight_flows.keys():
-            if (
-                inflight_flows[flow]["out_bytes"]
-                + inflight_flows[flow]["out_bytes"]
-                + inflight_flows[flow]["in_bytes"]
-                + inflight_flows[flow]["in_packets"]
-                != 0
-            ):
-                writer.writerow(inflight_flows[flow])
-
-    input_file.close()
-
-
-def process_azure_vnet_flow(record, output_csv_writer, inflight_flows, infile):
-    record_meta = {
-        "flow_type": "vnet",
-        "exporter_guid": record["flowLogGUID"],
-        "exporter_mac": record["macAddress"].lower(),
-        "flow_version": int(record["flowLogVersion"]),
-        "infile": infile,
-    }
-    for flowset in record["flowRecords"]["flows"]:
-        for flowgroup in flowset["flowGroups"]:
-            record_meta["flow_rule"] = flowgroup["rule"]
+    # flows still in flight carry over to the next record and file until
+    # they end, go idle, or are pushed out by the flow table's size limit
+    inflight_flows.expire()
 
-            flowtuples = csv.DictReader(flowgroup["flowTuples"], vnet_flow_fields)
 
-            for flowtuple in flowtuples:
-                inflight_index = create_inflight_index(flowtuple)
+def process_azure_flow(infile, inflight_flows):
+    for flow_groups in read_flow_groups(infile):
+        process_flow_groups(flow_groups, inflight_flows)
 
-                if flowtuple["flow_state"] == "B":
-                    # we are at the start of the flow
-                    # create the "in flight" tracker
-                    record_meta["state"] = "initial"
-                    inflight_flows[inflight_index] = create_inflight_entry(
-                        flowtuple, record_meta
-                    )
 
-                elif flowtuple["flow_state"] == "C":
-                    # continuation of flow record
-                    record_meta["state"] = "partial"
+def process_vnet_flowtuples(flowtuples, record_meta, inflight_flows):
+    """Add decoded Virtual Network Flow log flowtuples to the flow table."""
+    for flowtuple in flowtuples:
+        inflight_index = inflight_flows.flow_key(flowtuple)
+        flow_state = flowtuple[vnet_flow_state_field]
 
-                    # if there is no "in flight" tracker yet, we caught a random continue without a begin
-                    # create an empty record to start from
-                    if not inflight_index in inflight_flows:
-                        inflight_flows[inflight_index] = create_inflight_entry(
-                            flowtuple, record_meta
-                        )
+        if flow_state == "B":
+            # we are at the start of the flow
+            # create the "in flight" tracker
+            record_meta["state"] = "initial"
+            inflight_flows.create(inflight_index, flowtuple, record_meta)
 
-                    # update the "in flight" tracker
-                    inflight_flows[inflight_index] = update_inflight_record(
-                        inflight_flows[inflight_index], flowtuple, record_meta["state"]
-                    )
+        elif flow_state == "C":
+            # continuation of flow record
+            record_meta["state"] = "partial"
 
-                elif flowtuple["flow_state"] == "E":
-                    # close out the flow
-                    record_meta["state"] = "complete"
+            # if there is no "in flight" tracker yet, we caught a random continue without a begin
+            # create an empty record to start from
+            slot = inflight_flows.get_or_create(inflight_index, flowtuple, record_meta)
 
-                    # if there is no "in flight" tracker yet, we caught a random end without a begin
-                    # create an empty record to start from
-                    if not inflight_index in inflight_flows:
-                        inflight_flows[inflight_index] = create_inflight_entry(
-                            flowtuple, record_meta
-                        )
+            # update the "in flight" tracker
+            inflight_flows.update(slot, flowtuple, record_meta["state"])
 
-                    # update the "in flight" tracker
-                    inflight_flows[inflight_index] = update_inflight_record(
-                        inflight_flows[inflight_index], flowtuple, record_meta["state"]
-                    )
+        elif flow_state == "E":
+            # close out the flow
+            record_meta["state"] = "complete"
 
-                    # write to output file and remove the "in flight" tracker
-                    output_csv_writer.writerow(inflight_flows.pop(inflight_index, None))
+            # if there is no "in flight" tracker yet, we caught a random end without a begin
+            # create an empty record to start from
+            slot = inflight_flows.get_or_create(inflight_index, flowtuple, record_meta)
 
-                elif flowtuple["flow_state"] == "D":
-                    # denied flow
-                    record_meta["state"] = "denied"
+            # update the "in flight" tracker
+            inflight_flows.update(slot, flowtuple, record_meta["state"])
 
-                    # if there is no "in flight" tracker yet, we caught a random deny without a begin
-                    # create an empty record to start from
-                    if not inflight_index in inflight_flows:
-                        inflight_flows[inflight_index] = create_inflight_entry(
-                            flowtuple, record_meta
-                        )
+            # write to output file and remove the "in flight" tracker
+            inflight_flows.complete(inflight_index)
 
-                    # update the "in flight" tracker
-                    inflight_flows[inflight_index] = update_inflight_record(
-                        inflight_flows[inflight_index], flowtuple, record_meta["state"]
-                    )
+        elif flow_state == "D":
+            # denied flow
+            record_meta["state"] = "denied"
 
-                    inflight_flows[inflight_index]["traffic_decision"] = record_meta[
-                        "state"
-                    ]
+            # if there is no "in flight" tracker yet, we caught a random deny without a begin
+            # create an empty record to start from
+            slot = inflight_flows.get_or_create(inflight_index, flowtuple, record_meta)
 
-                    # write to output file and remove the "in flight" tracker
-                    output_csv_writer.writerow(inflight_flows.pop(inflight_index, None))
+            # update the "in flight" tracker
+            inflight_flows.update(slot, flowtuple, record_meta["state"])
 
+            inflight_flows.set_traffic_decision(slot, record_meta["state"])
 
-def process_azure_vpc_flow(record, output_csv_writer, inflight_flows, infile):
-    # set record-level metadata values
-    record_meta = {
-        "flow_type": "vpc",
-        "exporter_guid": record["systemId"],
-        "flow_version": int(record["properties"]["Version"]),
-        "infile": infile,
-    }
+            # write to output file and remove the "in flight" tracker
+            inflight_flows.complete(inflight_index)
 
-    for ruleset in record["properties"]["flows"]:
-        record_meta["flow_rule"] = ruleset["rule"]
 
-        for flowset in ruleset["flows"]:
-            # process all flow records in flowset['flowTuples']
-            record_meta["exporter_mac"] = flowset["mac"].lower()
-            flowtuples = csv.DictReader(sorted(flowset["flowTuples"]), vpc_flow_fields)
-
-            for flowtuple in flowtuples:
-                inflight_index = create_inflight_index(flowtuple)
-
-                if flowtuple["flow_state"] == "B":
-                    # we are at the start of the flow
-                    record_meta["state"] = "initial"
-                    inflight_flows[inflight_index] = create_inflight_entry(
-                        flowtuple, record_meta
+def process_vpc_flowtuples(flowtuples, record_meta, inflight_flows):
+    """Add decoded legacy VPC Flow log flowtuples to the flow table."""
+    # process tuples in time order, and records for the same flow within
+    # the same second in B/C/E order
+    flowtuples.sort(
+        key=lambda flowtuple: (
+            flowtuple[timestamp_field],
+            flowtuple[vpc_flow_state_field],
+        )
+    )
+
+    for flowtuple in flowtuples:
+        inflight_index = inflight_flows.flow_key(flowtuple)
+        flow_state = flowtuple[vpc_flow_state_field]
+
+        if flow_state == "B":
+            # we are at the start of the flow
+            record_meta["state"] = "initial"
+            inflight_flows.create(inflight_index, flowtuple, record_meta)
+
+        elif flow_state == "C":
+            # continuation of flow record
+            record_meta["state"] = "partial"
+
+            # if there is no "in flight" tracker yet, we caught a random continue without a begin
+            # create an empty record to start from
+            slot = inflight_flows.get_or_create(inflight_index, flowtuple, record_meta)
+
+            # update the "in flight" tracker
+            inflight_flows.update(slot, flowtuple, record_meta["state"])
+
+        elif flow_state == "E":
+            # close out the flow
+            record_meta["state"] = "complete"
+
+            # if there is no "in flight" tracker yet, we caught a random end without a begin
+            # create an empty record to start from
+            slot = inflight_flows.get_or_create(inflight_index, flowtuple, record_meta)
+
+            # update the "in flight" tracker
+            inflight_flows.update(slot, flowtuple, record_meta["state"])
+
+            # write to output file and remove the "in flight" tracker
+            inflight_flows.complete(inflight_index)
+
+
+def partition_flow_file(infile):
+    """
+    Parse one input file and split its flowtuples between the shards,
+    returning each shard's records pickled for its spool file (or b"" if it
+    owns none of them) and the worker's statistics.
+    """
+    shard_records = [[] for shard in range(shard_count)]
+
+    with stats.phase("transform"):
+        for flow_groups in read_flow_groups(infile):
+            record_groups = [[] for shard in range(shard_count)]
+            for record_meta, raw_flowtuples in flow_groups:
+                shard_flowtuples = [[] for shard in range(shard_count)]
+                for raw_flowtuple in raw_flowtuples:
+                    shard_flowtuples[flowtuple_shard(raw_flowtuple)].append(
+                        raw_flowtuple
                     )
+                for shard, flowtuples in enumerate(shard_flowtuples):
+                    if flowtuples:
+                        record_groups[shard].append((record_meta, flowtuples))
 
-                elif flowtuple["flow_state"] == "C":
-                    # continuation of flow record
-                    record_meta["state"] = "partial"
+            for shard, flow_groups in enumerate(record_groups):
+                if flow_groups:
+                    shard_records[shard].append(flow_groups)
 
-                    # if there is no "in flight" tracker yet, we caught a random continue without a begin
-                    # create an empty record to start from
-                    if not inflight_index in inflight_flows:
-                        inflight_flows[inflight_index] = create_inflight_entry(
-                            flowtuple, record_meta
-                        )
+        shard_data = [
+            pickle.dumps(records, pickle.HIGHEST_PROTOCOL) if records else b""
+            for records in shard_records
+        ]
 
-                    # update the "in flight" tracker
-                    inflight_flows[inflight_index] = update_inflight_record(
-                        inflight_flows[inflight_index], flowtuple, record_meta["state"]
-                    )
+    stats.add_files()
+    return shard_data, stats.take()
 
-                elif flowtuple["flow_state"] == "E":
-                    # close out the flow
-                    record_meta["state"] = "complete"
 
-                    # if there is no "in flight" tracker yet, we caught a random end without a begin
-                    # create an empty record to start from
-                    if not inflight_index in inflight_flows:
-                        inflight_flows[inflight_index] = create_inflight_entry(
-                            flowtuple, record_meta
-                        )
+def read_shard_queue(shard_queue):
+    """Yield each record sent to a shard, in order, until the end of the input."""
+    while True:
+        shard_data = shard_queue.get()
+        if shard_data is None:
+            return
+        yield from pickle.loads(shard_data)
+
+
+def convert_shard(shard_queue, output_queue, idle_timeout, max_flows):
+    """
+    Convert the flows owned by one shard as its records arrive on shard_queue.
+    The CSV output is sent to output_queue as ("output", text) blocks of about
+    output_block_size characters, followed by ("done", (counters, stats)) with
+    the flow table's counters and the process's statistics.  If the conversion
+    fails, ("error", text) carries the traceback instead.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        output = io.StringIO()
+        inflight_flows = FlowTable(
+            csv.writer(output), idle_timeout=idle_timeout, max_flows=max_flows
+        )
 
-                    # update the "in flight" tracker
-                    inflight_flows[inflight_index] = update_inflight_record(
-                        inflight_flows[inflight_index], flowtuple, record_meta["state"]
-                    )
+        def send_output():
+            with stats.phase("wait"):
+                output_queue.put(("output", output.getvalue()))
+            output.seek(0)
+            output.truncate()
+
+        with stats.phase("transform"):
+            for flow_groups in stats.timed(read_shard_queue(shard_queue), "wait"):
+                process_flow_groups(flow_groups, inflight_flows)
+                if output.tell() >= output_block_size:
+                    send_output()
+            inflight_flows.flush()
+        send_output()
+
+        stats.add_records(inflight_flows.flows_written)
+        counters = (
+            inflight_flows.flows_written,
+            inflight_flows.idle_evictions,
+            inflight_flows.capacity_evictions,
+        )
+        output_queue.put(("done", (counters, stats.take())))
+
+    except Exception:
+        output_queue.put(("error", traceback.format_exc()))
+
+
+def feed_shards(pool, input_files, shard_queues, parse_stats, verbose):
+    """
+    Parse the input files in the worker pool and send each shard its share of
+    their flowtuples.  Files are sent in input order, so every shard sees its
+    flowtuples in the same order as a single-process run, and at most
+    parse_window files per shard are parsed ahead of them.  The end of the
+    input is always sent, so the shards finish even if parsing fails.  This
+    runs in its own thread while the main thread writes the shards' output.
+    """
+    pending = collections.deque()
+    window = parse_window * len(shard_queues)
+
+    def send_file():
+        fileno, infile, result = pending.popleft()
+        shard_data, worker_stats = result.get()
+        if verbose:
+            print("- Parsing file: %s (%d of %d)" % (infile, fileno, len(input_files)))
+        for shard_queue, data in zip(shard_queues, shard_data):
+            if data:
+                shard_queue.put(data)
+        parse_stats.append(worker_stats)
+
+    try:
+        for fileno, infile in enumerate(input_files, 1):
+            pending.append(
+                (fileno, infile, pool.apply_async(partition_flow_file, (infile,)))
+            )
+            if len(pending) >= window:
+                send_file()
+        while pending:
+            send_file()
+
+    finally:
+        for shard_queue in shard_queues:
+            shard_queue.put(None)
 
-                    # write to output file and remove the "in flight" tracker
-                    output_csv_writer.writerow(inflight_flows.pop(inflight_index, None))
-
-
-parser = argparse.ArgumentParser(
-    description="Process Azure Flow logs into a format that is consistent with other SOF-ELK(R) NetFlow entries and place them into an output file.  Both Virtual Network Flow Logs and legacy VPC Flow Logs are supported."
-)
-parser.add_argument(
-    "-r",
-    "--read",
-    dest="infile",
-    help="Azure Flow log file to read or a directory containing JSON-formatted Azure Flow log files.",
-)
-parser.add_argument(
-    "-w",
-    "--write",
-    dest="outfile",
-    help="File to create containing processed Azure Flow data.",
-)
-parser.add_argument(
-    "-f",
-    "--force",
-    dest="force_outfile",
-    help="Force creating an output file in a location other than the default SOF-ELK ingest location, %s"
-    % (default_destdir),
-    default=False,
-    action="store_true",
-)
-parser.add_argument(
-    "-a",
-    "--append",
-    dest="append",
-    help="Append to the output file if it exists.",
-    default=False,
-    action="store_true",
-)
-parser.add_argument(
-    "-v",
-    "--verbose",
-    dest="verbose",
-    help="Display progress and related status information while parsing input files.",
-    default=False,
-    action="store_true",
-)
-args = parser.parse_args()
-
-if args.infile == None:
-    sys.stderr.write("ERROR: No input file or root directory specified.\n")
-    sys.exit(2)
-
-if args.outfile == None:
-    sys.stderr.write("ERROR: No output file specified.\n")
-    sys.exit(2)
-elif not args.outfile.startswith(default_destdir) and not args.force_outfile:
-    sys.stderr.write(
-        'ERROR: Output file is not in %s, which is the SOF-ELK ingest location. Use "-f" to force creating a file in this location.\n'
-        % (default_destdir)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process Azure Flow logs into a format that is consistent with other SOF-ELK(R) NetFlow entries and place them into an output file.  Both Virtual Network Flow Logs and legacy VPC Flow Logs are supported."
+    )
+    parser.add_argument(
+        "-r",
+        "--read",
+        dest="infile",
+        help="Azure Flow log file to read or a directory containing JSON-formatted Azure Flow log files, which may be compressed with gzip, bzip2, xz, or zstd.",
+    )
+    parser.add_argument(
+        "-w",
+        "--write",
+        dest="outfile",
+        help="File to create containing processed Azure Flow data.  Names ending in .gz are written gzip-compressed.",
     )
-    sys.exit(2)
-
-input_files = []
-if os.path.isfile(args.infile):
-    input_files.append(args.infile)
-elif os.path.isdir(args.infile):
-    for root, dirs, files in os.walk(args.infile):
-        for name in files:
-            input_files.append(os.path.join(root, name))
-else:
-    sys.stderr.write("No input files could be processed.  Exiting.\n")
-    sys.exit(4)
-
-if args.verbose:
-    print("Found %d files to parse." % (len(input_files)))
-    print()
-
-if os.path.isfile(args.outfile) and args.append == True:
-    outfh = open(args.outfile, "a")
-if os.path.isfile(args.outfile) and args.append == False:
-    sys.stderr.write(
-        'ERROR: Output file %s already exists. Use "-a" to append to the file at this location or specify a different filename.\n'
-        % (args.outfile)
+    parser.add_argument(
+        "-f",
+        "--force",
+        dest="force_outfile",
+        help="Force creating an output file in a location other than the default SOF-ELK ingest location, %s"
+        % (default_destdir),
+        default=False,
+        action="store_true",
     )
-    sys.exit(3)
-else:
-    outfh = open(args.outfile, "w")
+    parser.add_argument(
+        "-a",
+        "--append",
+        dest="append",
+        help="Append to the output file if it exists.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="Number of worker processes.  This many workers parse the input files and split their flowtuples by the hash of their 5-tuple between as many shard processes, each of which converts the flows it owns while the input is still being parsed.  Their output is written to the output file as it is produced, so flows from different shards are interleaved.  Use 0 to run one worker per CPU core. (Default: 1)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        dest="idle_timeout",
+        help="Write out and forget an in-flight flow once no record has been seen for it in this many seconds of log time.  Use 0 to keep flows in flight until the end of the run.  (Default: %d)"
+        % (default_idle_timeout),
+        default=default_idle_timeout,
+        type=int,
+    )
+    parser.add_argument(
+        "--max-flows",
+        dest="max_flows",
+        help="Maximum number of in-flight flows to hold in memory.  When reached, the least recently seen flows are written out early.  Use 0 for no limit.  (Default: %d)"
+        % (default_max_flows),
+        default=default_max_flows,
+        type=int,
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="verbose",
+        help="Display progress and related status information while parsing input files.",
+        default=False,
+        action="store_true",
+    )
+    sof_elk_stats.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.infile == None:
+        sys.stderr.write("ERROR: No input file or root directory specified.\n")
+        sys.exit(2)
+
+    if args.outfile == None:
+        sys.stderr.write("ERROR: No output file specified.\n")
+        sys.exit(2)
+    elif not args.outfile.startswith(default_destdir) and not args.force_outfile:
+        sys.stderr.write(
+            'ERROR: Output file is not in %s, which is the SOF-ELK ingest location. Use "-f" to force creating a file in this location.\n'
+            % (default_destdir)
+        )
+        sys.exit(2)
+
+    input_files = []
+    if os.path.isfile(args.infile):
+        input_files.append(args.infile)
+    elif os.path.isdir(args.infile):
+        for root, dirs, files in os.walk(args.infile):
+            for name in files:
+                input_files.append(os.path.join(root, name))
+    else:
+        sys.stderr.write("No input files could be processed.  Exiting.\n")
+        sys.exit(4)
 
-fileno = 0
-for infile in input_files:
-    fileno = fileno + 1
     if args.verbose:
-        print("- Parsing file: %s (%d of %d)" % (infile, fileno, len(input_files)))
+        print("Found %d files to parse." % (len(input_files)))
+        print()
+
+    if args.idle_timeout < 0 or args.max_flows < 0:
+        sys.stderr.write("ERROR: --idle-timeout and --max-flows cannot be negative.\n")
+        sys.exit(2)
+
+    if args.jobs < 0:
+        sys.stderr.write("ERROR: The number of jobs cannot be negative.\n")
+        sys.exit(2)
+    elif args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+
+    sof_elk_stats.start(args, "azure-flow2sof-elk.py")
+
+    if os.path.isfile(args.outfile) and args.append == True:
+        outfh = sof_elk_io.open_output(args.outfile, append=True)
+    elif os.path.isfile(args.outfile) and args.append == False:
+        sys.stderr.write(
+            'ERROR: Output file %s already exists. Use "-a" to append to the file at this location or specify a different filename.\n'
+            % (args.outfile)
+        )
+        sys.exit(3)
+    else:
+        # the output file only appears under its own name once it is complete
+        outfh = sof_elk_io.open_output(args.outfile)
+
+    with outfh:
+        input_files.sort(key=flow_log_sort_key)
+
+        if args.jobs > 1:
+            if args.verbose:
+                print(
+                    "Converting %d files with %d worker processes."
+                    % (len(input_files), args.jobs)
+                )
 
-    process_azure_flow(infile, outfh)
+            # shards receive their flowtuples and return their output through
+            # bounded queues, so neither is ever held in full in memory or on
+            # disk, and a thread feeds the shards while this one writes
+            shard_queues = [
+                multiprocessing.Queue(shard_queue_size) for shard in range(args.jobs)
+            ]
+            output_queue = multiprocessing.Queue(shard_queue_size * args.jobs)
+            shards = [
+                multiprocessing.Process(
+                    target=convert_shard,
+                    args=(
+                        shard_queue,
+                        output_queue,
+                        args.idle_timeout,
+                        args.max_flows,
+                    ),
+                )
+                for shard_queue in shard_queues
+            ]
+            pool = multiprocessing.Pool(
+                processes=args.jobs,
+                initializer=init_worker,
+                initargs=(args.jobs,),
+            )
+            parse_stats = []
+            feeder_errors = []
 
-print("Output complete.")
-if not args.outfile.startswith(default_destdir):
-    print(
-        "You must move/copy the generated file to the /logstash/nfarch/ directory before SOF-ELK can process it."
-    )
-else:
-    print(
-        "SOF-ELK should now be processing the generated file - check system load and the Kibana interface to confirm."
-    )
+            def feed():
+                try:
+                    feed_shards(
+                        pool, input_files, shard_queues, parse_stats, args.verbose
+                    )
+                except BaseException as e:
+                    feeder_errors.append(e)
+
+            feeder = threading.Thread(target=feed, daemon=True)
+            shard_results = []
+            try:
+                for shard in shards:
+                    shard.start()
+                feeder.start()
+
+                while len(shard_results) < len(shards):
+                    with stats.phase("wait"):
+                        message, payload = output_queue.get()
+                    if message == "output":
+                        with stats.phase("write"):
+                            outfh.write(payload)
+                    elif message == "done":
+                        shard_results.append(payload)
+                    else:
+                        sys.stderr.write(
+                            "ERROR: A shard process failed.  Exiting.\n%s" % (payload)
+                        )
+                        sys.exit(1)
+
+                feeder.join()
+                if feeder_errors:
+                    raise feeder_errors[0]
+                for shard in shards:
+                    shard.join()
+
+            finally:
+                pool.terminate()
+                pool.join()
+                for shard_queue in shard_queues:
+                    shard_queue.cancel_join_thread()
+                for shard in shards:
+                    if shard.is_alive():
+                        shard.terminate()
+                    if shard.pid is not None:
+                        shard.join()
+
+            for worker_stats in parse_stats:
+                stats.merge(worker_stats)
+            for _, worker_stats in shard_results:
+                stats.merge(worker_stats)
+
+            flows_written, idle_evictions, capacity_evictions = [
+                sum(counters)
+                for counters in zip(*[counters for counters, _ in shard_results])
+            ]
+
+        else:
+            inflight_flows = FlowTable(
+                csv.writer(outfh),
+                idle_timeout=args.idle_timeout,
+                max_flows=args.max_flows,
+            )
+
+            fileno = 0
+            for infile in input_files:
+                fileno = fileno + 1
+                if args.verbose:
+                    print(
+                        "- Parsing file: %s (%d of %d)"
+                        % (infile, fileno, len(input_files))
+                    )
+
+                written_before = inflight_flows.flows_written
+                with stats.phase("transform"):
+                    process_azure_flow(infile, inflight_flows)
+                stats.add_files()
+                stats.add_records(inflight_flows.flows_written - written_before)
+
+            # finish out any still in flight
+            written_before = inflight_flows.flows_written
+            with stats.phase("transform"):
+                inflight_flows.flush()
+            stats.add_records(inflight_flows.flows_written - written_before)
+
+            flows_written = inflight_flows.flows_written
+            idle_evictions = inflight_flows.idle_evictions
+            capacity_evictions = inflight_flows.capacity_evictions
+
+    if args.verbose:
+        print()
+        print(
+            "Wrote %d flows (%d evicted while idle, %d evicted at the in-flight limit)."
+            % (flows_written, idle_evictions, capacity_evictions)
+        )
+
+    print("Output complete.")
+    if not args.outfile.startswith(default_destdir):
+        print(
+            "You must move/copy the generated file to the /logstash/nfarch/ directory before SOF-ELK can process it."
+        )
+    else:
+        print(
+            "SOF-ELK should now be processing the generated file - check system load and the Kibana interface to confirm."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,13 +7,54 @@
 #   and string) are preserved, and fields consisting of empty strings will be removed from the JSON.
 #   Field names will be normalized by lowercasing them, replacing spaces with underscores, and
 #   removing any characters except [a-z0-9_-]
+#   Rows are converted and written in batches, so memory use does not grow with the size of the
+#   input, and the input can be read from stdin to use this script in a shell pipeline.
+#   The first rows are sampled to pick a type for each column, and each column then gets its own
+#   converter that only falls back to the general conversion for cells that do not fit its type.
+#   Large files can be split into byte ranges that end on record boundaries and converted by
+#   several processes, writing either a single file in the original order or one file per process.
+#   The input may be compressed with gzip, bzip2, xz, or zstd, and output files are only given their
+#   final name once they are complete.  Output files ending in ".gz" are written gzip-compressed.
+#   The time spent reading, parsing, converting, and writing rows is always measured, and can be
+#   reported along with throughput and memory use with "--stats".
 
 import csv
-import json
 import argparse
+import collections
+import io
+import itertools
+import multiprocessing
+import os
 import re
+import signal
 import sys
-import contextlib
+
+import sof_elk_io
+import sof_elk_json
+import sof_elk_stats
+from sof_elk_stats import stats
+
+default_batch_size = 10000
+default_sample_rows = 1000
+parallel_chunk_size = 32 * 1024 * 1024
+# at most this many chunks per worker are converted ahead of the writer
+parallel_window = 2
+scan_block_size = 8 * 1024 * 1024
+read_buffer_size = 1024 * 1024
+
+bool_values = {
+    "true": True,
+    "True": True,
+    "TRUE": True,
+    "false": False,
+    "False": False,
+    "FALSE": False,
+}
+# a string that does not start with one of these characters cannot be converted to a boolean,
+#   integer, or float, so it is kept as-is without trying
+convertible_first_chars = frozenset(
+    "0123456789+-.tTfFnNiI" + "".join(chr(c) for c in range(128) if chr(c).isspace())
+)
 
 
 def normalize_field_name(name):
@@ -59,39 +100,439 @@ def remove_empty_fields(obj):
         return obj
 
 
-def process_csv_to_json(csv_filename, json_filename, tags):
-    """Convert CSV file to JSON."""
+def convert_bool(value):
+    converted = bool_values.get(value)
+    if converted is None:
+        return convert_value(value)
+    return converted
+
+
+def convert_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return convert_value(value)
+
+
+def convert_float(value):
+    # integers in a float column stay integers, just as convert_value() does
+    try:
+        return int(value)
+    except ValueError:
+        pass
+
+    try:
+        return float(value)
+    except ValueError:
+        return convert_value(value)
+
+
+def convert_string(value):
+    if value[0] in convertible_first_chars or not value[0].isascii():
+        return convert_value(value)
+    return value
+
+
+column_converters = {
+    bool: convert_bool,
+    int: convert_int,
+    float: convert_float,
+    str: convert_string,
+}
+
+
+def infer_column_type(values):
+    """
+    Return the type that convert_value() produced for every non-empty value in
+    a column's sampled values.  A mix of integers and floats is treated as
+    float, and anything else (including no values at all) as string.
+    """
+    value_types = {type(convert_value(value)) for value in values if value}
+    if value_types == {bool}:
+        return bool
+    elif value_types == {int}:
+        return int
+    elif value_types and value_types <= {int, float}:
+        return float
+    return str
+
+
+def build_row_converter(fieldnames, sample_rows):
+    """
+    Build a function that converts a list of CSV values into a JSON-ready
+    dictionary, using one converter per column chosen from sample_rows.  The
+    field names are normalized once here rather than for every row.  Rows that
+    are shorter than the header, or headers that normalize to the same name,
+    are handled by convert_fields().
+    """
+    field_names = [normalize_field_name(fieldname) for fieldname in fieldnames]
+    column_count = len(fieldnames)
+
+    def convert_with_dict(row):
+        padding = [None] * (column_count - len(row))
+        return convert_fields(dict(zip(fieldnames, row + padding)))
+
+    if len(set(field_names)) != column_count:
+        return convert_with_dict
+
+    columns = [
+        (
+            field_name,
+            column_converters[
+                infer_column_type(row[index] for row in sample_rows if index < len(row))
+            ],
+        )
+        for index, field_name in enumerate(field_names)
+    ]
+
+    def convert(row):
+        if len(row) < column_count:
+            return convert_with_dict(row)
+        # empty strings are dropped, as in remove_empty_fields()
+        return {
+            field_name: converter(value)
+            for (field_name, converter), value in zip(columns, row)
+            if value
+        }
+
+    return convert
+
+
+def add_tags(newrow, tags):
+    """
+    Split any "tags" field into a list and add the requested tags to it.  The
+    requested tags are added whether or not the row had a "tags" field.
+    """
+    if "tags" in newrow:
+        # just split on spaces for now - will adjust in future if data requires it
+        newrow["tags"] = str(newrow["tags"]).split(" ")
+    if tags is not None:
+        newrow.setdefault("tags", []).extend(tags)
+
+    return newrow
+
+
+def convert_fields(row):
+    """Convert the fields of a CSV row dictionary, without any tag handling."""
+    newrow = {
+        normalize_field_name(k): convert_value(v)
+        for k, v in row.items()
+        if k is not None
+    }
+    return remove_empty_fields(newrow)
+
+
+def convert_row(row, tags):
+    """Convert a CSV row dictionary into a JSON-ready dictionary."""
+    return add_tags(convert_fields(row), tags)
+
+
+def iter_batches(iterable, batch_size):
+    """Yield lists of up to batch_size items from an iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def write_rows(rows, convert, tags, batch_size, jsonfile):
+    """Convert rows with convert() and write them to jsonfile batch_size rows at a time."""
+    # parsing each batch of rows is timed as decoding, and reading the input
+    # beneath it as reading
+    for batch in stats.timed(iter_batches(rows, batch_size), "decode"):
+        with stats.phase("transform"):
+            json_lines = "".join(
+                [
+                    sof_elk_json.dumps(add_tags(convert(row), tags)) + "\n"
+                    for row in batch
+                ]
+            )
+        with stats.phase("write"):
+            jsonfile.write(json_lines)
+        # free this batch's output before the next batch is read
+        del json_lines
+        stats.add_records(len(batch))
+
+
+def find_record_boundaries(csv_filename, offsets):
+    """
+    For each byte offset in offsets (ascending), return the offset just past
+    the first line break at or after it that is not inside a quoted field.
+    Quote characters are counted from the start of the file to track whether a
+    position is quoted, so this relies on quotes only being used to enclose
+    fields (with embedded quotes doubled), as RFC 4180 requires.  Offsets with
+    no such line break after them are dropped, as are duplicate results.
+    """
+    boundaries = []
+    pending = list(offsets)
+    in_quotes = False
+    block_start = 0
+
+    with open(csv_filename, "rb") as csvfile:
+        while pending:
+            block = csvfile.read(scan_block_size)
+            if not block:
+                break
+            block_end = block_start + len(block)
+
+            while pending and pending[0] < block_end:
+                pos = max(pending[0] - block_start, 0)
+                if boundaries:
+                    pos = max(pos, boundaries[-1] - block_start)
+                quoted = in_quotes ^ bool(block.count(b'"', 0, pos) & 1)
+
+                while True:
+                    newline = block.find(b"\n", pos)
+                    if newline == -1:
+                        break
+                    quoted ^= bool(block.count(b'"', pos, newline) & 1)
+                    if not quoted:
+                        break
+                    pos = newline + 1
+
+                if newline == -1:
+                    # the boundary is in a later block
+                    break
+
+                boundary = block_start + newline + 1
+                if not boundaries or boundary > boundaries[-1]:
+                    boundaries.append(boundary)
+                pending.pop(0)
+
+            in_quotes ^= bool(block.count(b'"') & 1)
+            block_start = block_end
+
+    return boundaries
+
+
+class ByteRangeReader(io.RawIOBase):
+    """Read-only raw stream over the bytes from start to end of a file."""
+
+    def __init__(self, filename, start, end):
+        self.file = open(filename, "rb")
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        with stats.phase("read"):
+            count = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining -= count
+        stats.add_bytes_in(count)
+        return count
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def open_byte_range(csv_filename, start, end):
+    """Open part of a CSV file as text, just as the whole file would be opened."""
+    return io.TextIOWrapper(
+        io.BufferedReader(ByteRangeReader(csv_filename, start, end), read_buffer_size),
+        encoding="utf-8",
+    )
+
+
+# state shared by every chunk converted in a worker process, set up by init_worker()
+worker_csv_filename = None
+worker_convert = None
+worker_tags = None
+worker_batch_size = default_batch_size
+
+
+def init_worker(csv_filename, fieldnames, sample, tags, batch_size):
+    global worker_csv_filename, worker_convert, worker_tags, worker_batch_size
+    # ctrl-c is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_csv_filename = csv_filename
+    # every worker builds the same converters from the same sample rows
+    worker_convert = build_row_converter(fieldnames, sample)
+    worker_tags = tags
+    worker_batch_size = batch_size
+
+
+def convert_chunk(byte_range, json_filename=None):
+    """
+    Convert the records in one byte range of the input file.  Returns a tuple
+    of the JSON lines as a single string (or None if they were written to
+    json_filename) and the worker's statistics for the range.
+    """
+    start, end = byte_range
+    with open_byte_range(worker_csv_filename, start, end) as csvfile:
+        # blank lines are skipped, as csv.DictReader does
+        rows = (row for row in csv.reader(csvfile) if row)
+
+        if json_filename is None:
+            jsonfile = io.StringIO()
+            write_rows(rows, worker_convert, worker_tags, worker_batch_size, jsonfile)
+            return jsonfile.getvalue(), stats.take()
+
+        with sof_elk_io.open_output(json_filename, encoding="utf-8") as jsonfile:
+            write_rows(rows, worker_convert, worker_tags, worker_batch_size, jsonfile)
+    return None, stats.take()
+
+
+def shard_filename(json_filename, shard):
+    """Return the name of one shard output file, e.g. events.json.gz -> events-2.json.gz"""
+    base_filename = sof_elk_io.strip_compression_extension(json_filename)
+    root, ext = os.path.splitext(base_filename)
+    return f"{root}-{shard}{ext}{json_filename[len(base_filename):]}"
+
+
+def process_csv_to_json_parallel(
+    csv_filename, json_filename, tags, batch_size, sample_rows, jobs, shards
+):
+    """
+    Convert a CSV file to JSON with jobs worker processes.  The data after the
+    header is split into byte ranges that end on record boundaries.  With
+    shards, each worker converts one range into its own output file.
+    Otherwise, ranges of about parallel_chunk_size bytes are converted and
+    written to json_filename in their original order, with at most
+    parallel_window ranges per worker converted ahead of the writer.
+    """
     try:
-        with open(csv_filename, "r", encoding="utf-8") as csvfile:
-            reader = csv.DictReader(csvfile)
-            rows = list(reader)
+        compression = sof_elk_io.file_compression(csv_filename)
+    except FileNotFoundError:
+        sys.stderr.write(f"ERROR: File '{csv_filename}' not found.\n")
+        sys.exit(1)
+
+    # compressed input cannot be split into byte ranges
+    if compression is not None:
+        sys.stderr.write(
+            f"ERROR: Parallel conversion cannot read {compression}-compressed input.\n"
+        )
+        sys.exit(2)
+
+    try:
+        # the workers count the bytes they read, so only the header counts here
+        with sof_elk_io.open_input(
+            csv_filename, encoding="utf-8", counted=False
+        ) as csvfile:
+            reader = csv.reader(csvfile)
+            fieldnames = next(reader, None)
+            if fieldnames is None:
+                return
+            sample = list(itertools.islice((row for row in reader if row), sample_rows))
+
+        file_size = os.path.getsize(csv_filename)
+        header_end = find_record_boundaries(csv_filename, [0])
+        data_start = header_end[0] if header_end else file_size
+
+        if shards:
+            chunk_count = jobs
+        else:
+            chunk_count = max(jobs, -(-(file_size - data_start) // parallel_chunk_size))
+        chunk_size = max(1, (file_size - data_start) // chunk_count)
+        # each range ends just past the first record that ends at or after its
+        # target offset, so targets are one byte short of the next chunk
+        targets = [
+            data_start + chunk * chunk_size - 1 for chunk in range(1, chunk_count)
+        ]
+        boundaries = [data_start] + [
+            boundary
+            for boundary in find_record_boundaries(csv_filename, targets)
+            if data_start < boundary < file_size
+        ]
+        byte_ranges = list(zip(boundaries, boundaries[1:] + [file_size]))
+        stats.add_bytes_in(data_start)
+
+        with multiprocessing.Pool(
+            processes=min(jobs, len(byte_ranges)),
+            initializer=init_worker,
+            initargs=(csv_filename, fieldnames, sample, tags, batch_size),
+        ) as pool:
+            if shards:
+                with stats.phase("wait"):
+                    results = pool.starmap(
+                        convert_chunk,
+                        [
+                            (byte_range, shard_filename(json_filename, shard))
+                            for shard, byte_range in enumerate(byte_ranges)
+                        ],
+                    )
+                for _, chunk_stats in results:
+                    stats.merge(chunk_stats)
+
+            else:
+                if json_filename == "-":
+                    cm = sof_elk_io.open_stdout()
+                else:
+                    cm = sof_elk_io.open_output(json_filename, encoding="utf-8")
+
+                # imap() would queue up the output of every chunk a slow
+                # writer has not reached yet, so only a window of chunks is
+                # submitted at a time
+                window = parallel_window * jobs
+                pending = collections.deque()
+
+                def write_chunk():
+                    with stats.phase("wait"):
+                        json_lines, chunk_stats = pending.popleft().get()
+                    with stats.phase("write"):
+                        jsonfile.write(json_lines)
+                    stats.merge(chunk_stats)
+
+                with cm as jsonfile:
+                    for byte_range in byte_ranges:
+                        pending.append(pool.apply_async(convert_chunk, (byte_range,)))
+                        if len(pending) >= window:
+                            write_chunk()
+                    while pending:
+                        write_chunk()
+        stats.add_files()
+
+    except Exception as e:
+        sys.stderr.write(f"ERROR: An unexpected error occurred: {e}.\n")
+        sys.exit(1)
+
+
+def process_csv_to_json(
+    csv_filename,
+    json_filename,
+    tags,
+    batch_size=default_batch_size,
+    sample_rows=default_sample_rows,
+):
+    """
+    Convert CSV file to JSON, reading and writing batch_size rows at a time.
+    Column types are inferred from the first sample_rows rows.
+    """
+    try:
+        csv_cm = sof_elk_io.open_input(csv_filename, encoding="utf-8")
     except FileNotFoundError:
         sys.stderr.write(f"ERROR: File '{csv_filename}' not found.\n")
         sys.exit(1)
 
     try:
         if json_filename == "-":
-            cm = contextlib.nullcontext(sys.stdout)
+            cm = sof_elk_io.open_stdout()
         else:
-            cm = open(json_filename, "w", encoding="utf-8")
-
-        with cm as jsonfile:
-            for row in rows:
-                newrow = {
-                    normalize_field_name(k): convert_value(v)
-                    for k, v in row.items()
-                    if k is not None
-                }
-                newrow = remove_empty_fields(newrow)
-
-                if "tags" in newrow:
-                    # just split on spaces for now - will adjust in future if data requires it
-                    newrow["tags"] = str(newrow["tags"]).split(" ")
-                elif tags is not None:
-                    newrow["tags"].extend(tags)
-
-                json.dump(newrow, jsonfile)
-                jsonfile.write("\n")
+            cm = sof_elk_io.open_output(json_filename, encoding="utf-8")
+
+        with csv_cm as csvfile, cm as jsonfile:
+            reader = csv.reader(csvfile)
+            fieldnames = next(reader, None)
+            if fieldnames is None:
+                return
+
+            # blank lines are skipped, as csv.DictReader does
+            rows = (row for row in reader if row)
+            with stats.phase("decode"):
+                sample = list(itertools.islice(rows, sample_rows))
+            convert = build_row_converter(fieldnames, sample)
+
+            write_rows(
+                itertools.chain(sample, rows), convert, tags, batch_size, jsonfile
+            )
+        stats.add_files()
     except Exception as e:
         sys.stderr.write(f"ERROR: An unexpected error occurred: {e}.\n")
         sys.exit(1)
@@ -100,22 +541,95 @@ def process_csv_to_json(csv_filename, json_filename, tags):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert CSV file to JSON.")
     parser.add_argument(
-        "-r", "--read", dest="infile", help="CSV input file to process.", required=True
+        "-r",
+        "--read",
+        dest="infile",
+        help='CSV input file to process, which may be compressed.  Use "-" for stdin.',
+        required=True,
     )
     parser.add_argument(
         "-w",
         "--write",
         dest="outfile",
-        help='JSON output file to create.  Use "-" for stdout.',
+        help='JSON output file to create.  Names ending in ".gz" are gzip-compressed.  Use "-" for stdout.',
         required=True,
     )
     parser.add_argument(
         "-t",
         "--tag",
         dest="tags",
-        help='Optional string to add to "tags" field.  Can be used multiple times.',
+        help='Optional string to add to "tags" field.  Can be used multiple times.  The tags are added to every row, including rows whose CSV data already has a "tags" column.',
         action="append",
     )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        dest="batch_size",
+        help=f"Number of rows to convert and write at a time. (Default: {default_batch_size})",
+        type=int,
+        default=default_batch_size,
+    )
+    parser.add_argument(
+        "-s",
+        "--sample-rows",
+        dest="sample_rows",
+        help=f"Number of rows to sample when choosing the type of each column. (Default: {default_sample_rows})",
+        type=int,
+        default=default_sample_rows,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="Number of worker processes used to convert parts of the input file in parallel.  Use 0 to run one worker per CPU core.  This requires quotes in the CSV file to be used only to enclose fields. (Default: 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--shards",
+        dest="shards",
+        help='With more than one job, write one output file per job (e.g. "out-0.json", "out-1.json") instead of a single file in the original order.',
+        default=False,
+        action="store_true",
+    )
+    sof_elk_stats.add_arguments(parser)
     args = parser.parse_args()
 
-    process_csv_to_json(args.infile, args.outfile, args.tags)
+    if args.batch_size < 1:
+        sys.stderr.write("ERROR: The batch size must be at least 1.\n")
+        sys.exit(2)
+
+    if args.sample_rows < 0:
+        sys.stderr.write("ERROR: The number of sample rows cannot be negative.\n")
+        sys.exit(2)
+
+    if args.jobs < 0:
+        sys.stderr.write("ERROR: The number of jobs cannot be negative.\n")
+        sys.exit(2)
+    elif args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+
+    if args.jobs > 1 and args.infile == "-":
+        sys.stderr.write("ERROR: Parallel conversion cannot read from stdin.\n")
+        sys.exit(2)
+
+    if args.shards and args.outfile == "-":
+        sys.stderr.write("ERROR: Shard output files cannot be written to stdout.\n")
+        sys.exit(2)
+
+    sof_elk_stats.start(args, "csv2json.py")
+
+    if args.jobs > 1:
+        process_csv_to_json_parallel(
+            args.infile,
+            args.outfile,
+            args.tags,
+            args.batch_size,
+            args.sample_rows,
+            args.jobs,
+            args.shards,
+        )
+    else:
+        process_csv_to_json(
+            args.infile, args.outfile, args.tags, args.batch_size, args.sample_rows
+        )
@@ -5,24 +5,52 @@
 # This script is used to NUKE data from elasticsearch.  This is incredibly destructive!
 # Optionally, re-load data from disk for the selected index or filepath
 
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, NotFoundError
 from subprocess import call, DEVNULL
 from io import open
-import json
 import os
 import argparse
 import signal
 import re
+import shutil
+import sys
+import tempfile
+import time
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 import atexit
 
+import sof_elk_json
+from sof_elk_json import (
+    JSONStream,
+    dumps_preserving_notation,
+    loads_preserving_notation,
+    preserving_decoder,
+)
+
 # set the top-level root location for all loaded files
 topdir = "/logstash/"
 log_path_field = "log.file.path.keyword"
 filebeat_registry_filename = "/var/lib/filebeat/registry/filebeat/log.json"
 filebeat_registry_checkpoint_filename = "/var/lib/filebeat/registry/filebeat/active.dat"
+# number of source files fetched from elasticsearch in each page of results
+file_page_size = 10000
+# maximum number of file paths in each terms query
+terms_batch_size = 10000
+# number of count requests or delete tasks run at the same time
+query_concurrency = 4
+# seconds between checks on the progress of a background delete task
+task_poll_interval = 2
+# a shadow reload is swapped in once no documents have arrived for this many seconds
+default_settle_time = 60
+# seconds to wait for a shadow reload to finish before giving up
+default_reload_timeout = 21600
+# shadow reloads write to <index>-reload-<timestamp>, and keep the documents that were
+# in a monthly index itself in <index>-previous-<timestamp> while they are reloaded
+reload_suffix_regex = re.compile(r"-(reload|previous)-\d{14}$")
 files_to_reload = []
 doccount = 0
+reload_doccount = 0
 populated_indices = []
 
 
@@ -75,6 +103,57 @@ def list_files_glob(pattern="**/*", recursive=True):
     return files
 
 
+# list every file under a directory, sorted by name
+# os.scandir() gets each entry's type along with its name, so only directories are stat()ed
+# like glob(), hidden files and directories are skipped and symlinks to directories are
+# followed.  each directory is visited once by (st_dev, st_ino), so a symlink loop cannot
+# make this recurse forever
+def list_files(directory):
+    files = []
+    directories = [directory]
+    visited = set()
+    while directories:
+        try:
+            current = directories.pop()
+            stat = os.stat(current)
+            if (stat.st_dev, stat.st_ino) in visited:
+                continue
+            visited.add((stat.st_dev, stat.st_ino))
+
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        directories.append(entry.path)
+                    elif entry.is_file():
+                        files.append(entry.path)
+        except OSError:
+            # like glob(), skip directories that cannot be read
+            continue
+    files.sort()
+    return files
+
+
+# split a list of file paths into terms queries of at most terms_batch_size paths each,
+# which keeps each request small and under the index.max_terms_count limit
+def get_terms_queries(paths):
+    return [
+        {"terms": {log_path_field: paths[offset : offset + terms_batch_size]}}
+        for offset in range(0, len(paths), terms_batch_size)
+    ]
+
+
+# count the documents matching any of a list of queries, running up to query_concurrency
+# counts at a time.  the queries must not overlap, or documents are counted more than once
+def count_documents(es, index, queries):
+    def count_query(query):
+        return es.count(index=index, query=query)["count"]
+
+    with ThreadPoolExecutor(max_workers=query_concurrency) as executor:
+        return sum(executor.map(count_query, queries))
+
+
 def exit_handler():
     if (
         call(
@@ -131,7 +210,7 @@ def get_es_indices(es):
     index_dict = {}
     indices = list(es.indices.get_alias(index="*", expand_wildcards="open"))
     for index in indices:
-        baseindex = "-".join(index.split("-")[:-1])
+        baseindex = "-".join(reload_suffix_regex.sub("", index).split("-")[:-1])
         if baseindex in index_dict:
             pass
         elif not any(compiled_reg.match(index) for compiled_reg in special_index_regex):
@@ -139,89 +218,462 @@ def get_es_indices(es):
     return list(index_dict)
 
 
-# scrub a registry file of any entry that is in the supplied list of files
-# this function overwrites the specified registry file, so be sure filebeat is stopped first
-def scrub_registry_file(registry_filename, file_list, checkpoint=False):
-    if os.path.isfile(registry_filename) and os.path.getsize(registry_filename) > 0:
-        # load existing filebeat registry
-        with open(registry_filename, "r") as registry_file:
-            reg_data = []
+# yield (filename, document count) for every source file in the matching indices
+# this pages through a composite aggregation, so elasticsearch never has to build
+# more than file_page_size buckets at once, regardless of how many files there are
+def get_source_files(es, index, page_size=file_page_size):
+    composite = {
+        "size": page_size,
+        "sources": [{"filename": {"terms": {"field": log_path_field}}}],
+    }
 
-            # checkpoint files are arrays.  main registry file is jsonl. ugh.
-            if checkpoint:
-                try:
-                    reg_data = json.load(
-                        registry_file, parse_float=preserve_sci_notation
+    while True:
+        res = es.search(
+            index=index,
+            size=0,
+            aggs={"source_files": {"composite": composite}},
+        )
+        source_files = res.body["aggregations"]["source_files"]
+
+        for bucket in source_files["buckets"]:
+            yield bucket["key"]["filename"], bucket["doc_count"]
+
+        # the last page has no after_key, or no buckets
+        if "after_key" not in source_files or len(source_files["buckets"]) == 0:
+            break
+        composite["after"] = source_files["after_key"]
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+
+# start a background delete_by_query task, sliced across the shards of the matching indices
+# returns the task id, which can be monitored with run_delete_tasks()
+def start_delete_task(es, index, query, requests_per_second=None):
+    res = es.delete_by_query(
+        index=index,
+        query=query,
+        slices="auto",
+        requests_per_second=requests_per_second,
+        wait_for_completion=False,
+    )
+    return res["task"]
+
+
+# run a background delete task for each query, up to query_concurrency at a time, and
+# poll them and any already-running task_ids until they complete, displaying their
+# combined progress.  if interrupted, the user can cancel the running tasks or leave
+# them running to be resumed later
+def run_delete_tasks(
+    es,
+    index=None,
+    queries=(),
+    task_ids=(),
+    expected_doccount=0,
+    requests_per_second=None,
+    noninteractive=False,
+):
+    pending_queries = list(queries)
+    active_tasks = list(task_ids)
+    # counters of the tasks that have completed
+    deleted = 0
+    processed = 0
+    total = 0
+    version_conflicts = 0
+    failures = 0
+    errors = []
+
+    start_time = time.monotonic()
+    first_deleted = None
+
+    # catch ctrl-c here rather than exiting through ctrlc_handler()
+    previous_handler = signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        while True:
+            while pending_queries and len(active_tasks) < query_concurrency:
+                active_tasks.append(
+                    start_delete_task(
+                        es, index, pending_queries.pop(0), requests_per_second
                     )
+                )
 
-                except json.JSONDecodeError:
-                    print(
-                        "ERROR: Could not load json data from registry file %s."
-                        % registry_filename
+            active_deleted = 0
+            active_processed = 0
+            active_total = 0
+            throttle = ""
+            for task_id in list(active_tasks):
+                try:
+                    res = es.tasks.get(task_id=task_id)
+                except NotFoundError:
+                    print("ERROR: Delete task %s was not found.  Exiting." % (task_id))
+                    exit(1)
+
+                if res["completed"]:
+                    active_tasks.remove(task_id)
+                    if "error" in res:
+                        errors.append(
+                            res["error"].get("reason", res["error"].get("type"))
+                        )
+                        continue
+                    response = res["response"]
+                    deleted += response["deleted"]
+                    processed += (
+                        response["deleted"]
+                        + response["version_conflicts"]
+                        + response["noops"]
+                    )
+                    total += response["total"]
+                    version_conflicts += response["version_conflicts"]
+                    failures += len(response["failures"])
+
+                else:
+                    status = res["task"]["status"]
+                    active_deleted += status["deleted"]
+                    active_processed += (
+                        status["deleted"]
+                        + status["version_conflicts"]
+                        + status["noops"]
                     )
+                    active_total += status["total"]
+                    if status["requests_per_second"] > 0:
+                        throttle = ", throttled to %s requests/sec per task" % (
+                            "{:,g}".format(status["requests_per_second"])
+                        )
 
+            current_deleted = deleted + active_deleted
+            remaining = max(expected_doccount, total + active_total) - (
+                processed + active_processed
+            )
+            elapsed = time.monotonic() - start_time
+            if first_deleted is None:
+                first_deleted = current_deleted
+            rate = (current_deleted - first_deleted) / elapsed if elapsed > 0 else 0
+
+            if rate > 0 and remaining > 0:
+                eta = format_duration(remaining / rate)
             else:
-                for registry_line in registry_file:
-                    try:
-                        reg_data.append(
-                            json.loads(registry_line, parse_float=preserve_sci_notation)
-                        )
+                eta = "--:--:--"
+            sys.stdout.write(
+                "\rDeleted %s of %s documents (%s docs/sec, ETA %s%s) "
+                % (
+                    "{:,}".format(current_deleted),
+                    "{:,}".format(max(expected_doccount, total + active_total)),
+                    "{:,.0f}".format(rate),
+                    eta,
+                    throttle,
+                )
+            )
+            sys.stdout.flush()
+
+            if not active_tasks and not pending_queries:
+                break
+            time.sleep(task_poll_interval)
+
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGINT, previous_handler)
+        print("\n")
+        if confirm(
+            prompt="Cancel the delete tasks?  Documents already deleted will not be restored.",
+            default_resp=False,
+            noninteractive=noninteractive,
+        ):
+            for task_id in active_tasks:
+                es.tasks.cancel(task_id=task_id)
+                print("Delete task %s cancelled." % (task_id))
+        else:
+            for task_id in active_tasks:
+                print(
+                    'Delete task %s is still running.  Use "-t %s" to resume monitoring it.'
+                    % (task_id, task_id)
+                )
+            if pending_queries:
+                print(
+                    "%d more batches of documents were not started.  Run the original command again to delete them."
+                    % (len(pending_queries))
+                )
+        exit(1)
 
-                    except json.JSONDecodeError:
-                        print(
-                            "ERROR: Skipping invalid json line in registry file %s."
-                            % (registry_filename)
-                        )
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
 
-        # create new registry, minus the files to be re-loaded
-        new_reg_data = []
-        for registry_entry in reg_data:
-            try:
-                file = str(registry_entry["v"]["meta"]["source"])
-                if not file in file_list:
-                    new_reg_data.append(registry_entry)
+    print()
+    print(
+        "Deleted %s documents in %s."
+        % ("{:,}".format(deleted), format_duration(time.monotonic() - start_time))
+    )
+    if version_conflicts > 0:
+        print(
+            "WARNING: %s documents changed while being deleted and were not deleted."
+            % ("{:,}".format(version_conflicts))
+        )
+    for error in errors:
+        print("ERROR: Delete task failed: %s" % (error))
+    if failures > 0:
+        print("ERROR: %d failures occurred while deleting documents." % (failures))
+    if errors or failures > 0:
+        exit(1)
 
-            except KeyError:
-                new_reg_data.append(registry_entry)
 
-        with open(registry_filename, "w") as new_reg_file:
+# prepare to reload the monthly indices for base_index into hidden shadow indices
+# each monthly index name becomes a hidden write alias for its shadow index, so logstash
+# writes the reloaded documents there while the existing documents stay visible
+# returns the list of shadow indices
+def prepare_shadow_indices(es, base_index, tag):
+    shadow_indices = []
+    indices = es.indices.get_alias(index="%s-*" % (base_index), expand_wildcards="open")
+    for index in sorted(indices.body):
+        target = reload_suffix_regex.sub("", index)
+        shadow_index = "%s-reload-%s" % (target, tag)
+        es.indices.create(index=shadow_index, settings={"index.hidden": True})
+
+        if target == index:
+            # the name of a plain monthly index can only be freed by removing the index, so
+            # its documents are copied to another index first.  a clone hard-links the
+            # existing segments, so it is quick.  the copy is hidden while it is created
+            # and shown just before the index is removed, so its documents are never
+            # missing from searches, but are counted twice for the moment between the
+            # two requests.  the clone would otherwise inherit the write block
+            previous_index = "%s-previous-%s" % (index, tag)
+            es.indices.put_settings(index=index, settings={"index.blocks.write": True})
+            es.indices.clone(
+                index=index,
+                target=previous_index,
+                settings={"index.hidden": True, "index.blocks.write": False},
+            )
+            es.indices.put_settings(
+                index=previous_index, settings={"index.hidden": False}
+            )
+            # removing the index in the same update that adds the alias leaves no moment
+            # where a writer could create a new index with the alias name
+            actions = [{"remove_index": {"index": index}}]
+        else:
+            # this index was itself swapped in by an earlier shadow reload
+            actions = [{"remove": {"index": index, "alias": target}}]
+
+        actions.append(
+            {
+                "add": {
+                    "index": shadow_index,
+                    "alias": target,
+                    "is_write_index": True,
+                    "is_hidden": True,
+                }
+            }
+        )
+        es.indices.update_aliases(actions=actions)
+        shadow_indices.append(shadow_index)
+
+    return shadow_indices
+
+
+# get the hidden shadow indices of a shadow reload for base_index that is in progress
+def get_shadow_indices(es, base_index):
+    indices = es.indices.get_settings(
+        index="%s-*-reload-*" % (base_index),
+        expand_wildcards="all",
+        name="index.hidden",
+    )
+    return sorted(
+        index
+        for index, index_info in indices.body.items()
+        if reload_suffix_regex.search(index)
+        and index_info["settings"]["index"].get("hidden") == "true"
+    )
+
+
+# wait until the shadow indices hold the expected number of documents and logstash has
+# stopped adding to them, displaying progress.  exits if that has not happened by the
+# timeout, leaving the reload in place to resume waiting for later
+# returns true if the shadow indices should be swapped in
+def wait_for_shadow_indices(
+    es,
+    base_index,
+    shadow_indices,
+    expected_doccount,
+    settle_time,
+    timeout=default_reload_timeout,
+    noninteractive=False,
+):
+    # catch ctrl-c here rather than exiting through ctrlc_handler()
+    previous_handler = signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        last_doccount = 0
+        last_change = time.monotonic()
+        deadline = last_change + timeout
+        while True:
+            shadow_doccount = es.count(index=",".join(shadow_indices))["count"]
+            if shadow_doccount != last_doccount:
+                last_doccount = shadow_doccount
+                last_change = time.monotonic()
+            idle_time = time.monotonic() - last_change
+
+            sys.stdout.write(
+                "\rReloaded %s of %s documents (%ds since the last new document) "
+                % (
+                    "{:,}".format(shadow_doccount),
+                    "{:,}".format(expected_doccount),
+                    idle_time,
+                )
+            )
+            sys.stdout.flush()
 
-            if checkpoint:
-                new_reg_file.write(dumps_preserving_notation(new_reg_data))
+            if shadow_doccount >= expected_doccount and idle_time >= settle_time:
+                print()
+                return True
 
-            else:
-                for new_line in new_reg_data:
-                    new_reg_file.write(dumps_preserving_notation(new_line) + "\n")
+            if timeout > 0 and time.monotonic() >= deadline:
+                print()
+                print(
+                    'ERROR: Only %s of %s documents were reloaded within %s.  The existing documents remain searchable.  Run with "-i %s -s" to resume waiting for the reload, and press Ctrl-C while waiting to swap in the reloaded documents regardless.'
+                    % (
+                        "{:,}".format(shadow_doccount),
+                        "{:,}".format(expected_doccount),
+                        format_duration(timeout),
+                        base_index,
+                    )
+                )
+                exit(1)
+            time.sleep(task_poll_interval)
+
+    except KeyboardInterrupt:
+        signal.signal(signal.SIGINT, previous_handler)
+        print("\n")
+        return confirm(
+            prompt="Swap in the reloaded documents now?",
+            default_resp=False,
+            noninteractive=noninteractive,
+        )
+
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+
+
+# make the shadow indices visible in place of the indices they replace, and drop those
+# the aliases, and therefore the documents that searches see, change in a single update
+def swap_shadow_indices(es, shadow_indices):
+    for shadow_index in shadow_indices:
+        target = reload_suffix_regex.sub("", shadow_index)
+        previous_indices = es.indices.get_alias(
+            index="%s-*" % (target), expand_wildcards="open"
+        )
+
+        actions = [
+            {"remove": {"index": shadow_index, "alias": target}},
+            {"add": {"index": shadow_index, "alias": target, "is_write_index": True}},
+        ]
+        for previous_index in previous_indices.body:
+            if previous_index != shadow_index:
+                actions.append({"remove_index": {"index": previous_index}})
+        es.indices.update_aliases(actions=actions)
+        es.indices.put_settings(index=shadow_index, settings={"index.hidden": False})
+
+
+# return true if a registry entry is for one of the files in file_set
+def registry_entry_matches(registry_entry, file_set):
+    try:
+        return str(registry_entry["v"]["meta"]["source"]) in file_set
+    except (KeyError, TypeError):
+        return False
+
+
+# yield each entry in a checkpoint registry file, which is a single json array
+def read_checkpoint_entries(registry_file, registry_filename):
+    stream = JSONStream(registry_file, decoder=preserving_decoder)
+    try:
+        stream.expect("[")
+        if stream.peek() == "]":
+            return
+
+        while True:
+            yield stream.decode()
+            if stream.peek() == ",":
+                stream.pos += 1
+                continue
+            stream.expect("]")
+            break
+
+    except sof_elk_json.JSONDecodeError:
+        print(
+            "ERROR: Could not load json data from registry file %s." % registry_filename
+        )
+        raise
 
 
-# these are needed to preserve numerical formatting within the JSON in the registry file
-class RawJSON:
-    """Wraps a raw JSON number/text so it's emitted verbatim, unquoted."""
+# yield each entry in a main registry file, which is jsonl
+def read_registry_entries(registry_file, registry_filename):
+    for registry_line in registry_file:
+        if not registry_line.strip():
+            continue
+        try:
+            yield loads_preserving_notation(registry_line)
 
-    def __init__(self, raw_text):
-        self.raw = raw_text
+        except sof_elk_json.JSONDecodeError:
+            print(
+                "ERROR: Skipping invalid json line in registry file %s."
+                % (registry_filename)
+            )
 
 
-def preserve_sci_notation(s):
-    # s is the original numeric substring exactly as it appeared in the source
-    if "e" in s or "E" in s:
-        return RawJSON(s)
-    return float(s)  # normal floats parse/format as usual
+# scrub a registry file of any entry that is in the supplied list of files
+# entries are streamed one at a time into a temporary file that then replaces the
+# registry, so memory use does not depend on the size of the registry and the
+# registry is never left half-written.  be sure filebeat is stopped first
+def scrub_registry_file(registry_filename, file_list, checkpoint=False):
+    if not os.path.isfile(registry_filename) or os.path.getsize(registry_filename) == 0:
+        return
+
+    file_set = set(file_list)
+    registry_dir, registry_basename = os.path.split(registry_filename)
+    # the temporary file is created with the same restrictive permissions as the
+    # registry itself, in the same directory so it can be renamed over it
+    temp_fd, temp_filename = tempfile.mkstemp(
+        prefix=".%s." % (registry_basename), dir=registry_dir or "."
+    )
+    try:
+        with open(registry_filename, "r") as registry_file, open(
+            temp_fd, "w"
+        ) as new_reg_file:
+            if checkpoint:
+                new_reg_file.write("[")
+                separator = ""
+                for registry_entry in read_checkpoint_entries(
+                    registry_file, registry_filename
+                ):
+                    if not registry_entry_matches(registry_entry, file_set):
+                        new_reg_file.write(
+                            separator + dumps_preserving_notation(registry_entry)
+                        )
+                        separator = ","
+                new_reg_file.write("]")
 
+            else:
+                for registry_entry in read_registry_entries(
+                    registry_file, registry_filename
+                ):
+                    if not registry_entry_matches(registry_entry, file_set):
+                        new_reg_file.write(
+                            dumps_preserving_notation(registry_entry) + "\n"
+                        )
 
-class RawJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, RawJSON):
-            return f"@@RAW@@{o.raw}@@RAW@@"
-        return super().default(o)
+            new_reg_file.flush()
+            os.fsync(new_reg_file.fileno())
 
+        shutil.copymode(registry_filename, temp_filename)
+        registry_stat = os.stat(registry_filename)
+        os.chown(temp_filename, registry_stat.st_uid, registry_stat.st_gid)
+        os.replace(temp_filename, registry_filename)
 
-def dumps_preserving_notation(data):
-    s = json.dumps(data, cls=RawJSONEncoder, ensure_ascii=False, separators=(",", ":"))
-    return re.sub(r'"@@RAW@@(.*?)@@RAW@@"', lambda m: m.group(1), s)
+    except sof_elk_json.JSONDecodeError:
+        # leave an unreadable checkpoint file as it is
+        os.remove(temp_filename)
 
+    except BaseException:
+        os.remove(temp_filename)
+        raise
 
-# end numerical-formatting preservation
 
 parser = argparse.ArgumentParser(
     description="Clear the SOF-ELK(R) Elasticsearch database and optionally reload the input files for the deleted index.  Optionally narrow delete/reload scope to a file or parent path on the local filesystem."
@@ -239,6 +691,12 @@ operation.add_argument(
     dest="filepath",
     help="Local directory root, single local file, or filesystem wildcard specification (glob) to remove.",
 )
+operation.add_argument(
+    "-t",
+    "--task",
+    dest="task",
+    help="Resume monitoring a delete task left running by an interrupted earlier run.  Combine with --requests-per-second to change its throttle.",
+)
 operation.add_argument(
     "-a",
     "--all",
@@ -255,6 +713,30 @@ parser.add_argument(
     default=False,
     help="Reload source files from the local filesystem, as indicated by existing documents and their respective sources, or the index and the documents it contains.",
 )
+parser.add_argument(
+    "-s",
+    "--shadow",
+    dest="shadow",
+    action="store_true",
+    default=False,
+    help="With -i and -r, reload into hidden shadow indices and swap them in once the reload is complete, instead of deleting the existing documents first.  The existing documents remain searchable until then.  Use -i and -s without -r to resume waiting for an interrupted shadow reload.",
+)
+parser.add_argument(
+    "--settle-time",
+    dest="settle_time",
+    type=int,
+    default=default_settle_time,
+    help="With -s, swap in the shadow indices once no documents have been reloaded for this many seconds.  (Default: %d)"
+    % (default_settle_time),
+)
+parser.add_argument(
+    "--reload-timeout",
+    dest="reload_timeout",
+    type=int,
+    default=default_reload_timeout,
+    help="With -s, give up waiting after this many seconds if the shadow indices do not yet hold as many documents as the reloaded files did before.  The reload is left in place, to resume waiting for with -i and -s.  Use 0 to wait indefinitely.  (Default: %d)"
+    % (default_reload_timeout),
+)
 parser.add_argument(
     "-y",
     "--yes",
@@ -263,8 +745,38 @@ parser.add_argument(
     default=False,
     help="Suppress all interactive verifications.  Useful for scripting but beware - you won't get a chance to change course!",
 )
+parser.add_argument(
+    "--requests-per-second",
+    dest="requests_per_second",
+    type=float,
+    default=None,
+    help="Throttle deleting documents by file path to this many requests per second for each delete task, where each request deletes up to 1,000 documents, to limit the load on the cluster.  Up to %d delete tasks run at a time.  Use 0 to remove the throttle.  (Default: unthrottled)"
+    % (query_concurrency),
+)
 args = parser.parse_args()
 
+if args.requests_per_second is not None:
+    if args.requests_per_second < 0:
+        print("ERROR: The requests per second cannot be negative.  Exiting.")
+        exit(2)
+    elif args.requests_per_second == 0:
+        # this is how elasticsearch spells "unthrottled"
+        args.requests_per_second = -1
+
+if args.settle_time < 0 or args.reload_timeout < 0:
+    print("ERROR: The settle time and reload timeout cannot be negative.  Exiting.")
+    exit(2)
+
+if args.shadow and (not args.index or args.index == "list"):
+    print('ERROR: "-s" can only be used with "-i".  Exiting.')
+    exit(2)
+
+if args.task and args.reload:
+    print(
+        'ERROR: "-t" cannot be combined with "-r".  Once the task completes, run the original command again to reload the files.'
+    )
+    exit(2)
+
 # create Elasticsearch handle
 es = Elasticsearch(["http://localhost:9200"])
 try:
@@ -289,6 +801,46 @@ if args.index == "list":
             print("- %s (%s documents)" % (index, "{:,}".format(doccount)))
     exit(0)
 
+# monitor a delete task from an earlier run
+if args.task:
+    if args.requests_per_second is not None:
+        es.delete_by_query_rethrottle(
+            task_id=args.task, requests_per_second=args.requests_per_second
+        )
+    run_delete_tasks(es, task_ids=[args.task], noninteractive=args.noninteractive)
+    exit(0)
+
+# resume waiting for a shadow reload from an earlier run
+if args.shadow and not args.reload:
+    shadow_indices = get_shadow_indices(es, args.index)
+    if len(shadow_indices) == 0:
+        print("There is no shadow reload in progress for %s.  Exiting." % (args.index))
+        exit(1)
+
+    # the documents that are being reloaded are still searchable in the original indices
+    res = es.count(index="%s-*" % (args.index), query={"match_all": {}})
+    if not wait_for_shadow_indices(
+        es,
+        args.index,
+        shadow_indices,
+        res["count"],
+        args.settle_time,
+        timeout=args.reload_timeout,
+        noninteractive=args.noninteractive,
+    ):
+        print('Run with "-i %s -s" to resume waiting for the reload.' % (args.index))
+        exit(1)
+    swap_shadow_indices(es, shadow_indices)
+    print("Swapped in the reloaded %s indices." % (args.index))
+    exit(0)
+
+if args.shadow and len(get_shadow_indices(es, args.index)) > 0:
+    print(
+        'ERROR: A shadow reload is already in progress for %s.  Run with "-i %s -s" to resume waiting for it.'
+        % (args.index, args.index)
+    )
+    exit(1)
+
 
 # do this up front to ensure full and consistent deletion of records if there is a reload (aka prevent records from shipping while this script is running)
 if args.reload:
@@ -304,21 +856,36 @@ if args.reload:
 # display document count
 if args.filepath:
     if os.path.isdir(args.filepath):
-        args.filepath = os.path.join(args.filepath, "**", "*")
+        # "/logstash" names the same directory as "/logstash/"
+        args.filepath = os.path.join(os.path.normpath(args.filepath), "")
 
     if not args.filepath.startswith(topdir):
         print('ERROR: File path must start with "%s".  Exiting.' % (topdir))
         exit(1)
 
-    files_to_reload = list_files_glob(args.filepath)
+    if os.path.isdir(args.filepath):
+        # everything loaded from under a directory, including files since removed from it
+        directory = args.filepath
+        files_to_reload = list_files(directory)
+        path_queries = [{"prefix": {log_path_field: directory}}]
 
-    res = es.count(index="*", query={"terms": {log_path_field: files_to_reload}})
-    doccount = res["count"]
+    else:
+        # a glob can match the same file more than once, which would be counted twice
+        files_to_reload = sorted(
+            set(
+                filename
+                for filename in list_files_glob(args.filepath)
+                if os.path.isfile(filename)
+            )
+        )
+        path_queries = get_terms_queries(files_to_reload)
+
+    doccount = count_documents(es, "*", path_queries)
 
 elif args.deleteall:
     populated_indices = [s + "-*" for s in get_es_indices(es)]
 
-    files_to_reload = list_files_glob(os.path.join(topdir, "**", "*"))
+    files_to_reload = list_files(topdir)
 
     if len(populated_indices) == 0:
         print("There are no active data indices in Elasticsearch")
@@ -332,28 +899,16 @@ elif args.deleteall:
 
 elif args.index:
     if args.reload:
-        # note: this will fail if there are too many buckets (meaning over 65536 by default).
-        #       in the future, need to paginate but this is not an expected condition
-        res = es.search(
-            index="%s-*" % (args.index),
-            size=0,
-            aggs={
-                "unique_categories": {
-                    "terms": {"field": log_path_field, "size": 1000000}
-                }
-            },
-        )
-
-        for file in res.body["aggregations"]["unique_categories"]["buckets"]:
-            filename = file["key"]
-            doccount += file["doc_count"]
+        for filename, file_doccount in get_source_files(es, "%s-*" % (args.index)):
+            doccount += file_doccount
 
             if os.path.isfile(filename):
                 files_to_reload.append(filename)
+                reload_doccount += file_doccount
             else:
                 print(
                     "- FILE NO LONGER PRESENT - WILL DELETE BUT CANNOT RELOAD: %s (%d records)"
-                    % (file["key"], file["doc_count"])
+                    % (filename, file_doccount)
                 )
 
     else:
@@ -382,8 +937,12 @@ if doccount > 0:
     # get user confirmation to proceed
     print("%s documents found\n" % ("{:,}".format(doccount)))
 
+    if args.shadow:
+        prompt = "Replace these documents permanently once they have been reloaded?"
+    else:
+        prompt = "Delete these documents permanently?"
     if not confirm(
-        prompt="Delete these documents permanently?",
+        prompt=prompt,
         default_resp=False,
         noninteractive=args.noninteractive,
     ):
@@ -391,9 +950,18 @@ if doccount > 0:
         exit(0)
 
     # delete the records
-    if args.filepath:
-        es.delete_by_query(
-            index="*", query={"terms": {log_path_field: files_to_reload}}
+    if args.shadow:
+        # the existing documents are dropped when the shadow indices are swapped in
+        pass
+
+    elif args.filepath:
+        run_delete_tasks(
+            es,
+            "*",
+            path_queries,
+            expected_doccount=doccount,
+            requests_per_second=args.requests_per_second,
+            noninteractive=args.noninteractive,
         )
 
     elif args.deleteall:
@@ -424,6 +992,12 @@ if args.reload:
         print("Will NOT reload any files.  Exiting.")
         exit(1)
 
+    shadow_indices = []
+    if args.shadow and doccount > 0:
+        shadow_indices = prepare_shadow_indices(
+            es, args.index, time.strftime("%Y%m%d%H%M%S", time.gmtime())
+        )
+
     # if there is a checkpoint file, scrub it first
     if (
         os.path.isfile(filebeat_registry_checkpoint_filename)
@@ -438,3 +1012,24 @@ if args.reload:
 
     # scrub the main registry file
     scrub_registry_file(filebeat_registry_filename, files_to_reload)
+
+    if len(shadow_indices) > 0:
+        # filebeat must be running to reload the files before the swap
+        exit_handler()
+
+        if not wait_for_shadow_indices(
+            es,
+            args.index,
+            shadow_indices,
+            reload_doccount,
+            args.settle_time,
+            timeout=args.reload_timeout,
+            noninteractive=args.noninteractive,
+        ):
+            print(
+                'The files are still being reloaded into hidden indices, and the existing documents remain searchable.  Run with "-i %s -s" to resume waiting for the reload.'
+                % (args.index)
+            )
+            exit(1)
+        swap_shadow_indices(es, shadow_indices)
+        print("Swapped in the reloaded %s indices." % (args.index))
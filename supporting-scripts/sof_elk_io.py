@@ -0,0 +1,393 @@
+# SOF-ELK® Supporting script
+# (C)2026 Lewes Technology Consulting, LLC
+#
+# Shared file input and output for the SOF-ELK® supporting scripts.
+#
+# Input files may be plain or compressed with gzip, bzip2, xz, or zstd, which
+# is detected from the first bytes of the file rather than its name.  zstd
+# requires the zstandard module ("pip install zstandard").
+#
+# Output files are written under a temporary ".partial" name and renamed into
+# place only once they are complete, so filebeat never reads a half-written
+# file.  The compression for an output file is taken from its extension, but
+# note that filebeat can only read plain and gzip-compressed (".gz") files.
+#
+# Time spent reading and decompressing input, and compressing and writing
+# output, is charged to the "read" and "write" phases of sof_elk_stats, along
+# with the number of bytes read and written as stored on disk.  Output written
+# to standard output through open_stdout() is timed and counted the same way.
+#
+# This module lives next to the scripts that import it, so it is found even
+# when a script is run through a symlink in /usr/local/sbin.
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+
+from sof_elk_stats import stats
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+io_buffer_size = 1024 * 1024
+default_compresslevel = 6
+partial_suffix = ".partial"
+
+# leading bytes of each supported compression format
+compression_magic = {
+    "gzip": b"\x1f\x8b",
+    "bzip2": b"BZh",
+    "xz": b"\xfd7zXZ\x00",
+    "zstd": b"\x28\xb5\x2f\xfd",
+}
+compression_extensions = {
+    ".gz": "gzip",
+    ".bz2": "bzip2",
+    ".xz": "xz",
+    ".zst": "zstd",
+}
+magic_length = max(len(magic) for magic in compression_magic.values())
+
+
+def detect_compression(header):
+    """Return the compression format that the leading bytes in header belong to, or None."""
+    for compression, magic in compression_magic.items():
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def file_compression(filename):
+    """Return the compression format of a file, or None if it is not compressed."""
+    with open(filename, "rb") as f:
+        return detect_compression(f.read(magic_length))
+
+
+def compression_for_filename(filename):
+    """Return the compression format implied by a filename's extension, or None."""
+    return compression_extensions.get(os.path.splitext(filename)[1].lower())
+
+
+def strip_compression_extension(filename):
+    """Remove a compression extension (e.g. ".gz") from a filename, if it has one."""
+    root, ext = os.path.splitext(filename)
+    if ext.lower() in compression_extensions:
+        return root
+    return filename
+
+
+def open_compressed_reader(raw, compression, filename):
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if compression == "bzip2":
+        return bz2.BZ2File(raw, mode="rb")
+    if compression == "xz":
+        return lzma.LZMAFile(raw, mode="rb")
+    if zstandard is None:
+        raise OSError(
+            f"{filename} is zstd-compressed, which requires the zstandard module"
+        )
+    return zstandard.ZstdDecompressor().stream_reader(
+        raw, read_size=io_buffer_size, closefd=True
+    )
+
+
+class InputFile(io.RawIOBase):
+    """
+    Read-only binary file that transparently decompresses its content.  The
+    file is decoded as a stream, so memory use does not depend on its size.
+    Unless counted is False, the bytes read are added to the statistics.
+    """
+
+    def __init__(self, filename, counted=True):
+        self.name = filename
+        self.counted = counted
+        if filename == "-":
+            raw = open(os.dup(0), "rb", buffering=io_buffer_size)
+        else:
+            raw = open(filename, "rb", buffering=io_buffer_size)
+
+        try:
+            self.compression = detect_compression(raw.peek(magic_length))
+            if self.compression is None:
+                self.stream = raw
+            else:
+                self.stream = open_compressed_reader(raw, self.compression, filename)
+            # the compressed size can only be counted if the file has positions
+            self.count_raw_position = self.compression is not None and raw.seekable()
+        except BaseException:
+            raw.close()
+            raise
+        self.raw = raw
+        self.raw_position = 0
+        self.read_timer = stats.phase("read")
+
+    def readable(self):
+        return True
+
+    def count_bytes_in(self, count):
+        if not self.counted:
+            return
+        if self.count_raw_position:
+            raw_position = self.raw.tell()
+            count = raw_position - self.raw_position
+            self.raw_position = raw_position
+        stats.add_bytes_in(count)
+
+    def readinto(self, buffer):
+        with self.read_timer:
+            count = self.stream.readinto(buffer)
+        if count:
+            self.count_bytes_in(count)
+        return count
+
+    def read(self, size=-1):
+        with self.read_timer:
+            data = self.stream.read(size)
+        self.count_bytes_in(len(data))
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            self.raw.close()
+        super().close()
+
+
+def open_input(
+    filename,
+    mode="rt",
+    encoding="utf-8",
+    errors=None,
+    newline=None,
+    buffer_size=None,
+    counted=True,
+):
+    """
+    Open a plain or compressed file for reading.  A filename of "-" reads
+    standard input.  mode is "rt" (the default) for text or "rb" for bytes.
+    Pass counted=False when only peeking at a file that will be read again,
+    so its bytes are not counted twice in the statistics.
+    """
+    reader = io.BufferedReader(
+        InputFile(filename, counted), buffer_size or io_buffer_size
+    )
+    if "b" in mode:
+        return reader
+    return io.TextIOWrapper(reader, encoding=encoding, errors=errors, newline=newline)
+
+
+class OutputStream(io.RawIOBase):
+    """
+    Write-only stream under an OutputFile's write buffer that times each
+    buffer of data as it is compressed and written, and counts the bytes that
+    reach the file.
+    """
+
+    def __init__(self, stream, raw, raw_position):
+        self.stream = stream
+        self.raw = raw
+        self.raw_position = raw_position
+        self.write_timer = stats.phase("write")
+
+    def writable(self):
+        return True
+
+    def count_bytes_out(self):
+        raw_position = self.raw.tell()
+        stats.add_bytes_out(raw_position - self.raw_position)
+        self.raw_position = raw_position
+
+    def write(self, data):
+        with self.write_timer:
+            count = self.stream.write(data)
+        self.count_bytes_out()
+        return count
+
+    def close(self):
+        if not self.closed:
+            # a compressed stream writes the last of its data when closed
+            with self.write_timer:
+                if self.stream is not self.raw:
+                    self.stream.close()
+            self.count_bytes_out()
+        super().close()
+
+
+def open_compressed_writer(raw, compression, mode, compresslevel, filename):
+    if compression == "gzip":
+        # the gzip header records the final filename, not the partial one
+        return gzip.GzipFile(
+            filename=os.path.basename(filename),
+            fileobj=raw,
+            mode=mode,
+            compresslevel=compresslevel,
+        )
+    if compression == "bzip2":
+        return bz2.BZ2File(raw, mode=mode, compresslevel=max(1, compresslevel))
+    if compression == "xz":
+        return lzma.LZMAFile(raw, mode=mode, preset=compresslevel)
+    if zstandard is None:
+        raise OSError("zstd compression requires the zstandard module")
+    return zstandard.ZstdCompressor(level=compresslevel).stream_writer(
+        raw, closefd=False
+    )
+
+
+class OutputFile:
+    """
+    File that is written under a temporary ".partial" name and renamed to its
+    final name when it is closed.  If the block using it as a context manager
+    raises an exception, the partial file is removed instead.
+
+    With append, an existing file is appended to in place, because renaming a
+    copy over it would make filebeat read it as a new file.  Compressed output
+    is appended as a new gzip member (or bzip2/xz stream, or zstd frame), which
+    is still a valid file.
+    """
+
+    def __init__(
+        self,
+        filename,
+        mode="wt",
+        encoding="utf-8",
+        newline=None,
+        compression=None,
+        compresslevel=default_compresslevel,
+        append=False,
+        buffer_size=None,
+    ):
+        if compression is None:
+            compression = compression_for_filename(filename)
+        self.name = filename
+        self.compression = compression
+
+        if append and os.path.exists(filename):
+            self.partial_filename = None
+            raw_mode = "ab"
+            raw = open(filename, raw_mode, buffering=0)
+        else:
+            self.partial_filename = filename + partial_suffix
+            raw_mode = "wb"
+            raw = open(self.partial_filename, raw_mode, buffering=0)
+
+        try:
+            # compressed streams write a header as soon as they are opened
+            raw_position = raw.tell()
+            if compression is None:
+                stream = raw
+            else:
+                stream = open_compressed_writer(
+                    raw, compression, raw_mode, compresslevel, filename
+                )
+            self.file = io.BufferedWriter(
+                OutputStream(stream, raw, raw_position), buffer_size or io_buffer_size
+            )
+            if "b" not in mode:
+                self.file = io.TextIOWrapper(
+                    self.file, encoding=encoding, newline=newline
+                )
+        except BaseException:
+            raw.close()
+            self.discard()
+            raise
+        self.raw = raw
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def writelines(self, lines):
+        self.file.writelines(lines)
+
+    def flush(self):
+        self.file.flush()
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def close(self):
+        """Finish writing the file and move it to its final name."""
+        if self.raw.closed:
+            return
+        try:
+            self.file.close()
+        finally:
+            self.raw.close()
+        if self.partial_filename is not None:
+            os.replace(self.partial_filename, self.name)
+
+    def discard(self):
+        """Abandon the file, removing its partial output."""
+        if getattr(self, "raw", None) is not None and not self.raw.closed:
+            try:
+                self.file.close()
+            except (OSError, ValueError):
+                pass
+            self.raw.close()
+        if self.partial_filename is not None:
+            try:
+                os.remove(self.partial_filename)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def open_output(filename, mode="wt", **kwargs):
+    """Open a file for writing through OutputFile, which accepts the same arguments."""
+    return OutputFile(filename, mode, **kwargs)
+
+
+class StdoutStream(io.RawIOBase):
+    """
+    Write-only stream over standard output that times and counts each buffer
+    of data written, as OutputStream does for files.  Closing it flushes
+    standard output but leaves it open.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.write_timer = stats.phase("write")
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        with self.write_timer:
+            count = self.stream.write(data)
+        stats.add_bytes_out(count)
+        return count
+
+    def close(self):
+        if not self.closed:
+            with self.write_timer:
+                self.stream.flush()
+        super().close()
+
+
+def open_stdout(encoding="utf-8", newline=None, buffer_size=None):
+    """
+    Open standard output for writing text through the same buffering, timing,
+    and byte counting as an output file.  Close it to flush it.
+    """
+    sys.stdout.flush()
+    return io.TextIOWrapper(
+        io.BufferedWriter(
+            StdoutStream(sys.stdout.buffer), buffer_size or io_buffer_size
+        ),
+        encoding=encoding,
+        newline=newline,
+    )
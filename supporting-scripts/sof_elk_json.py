@@ -0,0 +1,249 @@
+# SOF-ELK® Supporting script
+# (C)2026 Lewes Technology Consulting, LLC
+#
+# Shared JSON handling for the SOF-ELK® supporting scripts.
+#
+# The orjson module is used to encode and decode JSON when it is installed
+# ("pip install orjson"), and the standard library json module otherwise.  The
+# two produce the same compact output, except that orjson spells some floats
+# differently: exponents without "+" or leading zeros (1e16 rather than 1e+16,
+# 1e-7 rather than 1e-07), and small numbers such as 0.00001 in positional
+# rather than scientific notation (1e-05).  Both spellings decode to the same
+# value.  NaN and Infinity, which are not valid JSON, are written as null by
+# either module.  Anything orjson cannot handle exactly like the json module
+# (non-ASCII text when ASCII output was requested, integers beyond 64 bits,
+# lone surrogates, NaN/Infinity literals in the input) is passed to the json
+# module instead.
+#
+# This module lives next to the scripts that import it, so it is found even
+# when a script is run through a symlink in /usr/local/sbin.
+
+import json
+import math
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+backend = "orjson" if orjson is not None else "json"
+
+JSONDecodeError = json.JSONDecodeError
+
+read_chunk_size = 1024 * 1024
+# documents up to this size (in characters) are decoded in one call by
+# JSONStream.read_document(), larger ones are walked value by value
+whole_document_size = 16 * 1024 * 1024
+
+json_decoder = json.JSONDecoder()
+ascii_encoder = json.JSONEncoder(
+    separators=(",", ":"), ensure_ascii=True, allow_nan=False
+)
+unicode_encoder = json.JSONEncoder(
+    separators=(",", ":"), ensure_ascii=False, allow_nan=False
+)
+# stray BOMs between values are skipped along with whitespace
+whitespace_regex = re.compile(r"[ \t\n\r\ufeff]*")
+# orjson decodes integers that do not fit in 64 bits as floats
+long_number_regex = re.compile(r"\d{19}")
+
+
+def loads(s):
+    """Decode a JSON document from a str."""
+    if orjson is not None and not long_number_regex.search(s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # let the json module decide, and raise its error if it is invalid
+            pass
+    return json.loads(s)
+
+
+def replace_non_finite(obj):
+    """Return a copy of obj with NaN and Infinity floats replaced by None."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [replace_non_finite(value) for value in obj]
+    return obj
+
+
+def encode_finite(encoder, obj):
+    """
+    Encode obj with a json module encoder that rejects NaN and Infinity,
+    writing them as null just as orjson does.  Only objects that contain
+    them are copied.
+    """
+    try:
+        return encoder.encode(obj)
+    except ValueError:
+        return encoder.encode(replace_non_finite(obj))
+
+
+def dumps(obj, ensure_ascii=True):
+    """
+    Encode obj as compact JSON text.  With ensure_ascii, all non-ASCII
+    characters are escaped, just as json.dumps() does by default.  NaN and
+    Infinity are written as null.
+    """
+    if orjson is not None:
+        try:
+            encoded = orjson.dumps(obj).decode("utf-8")
+        except TypeError:
+            pass
+        else:
+            if not ensure_ascii or encoded.isascii():
+                return encoded
+
+    if ensure_ascii:
+        return encode_finite(ascii_encoder, obj)
+    return encode_finite(unicode_encoder, obj)
+
+
+class JSONStream:
+    """
+    Incremental reader that decodes one JSON value at a time from a text file
+    handle.  Only the portion of the file needed to decode the current value is
+    held in memory, so arbitrarily large documents can be walked piece by piece.
+    Values are decoded with decoder, which must have a raw_decode() method like
+    json.JSONDecoder.
+    """
+
+    def __init__(self, input_file, decoder=json_decoder):
+        self.input_file = input_file
+        self.decoder = decoder
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=read_chunk_size):
+        """Discard consumed text and append the next chunk from the file."""
+        if self.pos:
+            self.buffer = self.buffer[self.pos :]
+            self.pos = 0
+
+        chunk = self.input_file.read(size)
+        if chunk:
+            self.buffer += chunk
+        else:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it, or "" at EOF."""
+        while True:
+            self.pos = whitespace_regex.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        """Consume the next non-whitespace character, which must be char."""
+        if self.peek() != char:
+            raise JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def decode(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        size = read_chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a value that runs to the end of the buffer (e.g. a number)
+                # may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except JSONDecodeError:
+                if self.eof:
+                    raise
+
+            self.fill(size)
+            size *= 2
+
+    def read_document(self, max_size=whole_document_size):
+        """
+        If the rest of the input is no longer than max_size characters, decode
+        it as a single JSON document with loads() and return it.  Otherwise,
+        return None and leave the text buffered so it can be walked with
+        decode() instead.  Decoding a whole document in one call is much faster than
+        walking it value by value, particularly with orjson.
+        """
+        while not self.eof and len(self.buffer) - self.pos <= max_size:
+            self.fill()
+        if not self.eof:
+            return None
+
+        # if the document is not valid JSON, the text is left in the buffer
+        # so the caller can still walk the values ahead of the error
+        document = loads(self.buffer[self.pos :])
+        self.buffer = ""
+        self.pos = 0
+        return document
+
+
+# these are needed to preserve numerical formatting within the JSON in the
+# filebeat registry file
+class RawJSON:
+    """Wraps a raw JSON number/text so it's emitted verbatim, unquoted."""
+
+    def __init__(self, raw_text):
+        self.raw = raw_text
+
+
+def preserve_sci_notation(s):
+    # s is the original numeric substring exactly as it appeared in the source
+    if "e" in s or "E" in s:
+        return RawJSON(s)
+    return float(s)  # normal floats parse/format as usual
+
+
+# decoder for JSONStream that keeps numbers written in scientific notation as RawJSON
+preserving_decoder = json.JSONDecoder(parse_float=preserve_sci_notation)
+
+
+def loads_preserving_notation(s):
+    """Decode JSON, keeping numbers written in scientific notation as RawJSON."""
+    return preserving_decoder.decode(s)
+
+
+class RawJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, RawJSON):
+            return f"@@RAW@@{o.raw}@@RAW@@"
+        return super().default(o)
+
+
+raw_json_encoder = RawJSONEncoder(
+    separators=(",", ":"), ensure_ascii=False, allow_nan=False
+)
+
+
+def raw_json_fragment(o):
+    if isinstance(o, RawJSON):
+        return orjson.Fragment(o.raw)
+    raise TypeError
+
+
+def dumps_preserving_notation(data):
+    """
+    Encode data as compact, non-ASCII-escaped JSON, writing RawJSON values
+    verbatim and NaN and Infinity as null.  orjson can only do this in
+    releases that have orjson.Fragment.
+    """
+    if orjson is not None and hasattr(orjson, "Fragment"):
+        try:
+            return orjson.dumps(data, default=raw_json_fragment).decode("utf-8")
+        except TypeError:
+            pass
+
+    s = encode_finite(raw_json_encoder, data)
+    return re.sub(r'"@@RAW@@(.*?)@@RAW@@"', lambda m: m.group(1), s)
+
+
+# end numerical-formatting preservation
@@ -0,0 +1,366 @@
+# SOF-ELK® Supporting script
+# (C)2026 Lewes Technology Consulting, LLC
+#
+# Shared throughput statistics and profiling for the SOF-ELK® converter scripts.
+#
+# Each process keeps one ConversionStats object, "stats", that counts the files
+# and records converted and the bytes read and written, and times each phase of
+# the conversion: read (reading and decompressing input), decode (parsing JSON
+# or CSV), transform (converting records), and write (encoding, compressing,
+# and writing output).  A main process also counts the time it spends waiting
+# for its worker processes.  Time outside of these phases is counted as "other".
+# The timers are always on, so they are only ever switched once per file,
+# batch, or buffer of data, never once per record.
+#
+# Converters add the --stats and --profile options with add_arguments() and act
+# on them with start().  --stats writes a line of progress to stderr every few
+# seconds and a full report at exit.  --profile writes a cProfile dump (read it
+# with "python3 -m pstats FILE") or a tracemalloc snapshot of the main process.
+#
+# Worker processes start with empty counters and send them to the main process
+# with take(), where they are added in with merge().
+#
+# This module lives next to the scripts that import it, so it is found even
+# when a script is run through a symlink in /usr/local/sbin.
+
+import atexit
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+default_report_interval = 10
+phases = ("read", "decode", "transform", "write", "wait", "other")
+
+
+def peak_rss_kb():
+    """Return the peak resident set size of this process and its finished children in KB, or 0 if unknown."""
+    if resource is None:
+        return 0
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # macOS reports bytes rather than KB
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+    return peak_rss
+
+
+def format_bytes(count):
+    return f"{count / 1048576:.1f} MB"
+
+
+class PhaseTimer:
+    """Context manager that charges the time spent inside it to one phase."""
+
+    __slots__ = ("stats", "phase")
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+    def __enter__(self):
+        self.stats.enter_phase(self.phase)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.leave_phase()
+
+
+class ConversionStats:
+    """
+    Counters and phase timers for one process.  Phases nest, and time is only
+    charged to the innermost one, so input read while decoding counts as read
+    time rather than decode time.
+    """
+
+    def __init__(self):
+        self.timers = {phase: PhaseTimer(self, phase) for phase in phases}
+        self.report_interval = 0
+        self.profile = None
+        self.reset()
+
+    def reset(self):
+        """Clear every counter and timer, starting the clock again."""
+        self.start_time = time.perf_counter()
+        self.files = 0
+        self.records = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.worker_peak_rss_kb = 0
+        self.workers_merged = False
+        self.phase_times = dict.fromkeys(phases, 0.0)
+        self.current_phase = "other"
+        self.phase_stack = []
+        self.phase_start = self.start_time
+        self.next_report = time.monotonic() + self.report_interval
+
+    def forked(self):
+        # a forked worker starts counting from zero and only reports through
+        # the main process
+        self.report_interval = 0
+        if self.profile is not None:
+            # only the main process is profiled
+            self.profile.disable()
+            self.profile = None
+        self.reset()
+
+    def phase(self, phase):
+        """Return the context manager that times one phase, e.g. "with stats.phase("decode"):"."""
+        return self.timers[phase]
+
+    def enter_phase(self, phase):
+        now = time.perf_counter()
+        self.phase_times[self.current_phase] += now - self.phase_start
+        self.phase_start = now
+        self.phase_stack.append(self.current_phase)
+        self.current_phase = phase
+
+    def leave_phase(self):
+        now = time.perf_counter()
+        self.phase_times[self.current_phase] += now - self.phase_start
+        self.phase_start = now
+        self.current_phase = self.phase_stack.pop() if self.phase_stack else "other"
+
+    def timed(self, iterable, phase):
+        """
+        Iterate over iterable, charging the time taken to produce each item to
+        phase.  The return value of a generator is passed through, so this can
+        be used with "yield from".
+        """
+        iterator = iter(iterable)
+        timer = self.timers[phase]
+        while True:
+            with timer:
+                try:
+                    item = next(iterator)
+                except StopIteration as e:
+                    return e.value
+            yield item
+
+    def add_files(self, count=1):
+        self.files += count
+        self.maybe_report()
+
+    def add_records(self, count):
+        self.records += count
+        self.maybe_report()
+
+    def add_bytes_in(self, count):
+        self.bytes_in += count
+        self.maybe_report()
+
+    def add_bytes_out(self, count):
+        self.bytes_out += count
+
+    def take(self):
+        """
+        Return the counters and timers of this process as a dictionary that
+        can be passed to merge() in another process, and clear them.
+        """
+        self.charge_current_phase()
+        snapshot = {
+            "files": self.files,
+            "records": self.records,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "phase_times": self.phase_times,
+            "peak_rss_kb": self.peak_rss_kb(),
+        }
+        self.files = self.records = self.bytes_in = self.bytes_out = 0
+        self.phase_times = dict.fromkeys(phases, 0.0)
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the counters and timers from another process's take() to these."""
+        self.files += snapshot["files"]
+        self.records += snapshot["records"]
+        self.bytes_in += snapshot["bytes_in"]
+        self.bytes_out += snapshot["bytes_out"]
+        for phase, phase_time in snapshot["phase_times"].items():
+            self.phase_times[phase] += phase_time
+        self.worker_peak_rss_kb = max(self.worker_peak_rss_kb, snapshot["peak_rss_kb"])
+        self.workers_merged = True
+        self.maybe_report()
+
+    def charge_current_phase(self):
+        # charge the time so far to the current phase without leaving it
+        now = time.perf_counter()
+        self.phase_times[self.current_phase] += now - self.phase_start
+        self.phase_start = now
+
+    def elapsed(self):
+        return max(time.perf_counter() - self.start_time, 0.000001)
+
+    def peak_rss_kb(self):
+        return max(peak_rss_kb(), self.worker_peak_rss_kb)
+
+    def progress_line(self):
+        elapsed = self.elapsed()
+        line = (
+            f"{elapsed:.1f}s: {self.files} files, {self.records} records"
+            f" ({self.records / elapsed:.0f} records/s),"
+            f" {format_bytes(self.bytes_in)} in ({self.bytes_in / 1048576 / elapsed:.1f} MB/s),"
+            f" {format_bytes(self.bytes_out)} out"
+        )
+        if resource is not None:
+            line += f", peak RSS {format_bytes(self.peak_rss_kb() * 1024)}"
+        return line
+
+    def maybe_report(self):
+        if self.profile is not None:
+            self.profile.checkpoint()
+        if self.report_interval and time.monotonic() >= self.next_report:
+            self.next_report = time.monotonic() + self.report_interval
+            sys.stderr.write(f"Progress: {self.progress_line()}\n")
+
+    def report(self, name):
+        """Write the final statistics report to stderr."""
+        self.charge_current_phase()
+        elapsed = self.elapsed()
+        phase_total = max(sum(self.phase_times.values()), 0.000001)
+        phase_summary = ", ".join(
+            f"{phase} {self.phase_times[phase]:.2f}s ({self.phase_times[phase] / phase_total:.0%})"
+            for phase in phases
+        )
+
+        lines = [
+            f"{name} statistics:",
+            f"  Elapsed:    {elapsed:.2f}s",
+            f"  Files:      {self.files}",
+            f"  Records:    {self.records} ({self.records / elapsed:.0f} records/s)",
+            f"  Bytes in:   {format_bytes(self.bytes_in)} ({self.bytes_in / 1048576 / elapsed:.1f} MB/s)",
+            f"  Bytes out:  {format_bytes(self.bytes_out)} ({self.bytes_out / 1048576 / elapsed:.1f} MB/s)",
+        ]
+        if resource is not None:
+            lines.append(f"  Peak RSS:   {format_bytes(self.peak_rss_kb() * 1024)}")
+        if self.workers_merged:
+            lines.append(f"  Phases (all processes): {phase_summary}")
+        else:
+            lines.append(f"  Phases:     {phase_summary}")
+        sys.stderr.write("\n".join(lines) + "\n")
+
+
+stats = ConversionStats()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=stats.forked)
+
+
+def add_arguments(parser):
+    """Add the --stats and --profile options to an argparse parser."""
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        help="Report files, records, bytes read and written, records/sec, and peak memory use every few seconds while converting, and time spent in each phase when finished.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        dest="stats_interval",
+        help=f"Seconds between progress reports with --stats. (Default: {default_report_interval})",
+        type=float,
+        default=default_report_interval,
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        help="Write a profile of the conversion to this file.  Only the main process is profiled, so use one job to profile the conversion itself.",
+        default=None,
+    )
+    parser.add_argument(
+        "--profile-mode",
+        dest="profile_mode",
+        help='With --profile, write a "cpu" profile (cProfile, for "python3 -m pstats") or a "memory" snapshot of allocations (tracemalloc), which makes the conversion several times slower. (Default: cpu)',
+        choices=("cpu", "memory"),
+        default="cpu",
+    )
+
+
+class MemoryProfile:
+    """
+    tracemalloc profile that keeps a snapshot of the allocations from when
+    the traced memory was at its highest, checked at each progress checkpoint.
+    """
+
+    # a new snapshot is only taken once traced memory has grown by this much
+    growth_factor = 1.1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.snapshot = None
+        self.snapshot_size = 0
+        # one frame per allocation: deeper tracebacks slow the conversion
+        # down by well over an order of magnitude
+        tracemalloc.start(1)
+
+    def checkpoint(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.snapshot_size * self.growth_factor:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_size = current
+
+    def disable(self):
+        tracemalloc.stop()
+
+    def stop(self):
+        self.checkpoint()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.snapshot.dump(self.filename)
+        sys.stderr.write(
+            f"Wrote tracemalloc snapshot taken at {format_bytes(self.snapshot_size)} traced memory to {self.filename} (peak {format_bytes(peak)}).\n"
+        )
+
+
+class CPUProfile:
+    """cProfile profile of everything the process does until it exits."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def checkpoint(self):
+        pass
+
+    def disable(self):
+        self.profiler.disable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.filename)
+        sys.stderr.write(f"Wrote cProfile data to {self.filename}.\n")
+
+
+def start_profile(filename, mode):
+    """Start profiling this process, writing the profile to filename at exit."""
+    if mode == "memory":
+        profile = MemoryProfile(filename)
+    else:
+        profile = CPUProfile(filename)
+    stats.profile = profile
+    atexit.register(profile.stop)
+
+
+def start(args, name):
+    """
+    Act on the options from add_arguments(): start profiling and periodic
+    progress reports, and report the statistics when the script exits.
+    """
+    if args.stats:
+        if args.stats_interval > 0:
+            stats.report_interval = args.stats_interval
+            stats.next_report = time.monotonic() + args.stats_interval
+        atexit.register(stats.report, name)
+
+    if args.profile:
+        start_profile(args.profile, args.profile_mode)
@@ -0,0 +1,61 @@
+import importlib.util
+import os
+import sys
+
+scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, scripts_dir)
+
+spec = importlib.util.spec_from_file_location(
+    "azure_flow2sof_elk", os.path.join(scripts_dir, "azure-flow2sof-elk.py")
+)
+azure_flow = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(azure_flow)
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+
+def vnet_record(flowtuples):
+    return {
+        "category": "FlowLogFlowEvent",
+        "flowLogGUID": "00000000-0000-0000-0000-000000000000",
+        "macAddress": "00224871C205",
+        "flowLogVersion": 4,
+        "flowRecords": {
+            "flows": [{"flowGroups": [{"rule": "test-rule", "flowTuples": flowtuples}]}]
+        },
+    }
+
+
+def test_restarted_flow_emits_both_flows():
+    flow = "10.0.0.4,10.0.0.5,44931,443,6,O"
+    writer = ListWriter()
+    inflight_flows = azure_flow.FlowTable(writer)
+
+    flow_groups = azure_flow.vnet_flow_groups(
+        vnet_record(
+            [
+                "1700000000000,%s,B,NX,,,," % (flow),
+                "1700000060000,%s,C,NX,1,100,2,200" % (flow),
+                "1700000120000,%s,B,NX,,,," % (flow),
+                "1700000180000,%s,E,NX,3,300,4,400" % (flow),
+            ]
+        ),
+        "test.json",
+    )
+    azure_flow.process_flow_groups(list(flow_groups), inflight_flows)
+    inflight_flows.flush()
+
+    states = azure_flow.output_csv_columns.index("state")
+    out_bytes = azure_flow.output_csv_columns.index("out_bytes")
+    assert [(row[states], row[out_bytes]) for row in writer.rows] == [
+        ("partial", 100),
+        ("complete", 300),
+    ]
+    assert len(inflight_flows) == 0
+    assert len(inflight_flows.free_slots) == len(inflight_flows.profiles)
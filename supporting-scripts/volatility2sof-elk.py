@@ -27,18 +27,55 @@
 #   multiline JSON created with the "-r json" renderer into newline-delimited
 #   JSON, allowing a clean ingest.
 #
+#   Input is decoded and converted as it is read: newline-delimited JSON is
+#   handled one line at a time and a top-level JSON array one element at a
+#   time, so memory use does not grow with the size of the input file.  The
+#   input may also be compressed with gzip, bzip2, xz, or zstd.
+#
+#   Use "--stats" to report throughput and the time spent in each phase of
+#   the conversion, or "--profile" to profile it.
+#
 # Usage:
 #   volatility2sof-elk.py -r pstree-UTF16.json -w pstree_-UTF8.json
 #   volatility2sof-elk.py -r pslist-UTF16.json -w -  # prints results on stdout
 #   volatility2sof-elk.py -r cmdline-UTF16.json -w cmdline-UTF8.json --encoding utf-16
+#   volatility2sof-elk.py -r /cases/images/  # converts every file in the tree
 #
 # Output is always UTF-8 newline-delimited JSON with one record per line,
 # suitable for ingest via the /logstash/volatility/*/ directories.
+#
+# When given a directory, every *.json and *.jsonl file beneath it (including
+# compressed ones such as *.json.gz) is converted in parallel and written to
+# the /logstash/volatility/<plugin>/ directory for the plugin that created it,
+# which is taken from the file's path (e.g. "windows.pslist.json" or
+# "img01/netscan.json") or, for plugins whose records are distinctive, from
+# the file's first record.
 
 import argparse
-import json
+import itertools
+import multiprocessing
+import os
+import re
+import signal
 import sys
-import contextlib
+import time
+
+import sof_elk_io
+import sof_elk_json
+import sof_elk_stats
+from sof_elk_json import JSONStream
+from sof_elk_stats import stats
+
+read_chunk_size = 1024 * 1024
+line_batch_size = 1000
+
+default_destdir = "/logstash/volatility/"
+batch_extensions = (".json", ".jsonl")
+# plugins with a /logstash/volatility/<plugin>/ ingest directory
+ingest_plugins = ("cmdline", "netscan", "netstat", "pslist", "psscan", "pstree")
+plugin_name_regex = re.compile(
+    r"(?:^|[^a-z0-9])(?:windows\.)?(%s)(?:[^a-z0-9]|$)" % ("|".join(ingest_plugins))
+)
 
 
 def detect_encoding(filename):
@@ -47,7 +84,7 @@ def detect_encoding(filename):
     'utf-8-sig' — UTF-8 with BOM
     'utf-8'     — no BOM, assume UTF-8 (covers Linux/macOS native output)
     """
-    with open(filename, "rb") as f:
+    with sof_elk_io.open_input(filename, "rb", counted=False) as f:
         head = f.read(4)
     if head.startswith(b"\xff\xfe") or head.startswith(b"\xfe\xff"):
         return "utf-16"
@@ -57,9 +94,20 @@ def detect_encoding(filename):
         return "utf-8"
 
 
+def peek_first_char(inputfile):
+    """Return the first character that is not whitespace or a BOM, or "" if there is none."""
+    while True:
+        chunk = inputfile.read(read_chunk_size)
+        if not chunk:
+            return ""
+        chunk = chunk.lstrip("\ufeff").lstrip()
+        if chunk:
+            return chunk[0]
+
+
 def emit_line(obj, out):
     """Serialize one record as a single line of compact UTF-8 JSON."""
-    out.write(json.dumps(obj, ensure_ascii=False))
+    out.write(sof_elk_json.dumps(obj, ensure_ascii=False))
     out.write("\n")
 
 
@@ -76,57 +124,154 @@ def emit_object(obj, out, processed, skipped):
     return processed, skipped
 
 
-def process(input_filename, output_filename, encoding=None):
-    if encoding is None:
-        encoding = detect_encoding(input_filename)
+def emit_stream(inputfile, out, processed, skipped):
+    """
+    Emit a sequence of JSON values (e.g. the output of the "-r json" renderer).
+    Top-level arrays are walked one element at a time, and the rest of the
+    file is skipped after the first value that is not valid JSON.
+    """
+    stream = JSONStream(inputfile)
+    decode_timer = stats.phase("decode")
+    processed_before = processed
+    try:
+        while stream.peek():
+            if stream.peek() != "[":
+                with decode_timer:
+                    obj = stream.decode()
+                processed, skipped = emit_object(obj, out, processed, skipped)
+                continue
 
-    # errors="replace" is a safety net for the rare mangled byte — same
-    # convention csv2json.py uses. Lets one bad byte spoil only the chars
-    # around it, not the whole file.
-    with open(input_filename, "r", encoding=encoding, errors="replace") as inputfile:
-        content = inputfile.read()
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+                continue
+            while True:
+                with decode_timer:
+                    obj = stream.decode()
+                processed, skipped = emit_object(obj, out, processed, skipped)
+                if stream.peek() == ",":
+                    stream.pos += 1
+                    continue
+                stream.expect("]")
+                break
 
-    # Strip any stray BOM at the top of the file (utf-16 codec usually
-    # consumes the BOM itself, but utf-8-sig and edge cases sometimes
-    # leave a U+FEFF behind).
-    content = content.lstrip("\ufeff").strip()
+    except sof_elk_json.JSONDecodeError as e:
+        sys.stderr.write(
+            f"volatility2sof-elk.py: skipping rest of file after bad JSON ({e})\n"
+        )
+        skipped += 1
 
-    if not content:
-        sys.stderr.write(f"volatility2sof-elk: empty input {input_filename}\n")
-        return 0
+    stats.add_records(processed - processed_before)
+    return processed, skipped
 
-    lines_processed = 0
-    lines_skipped = 0
 
-    if output_filename == "-":
-        cm = contextlib.nullcontext(sys.stdout)
-    else:
-        cm = open(output_filename, "w", encoding="utf-8")
+def emit_lines(inputfile, out, processed, skipped):
+    """
+    Emit newline-delimited JSON one line at a time.  Returns None without
+    emitting anything if the first line is the start of a JSON value that
+    spans several lines, so the file can be handled by emit_stream() instead.
+    Lines are read, decoded, and emitted line_batch_size at a time, so each
+    phase is only timed once per batch.
+    """
+    first_line = True
+    lineno = 0
+    while True:
+        with stats.phase("read"):
+            lines = list(itertools.islice(inputfile, line_batch_size))
+        if not lines:
+            break
 
-    with cm as out:
-        try:
-            # Path 1: whole file parses as one JSON value (array or single dict)
-            obj = json.loads(content)
-            lines_processed, lines_skipped = emit_object(
-                obj, out, lines_processed, lines_skipped
-            )
-        except json.JSONDecodeError:
-            # Path 2: not one big JSON — try line-by-line (newline-delimited JSON)
-            for lineno, ln in enumerate(content.splitlines(), 1):
+        objs = []
+        with stats.phase("decode"):
+            for ln in lines:
+                lineno += 1
                 ln = ln.strip().lstrip("\ufeff")
                 if not ln:
                     continue
                 try:
-                    obj = json.loads(ln)
-                except json.JSONDecodeError as e:
+                    objs.append(sof_elk_json.loads(ln))
+                except sof_elk_json.JSONDecodeError as e:
+                    if first_line and e.pos >= len(ln):
+                        return None
                     sys.stderr.write(
                         f"volatility2sof-elk.py: line {lineno}: skipping bad JSON ({e})\n"
                     )
-                    lines_skipped += 1
-                    continue
-                lines_processed, lines_skipped = emit_object(
-                    obj, out, lines_processed, lines_skipped
-                )
+                    skipped += 1
+                finally:
+                    first_line = False
+
+        processed_before = processed
+        for obj in objs:
+            processed, skipped = emit_object(obj, out, processed, skipped)
+        stats.add_records(processed - processed_before)
+
+    return processed, skipped
+
+
+def open_input_file(input_filename, encoding, counted=True):
+    # errors="replace" is a safety net for the rare mangled byte — same
+    # convention csv2json.py uses. Lets one bad byte spoil only the chars
+    # around it, not the whole file.
+    return sof_elk_io.open_input(
+        input_filename, encoding=encoding, errors="replace", counted=counted
+    )
+
+
+def emit_file(input_filename, out, encoding, first_char):
+    """Emit every record in an input file, returning the number written and skipped."""
+    counts = None
+    if first_char != "[":
+        # Path 1: newline-delimited JSON, one record per line
+        with open_input_file(input_filename, encoding) as inputfile:
+            counts = emit_lines(inputfile, out, 0, 0)
+
+    if counts is None:
+        # Path 2: a JSON array or other value(s) spanning several lines
+        with open_input_file(input_filename, encoding) as inputfile:
+            counts = emit_stream(inputfile, out, 0, 0)
+
+    return counts
+
+
+def convert(input_filename, output_filename, encoding, discard_empty=False):
+    """
+    Convert one input file, returning the number of records written and
+    skipped, or None if the input file is empty.  The input may be compressed,
+    and output files are renamed into place once they are complete.  With
+    discard_empty, an output file that would contain no records is removed.
+    """
+    with open_input_file(input_filename, encoding, counted=False) as inputfile:
+        # Stray BOMs at the top of the file (utf-16 codec usually consumes the
+        # BOM itself, but utf-8-sig and edge cases sometimes leave a U+FEFF
+        # behind) are skipped along with whitespace.
+        first_char = peek_first_char(inputfile)
+    if not first_char:
+        return None
+
+    if output_filename == "-":
+        with sof_elk_io.open_stdout() as out:
+            with stats.phase("transform"):
+                counts = emit_file(input_filename, out, encoding, first_char)
+    else:
+        with sof_elk_io.open_output(output_filename, encoding="utf-8") as out:
+            with stats.phase("transform"):
+                counts = emit_file(input_filename, out, encoding, first_char)
+            if discard_empty and counts[0] == 0:
+                out.discard()
+
+    stats.add_files()
+    return counts
+
+
+def process(input_filename, output_filename, encoding=None):
+    if encoding is None:
+        encoding = detect_encoding(input_filename)
+
+    counts = convert(input_filename, output_filename, encoding)
+    if counts is None:
+        sys.stderr.write(f"volatility2sof-elk: empty input {input_filename}\n")
+        return 0
+    lines_processed, lines_skipped = counts
 
     sys.stderr.write(
         f"volatility2sof-elk.py: {lines_processed} records  {input_filename} -> {output_filename}"
@@ -136,6 +281,180 @@ def process(input_filename, output_filename, encoding=None):
     return lines_processed
 
 
+def first_record(input_filename, encoding):
+    """Return the first record in a file, or None if it cannot be read."""
+    with open_input_file(input_filename, encoding, counted=False) as inputfile:
+        stream = JSONStream(inputfile)
+        try:
+            if stream.peek() == "[":
+                stream.expect("[")
+            value = stream.decode()
+        except sof_elk_json.JSONDecodeError:
+            return None
+
+    while isinstance(value, list) and value:
+        value = value[0]
+    if isinstance(value, dict):
+        return value
+    return None
+
+
+def detect_plugin(input_filename, relative_name, encoding):
+    """
+    Return the ingest plugin name for a Volatility output file, or None.  The
+    file name is checked first, then the directories above it, and finally the
+    fields of the first record.  pslist and psscan, like netscan and netstat,
+    produce records with the same fields, so those can only be told apart by
+    name.
+    """
+    path_parts = relative_name.lower().split(os.sep)
+    for part in reversed(path_parts):
+        plugin_match = plugin_name_regex.search(part)
+        if plugin_match:
+            return plugin_match.group(1)
+
+    record = first_record(input_filename, encoding)
+    if record is None:
+        return None
+    elif "Args" in record:
+        return "cmdline"
+    elif "Cmd" in record or "Audit" in record:
+        return "pstree"
+    return None
+
+
+def convert_batch_file(task):
+    """
+    Convert one file found in batch mode into the ingest directory for its
+    plugin.  Output is written under a temporary name and renamed when
+    complete so filebeat never reads a partial file.  Returns a dictionary
+    describing the result.
+    """
+    input_filename, relative_name, output_root, encoding, overwrite, compress = task
+    result = {
+        "input": input_filename,
+        "output": None,
+        "bytes": os.path.getsize(input_filename),
+        "records": 0,
+        "skipped": 0,
+        "error": None,
+    }
+
+    if encoding is None:
+        encoding = detect_encoding(input_filename)
+
+    plugin = detect_plugin(input_filename, relative_name, encoding)
+    if plugin is None:
+        result["error"] = "could not determine plugin"
+        return result
+
+    # flatten the relative path into the file name so files with the same
+    # name from different images do not collide
+    output_name = os.path.splitext(
+        sof_elk_io.strip_compression_extension(relative_name).replace(os.sep, "_")
+    )[0]
+    output_name += ".json.gz" if compress else ".json"
+    output_filename = os.path.join(output_root, plugin, output_name)
+    result["output"] = output_filename
+
+    if os.path.exists(output_filename) and not overwrite:
+        result["error"] = "output file exists"
+        return result
+
+    try:
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+        counts = convert(input_filename, output_filename, encoding, discard_empty=True)
+    except OSError as e:
+        result["error"] = f"could not convert ({e})"
+        counts = None
+
+    if counts is None or counts[0] == 0:
+        if result["error"] is None:
+            result["error"] = "no records"
+        if counts is not None:
+            result["skipped"] = counts[1]
+        return result
+
+    result["records"], result["skipped"] = counts
+    return result
+
+
+def init_worker():
+    # ctrl-c is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_batch_task(task):
+    """Convert one file in a worker process, adding the worker's statistics to the result."""
+    result = convert_batch_file(task)
+    result["stats"] = stats.take()
+    return result
+
+
+def process_batch(
+    input_dir, output_root, encoding=None, jobs=1, overwrite=False, compress=False
+):
+    """
+    Convert every Volatility output file beneath input_dir with a pool of jobs
+    worker processes and print a summary.  Returns the number of files
+    converted.
+    """
+    tasks = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            base_name = sof_elk_io.strip_compression_extension(name)
+            if base_name.lower().endswith(batch_extensions):
+                input_filename = os.path.join(root, name)
+                relative_name = os.path.relpath(input_filename, input_dir)
+                tasks.append(
+                    (
+                        input_filename,
+                        relative_name,
+                        output_root,
+                        encoding,
+                        overwrite,
+                        compress,
+                    )
+                )
+
+    if not tasks:
+        sys.stderr.write(f"volatility2sof-elk.py: no JSON files found in {input_dir}\n")
+        return 0
+
+    start_time = time.monotonic()
+    results = []
+    with multiprocessing.Pool(
+        processes=min(jobs, len(tasks)), initializer=init_worker
+    ) as pool:
+        for result in stats.timed(pool.imap_unordered(run_batch_task, tasks), "wait"):
+            stats.merge(result.pop("stats"))
+            if result["error"] is None:
+                sys.stderr.write(
+                    f"volatility2sof-elk.py: {result['records']} records  {result['input']} -> {result['output']}\n"
+                )
+            results.append(result)
+    elapsed = max(time.monotonic() - start_time, 0.001)
+
+    converted = [result for result in results if result["error"] is None]
+    failed = [result for result in results if result["error"] is not None]
+    total_bytes = sum(result["bytes"] for result in results)
+    total_records = sum(result["records"] for result in results)
+    total_skipped = sum(result["skipped"] for result in results)
+
+    print(
+        f"Converted {len(converted)} of {len(results)} files: {total_records} records"
+        f" ({total_skipped} skipped) from {total_bytes / 1048576:.1f} MB in {elapsed:.1f}s"
+        f" ({total_bytes / 1048576 / elapsed:.1f} MB/s, {total_records / elapsed:.0f} records/s)"
+    )
+    if failed:
+        print(f"Skipped {len(failed)} files:")
+        for result in sorted(failed, key=lambda result: result["input"]):
+            print(f"- {result['input']}: {result['error']}")
+
+    return len(converted)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Normalize Volatility 3 JSON output into clean UTF-8 newline-delimited JSON.",
@@ -144,6 +463,7 @@ def main():
             "  volatility2sof-elk.py -r pstree-UTF16.json -w pstree-UTF8.json\n"
             "  volatility2sof-elk.py -r pslist-UTF16.json -w - | head\n"
             "  volatility2sof-elk.py -r cmdline-UTF16.json -w cmdline-UTF8.json --encoding utf-16\n"
+            "  volatility2sof-elk.py -r /cases/images/ -j 8\n"
         ),
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -152,14 +472,17 @@ def main():
         "--read",
         dest="input_filename",
         required=True,
-        help="Input Volatility JSON file (UTF-8 / UTF-8 BOM / UTF-16 LE/BE auto-detected)",
+        help="Input Volatility JSON file (UTF-8 / UTF-8 BOM / UTF-16 LE/BE auto-detected, "
+        "optionally gzip/bzip2/xz/zstd-compressed), "
+        "or a directory tree of *.json and *.jsonl files to convert in batch mode",
     )
     parser.add_argument(
         "-w",
         "--write",
         dest="output_filename",
-        required=True,
-        help='Output newline-delimited JSON file path. Use "-" for stdout.',
+        default=None,
+        help='Output newline-delimited JSON file path. Use "-" for stdout. '
+        f"In batch mode, the directory containing the per-plugin ingest directories (default: {default_destdir})",
     )
     parser.add_argument(
         "--encoding",
@@ -168,7 +491,58 @@ def main():
         help="Force input encoding (e.g., utf-8, utf-16, utf-16-le, utf-8-sig). "
         "Default: auto-detect via BOM, fall back to utf-8.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=0,
+        help="Batch mode: number of files to convert in parallel. "
+        "Default: one worker per CPU core.",
+    )
+    parser.add_argument(
+        "--overwrite",
+        dest="overwrite",
+        action="store_true",
+        default=False,
+        help="Batch mode: replace output files that already exist instead of skipping them.",
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        dest="compress",
+        action="store_true",
+        default=False,
+        help="Batch mode: write gzip-compressed output files (.json.gz), which filebeat reads natively.",
+    )
+    sof_elk_stats.add_arguments(parser)
     args = parser.parse_args()
+    sof_elk_stats.start(args, "volatility2sof-elk.py")
+
+    if os.path.isdir(args.input_filename):
+        if args.jobs < 0:
+            sys.stderr.write("ERROR: The number of jobs cannot be negative.\n")
+            sys.exit(2)
+        elif args.jobs == 0:
+            args.jobs = os.cpu_count() or 1
+
+        output_root = args.output_filename or default_destdir
+        if output_root == "-":
+            sys.stderr.write("ERROR: Batch mode cannot write to stdout.\n")
+            sys.exit(2)
+
+        converted = process_batch(
+            args.input_filename,
+            output_root,
+            args.encoding,
+            args.jobs,
+            args.overwrite,
+            args.compress,
+        )
+        sys.exit(0 if converted > 0 else 2)
+
+    if args.output_filename is None:
+        parser.error("the following arguments are required: -w/--write")
 
     sys.exit(
         0